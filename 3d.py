@@ -1,145 +1,157 @@
+import argparse
+
 import cv2
 import numpy as np
-import pyrealsense2 as rs
 from ultralytics import YOLO
-import open3d as o3d
+
+from annotate import Annotator, SplitCanvas
+from cloud_viewer import CloudViewer
+from depth_filters import DepthFilterChain, add_depth_filter_args
+from depth_sampling import deproject_pixels, sample_box_depths
+from detection_log import add_log_args, recorder_from_args
+from detections import from_result
+from frame_pipeline import Pipeline
+from frame_sources import add_source_args, colorize_depth, source_from_args
+from metrics import METRICS, Instrumentation, add_metrics_args
+from point_cloud import PointCloudBuilder
+from roi import add_roi_args, roi_from_args
+from tracker import Tracker
+
+# -----------------------------
+# Command line: frame source (RealSense by default) and display
+# -----------------------------
+parser = add_source_args(argparse.ArgumentParser(description="YOLO + RealSense 3D point cloud"))
+parser.add_argument("--headless", action="store_true",
+                    help="No windows and no point cloud, detection only (deployment/benchmarking)")
+parser.add_argument("--viewer-fps", type=float, default=30.0, help="Refresh rate of the 3D viewer process")
+parser.add_argument("--cloud-step", type=int, default=2, help="Use every Nth depth pixel for the point cloud")
+parser.add_argument("--voxel", type=float, default=0.0, help="Voxel grid size in meters (0 = off)")
+parser.add_argument("--roi", action="store_true", help="Only show points around detected fruit")
+add_depth_filter_args(parser)
+add_roi_args(parser)
+add_metrics_args(parser)
+add_log_args(parser)
+args = parser.parse_args()
+instruments = Instrumentation.from_args(args)
+recorder = recorder_from_args(args)
 
 # -----------------------------
 # Load YOLO model
 # -----------------------------
 model = YOLO("best.pt")  # Replace with your YOLO weights
+roi = roi_from_args(args, model)  # --depth-roi: model only sees the working-volume regions
+annotator = Annotator(model.names, font_scale=0.5)
+canvas = SplitCanvas()
 
 # -----------------------------
-# Configure RealSense
+# Open the frame source (color + depth aligned to color)
 # -----------------------------
-pipeline = rs.pipeline()
-config = rs.config()
-config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-pipeline.start(config)
+source = source_from_args(args)
+depth_filters = DepthFilterChain.from_spec(args.depth_filters)
+try:
+    import pyrealsense2 as rs
+    colorizer = rs.colorizer()
+except ImportError:
+    colorizer = None
 
-colorizer = rs.colorizer()
-depth_intrin = None
+# -----------------------------
+# Open3D visualization: runs in its own process, fed through shared memory
+# -----------------------------
+cloud = PointCloudBuilder(step=args.cloud_step, voxel=args.voxel, roi=args.roi)
+viewer = None if args.headless else CloudViewer(fps=args.viewer_fps)
 
 # -----------------------------
-# Open3D visualization
+# Tracker: stable per-fruit IDs with per-track smoothing of the 3D position
 # -----------------------------
-pcd = o3d.geometry.PointCloud()
-vis = o3d.visualization.Visualizer()
-vis.create_window("3D Point Cloud", width=640, height=480)
-vis.add_geometry(pcd)
+tracker = Tracker(alpha=0.5, max_age=15)
 
-pc = rs.pointcloud()
+# -----------------------------
+# Capture: next aligned frame, depth post-processing + colorized depth
+# -----------------------------
+def capture():
+    frame = depth_filters.process(source.read())
+    if frame is None:
+        return None
+    with METRICS.timer("colorize"):
+        return frame, colorize_depth(frame, colorizer)
 
 # -----------------------------
-# Smooth coordinates storage
+# Inference: YOLO detection, 3D coordinates and point cloud
 # -----------------------------
-prev_coords = {}
+def infer(item):
+    frame, depth_colormap = item
+    color_image = frame.color
 
-def smooth_coords(label, coords, alpha=0.5):
-    if label in prev_coords:
-        new_coords = alpha * np.array(coords) + (1 - alpha) * np.array(prev_coords[label])
-        prev_coords[label] = new_coords
-        return new_coords
+    if roi is not None:
+        det = roi(color_image, frame.depth, frame.depth_scale)
     else:
-        prev_coords[label] = coords
-        return coords
+        det = from_result(model(color_image, verbose=False)[0])
+    xyxy = det.xyxy
+
+    # Robust depth and 3D position for every detection in one batched call
+    depths = np.zeros(len(xyxy), dtype=np.float32)
+    if frame.depth is not None:
+        with METRICS.timer("depth.lookup"):
+            depths = sample_box_depths(frame.depth, xyxy, frame.depth_scale, image_shape=color_image.shape).median
+    centers = ((xyxy[:, :2] + xyxy[:, 2:]) / 2).astype(int)
+    points_3d = deproject_pixels(frame.intrinsics, centers[:, 0], centers[:, 1], depths)
+    with METRICS.timer("track"):
+        tracks = tracker.update(xyxy, det.cls, points_3d)
+
+    # Persist detections with depth, smoothed 3D position and track id (written off the hot path)
+    if recorder is not None:
+        recorder.append(frame.index, frame.timestamp, det, depths, tracks.xyz, tracks.ids, names=model.names)
+
+    # Track id, depth and smoothed 3D position appended to each label
+    labels = [f"#{tid} {d:.2f}m ({X:.2f},{Y:.2f},{Z:.2f})"
+              for tid, d, (X, Y, Z) in zip(tracks.ids, depths, tracks.xyz)]
+
+    # Point cloud: valid pixels only, colors through the texture coordinates
+    vtx = colors = None
+    if viewer is not None:
+        with METRICS.timer("cloud"):
+            vtx, colors = cloud.build(frame, xyxy)
+
+    return item, color_image, det, labels, vtx, colors, tracks.xyz
 
 # -----------------------------
-# Average depth over bounding box
+# Render: boxes, 3D point cloud and split-screen RGB + Depth
 # -----------------------------
-def get_avg_depth(depth_frame, cx, cy, size=5):
-    x_min = max(cx - size//2, 0)
-    x_max = min(cx + size//2, depth_frame.get_width() - 1)
-    y_min = max(cy - size//2, 0)
-    y_max = min(cy + size//2, depth_frame.get_height() - 1)
-    
-    depth_values = []
-    for x in range(x_min, x_max+1):
-        for y in range(y_min, y_max+1):
-            d = depth_frame.get_distance(x, y)
-            if d > 0:  # valid depth
-                depth_values.append(d)
-    if len(depth_values) == 0:
-        return 0
-    return float(np.mean(depth_values))
+def render(result):
+    item, color_image, det, labels, vtx, colors, fruit_xyz = result
+    if args.headless:
+        return True  # no annotation or display work
+
+    # Non-blocking: copies into shared memory, the viewer redraws at its own rate
+    with METRICS.timer("viewer.publish"):
+        viewer.publish(vtx, colors, fruit_xyz, det.cls)
+
+    # Boxes and 3D coordinates drawn onto the left half of a reused canvas
+    with METRICS.timer("draw"):
+        combined = canvas.compose(color_image, item[1])
+        annotator.boxes(canvas.left, det, labels)
+        instruments.overlay(combined)
+
+    with METRICS.timer("imshow"):
+        cv2.imshow("YOLO + RealSense 3D (RGB | Depth)", combined)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
 
 # -----------------------------
-# Main loop
+# Main loop: capture, inference and display run concurrently
 # -----------------------------
+stream = Pipeline(*instruments.wrap(capture, infer, render), report_every=5.0, drop_frames=not args.fast)
 try:
-    while True:
-        frames = pipeline.wait_for_frames()
-        depth_frame = frames.get_depth_frame()
-        color_frame = frames.get_color_frame()
-        if not depth_frame or not color_frame:
-            continue
-
-        if depth_intrin is None:
-            depth_intrin = depth_frame.profile.as_video_stream_profile().intrinsics
-
-        # Convert frames to numpy arrays
-        color_image = np.asanyarray(color_frame.get_data())
-        depth_colormap = np.asanyarray(colorizer.colorize(depth_frame).get_data())
-
-        # -----------------------------
-        # YOLO detection
-        # -----------------------------
-        results = model(color_image, verbose=False)
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-                cls = int(box.cls[0])
-                label = model.names[cls]
-                conf = float(box.conf[0])
-
-                cx = int((x1 + x2) / 2)
-                cy = int((y1 + y2) / 2)
-
-                # Fine-tuned depth
-                avg_depth = get_avg_depth(depth_frame, cx, cy, size=7)
-                X, Y, Z = rs.rs2_deproject_pixel_to_point(depth_intrin, [cx, cy], avg_depth)
-                X, Y, Z = smooth_coords(label, [X, Y, Z])
-
-                # Draw box and 3D coordinates
-                cv2.rectangle(color_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(color_image,
-                            f"{label} {conf:.2f} {avg_depth:.2f}m ({X:.2f},{Y:.2f},{Z:.2f})",
-                            (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                            (0, 255, 0), 2)
-
-        # -----------------------------
-        # Update 3D point cloud
-        # -----------------------------
-        points = pc.calculate(depth_frame)
-        pc.map_to(color_frame)
-
-        vertices = np.asanyarray(points.get_vertices())
-        if len(vertices) > 0:
-            vtx = np.stack([vertices['f0'], vertices['f1'], vertices['f2']], axis=-1).astype(np.float32)
-            vtx = vtx[::5]  # optional downsample
-
-            color_image_flat = np.asanyarray(color_frame.get_data())
-            colors = (color_image_flat.reshape(-1,3)/255.0).astype(np.float32)
-
-            pcd.points = o3d.utility.Vector3dVector(vtx)
-            pcd.colors = o3d.utility.Vector3dVector(colors)
-            vis.update_geometry(pcd)
-            vis.poll_events()
-            vis.update_renderer()
-
-        # -----------------------------
-        # Split-screen RGB + Depth
-        # -----------------------------
-        combined = np.hstack((color_image, depth_colormap))
-        cv2.imshow("YOLO + RealSense 3D (RGB | Depth)", combined)
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
+    stream.run()
 finally:
-    pipeline.stop()
-    cv2.destroyAllWindows()
-    vis.destroy_window()
+    source.close()
+    if not args.headless:
+        cv2.destroyAllWindows()
+        viewer.close()
+    stream.report()
+    depth_filters.report()
+    if roi is not None:
+        roi.report()
+    METRICS.report()
+    instruments.close()
+    if recorder is not None:
+        recorder.close()
@@ -0,0 +1,252 @@
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from detections import Detections, class_color
+
+
+# -----------------------------
+# Fast annotation: one mask composite, cached label sprites, reused canvas
+# -----------------------------
+class Annotator:
+    """Draws masks, boxes and labels for a Detections tuple in place.
+
+    All masks are filled into one overlay (one fillPoly call per class)
+    and blended in a single pass restricted to the detections' bounding
+    region. The "<class> <conf>" part of a label is rendered once per class
+    and confidence bucket (0.05) and pasted; per-frame suffixes (depth,
+    XYZ, track id) are drawn next to it with one putText, so they never
+    churn the cache. enabled=False turns every call into a no-op for
+    headless runs.
+    """
+
+    def __init__(self, names, alpha=0.4, font_scale=0.6, thickness=2, enabled=True, cache_size=512):
+        self.names = names
+        self.alpha = alpha
+        self.font_scale = font_scale
+        self.thickness = thickness
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self._sprites = OrderedDict()
+        # Hershey text height does not depend on the string, so every patch lines up
+        self._text_h = cv2.getTextSize("0", cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)[0][1]
+
+    def masks(self, img, det):
+        if not self.enabled or det.polygons is None or not len(det.polygons):
+            return img
+        h, w = img.shape[:2]
+        x0, y0 = np.maximum(np.floor(det.xyxy[:, :2].min(axis=0)).astype(int), 0)
+        x1, y1 = np.minimum(np.ceil(det.xyxy[:, 2:].max(axis=0)).astype(int) + 1, (w, h))
+        if x1 <= x0 or y1 <= y0:
+            return img
+        roi = img[y0:y1, x0:x1]
+        # Pixels outside every mask blend with themselves, so no mask or lookup is needed
+        overlay = roi.copy()
+        offset = np.array([x0, y0], dtype=np.float32)
+        cls = np.asarray(det.cls)
+        for c in np.unique(cls):
+            polys = [(det.polygons[i] - offset).astype(np.int32) for i in np.flatnonzero(cls == c)
+                     if len(det.polygons[i]) >= 3]
+            if polys:
+                cv2.fillPoly(overlay, polys, class_color(c))
+        cv2.addWeighted(overlay, self.alpha, roi, 1 - self.alpha, 0, dst=roi)
+        return img
+
+    def _render(self, text, color, pad):
+        (tw, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, self.thickness)
+        sprite = np.empty((self._text_h + 8, tw + pad, 3), dtype=np.uint8)
+        sprite[:] = color
+        cv2.putText(sprite, text, (pad // 2, self._text_h + 4), cv2.FONT_HERSHEY_SIMPLEX, self.font_scale,
+                    (255, 255, 255), self.thickness)
+        return sprite
+
+    def _sprite(self, cls, conf, color):
+        # "<class> <conf>" patch, one per class and 0.05 confidence bucket
+        bucket = round(conf * 20)
+        key = (cls, bucket, color)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+        sprite = self._render(f"{self.names[cls]} {bucket / 20:.2f}", color, 4)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.cache_size:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def _paste(self, img, sprite, left, top):
+        # Clipped to the image; returns the x just right of the patch
+        sh, sw = sprite.shape[:2]
+        h, w = img.shape[:2]
+        sy0, sx0 = max(0, -top), max(0, -left)
+        dy0, dx0 = max(top, 0), max(left, 0)
+        dy1, dx1 = min(top + sh, h), min(left + sw, w)
+        if dy1 > dy0 and dx1 > dx0:
+            img[dy0:dy1, dx0:dx1] = sprite[sy0:sy0 + dy1 - dy0, sx0:sx0 + dx1 - dx0]
+        return left + sw
+
+    def label(self, img, x, y, cls, conf, color, suffix=None):
+        # Label with its bottom-left corner at (x, y): cached class/confidence patch, then the suffix
+        sprite = self._sprite(cls, conf, color)
+        top = y - sprite.shape[0]
+        x = self._paste(img, sprite, x, top)
+        if suffix:
+            # Changes every frame, so drawn directly instead of growing the cache
+            (tw, _), _ = cv2.getTextSize(suffix, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, self.thickness)
+            cv2.rectangle(img, (x, top), (x + tw + 4, y - 1), color, -1)
+            cv2.putText(img, suffix, (x, y - 4), cv2.FONT_HERSHEY_SIMPLEX, self.font_scale,
+                        (255, 255, 255), self.thickness)
+
+    def boxes(self, img, det, extra=None):
+        # extra: optional per-detection strings appended to the label (depth, size, track id)
+        if not self.enabled:
+            return img
+        # Plain Python ints/floats up front: per-element numpy access dominates with many fruit
+        boxes = det.xyxy.astype(int).tolist()
+        for i, (cls, conf) in enumerate(zip(np.asarray(det.cls).tolist(), np.asarray(det.conf).tolist())):
+            x1, y1, x2, y2 = boxes[i]
+            color = class_color(cls)
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, self.thickness)
+            self.label(img, x1, y1, cls, conf, color, extra[i] if extra is not None else None)
+        return img
+
+    def draw(self, img, det, extra=None):
+        self.masks(img, det)
+        return self.boxes(img, det, extra)
+
+
+class DrawCanvas:
+    """Something to draw a frame's annotations on.
+
+    Writable frames are returned as they are. Read-only ones (zero-copy
+    views into frame_ring's shared memory, which other consumers read too)
+    are first copied into a buffer that is reused from frame to frame.
+    """
+
+    def __init__(self):
+        self.buffer = None
+
+    def __call__(self, img):
+        if img.flags.writeable:
+            return img
+        if self.buffer is None or self.buffer.shape != img.shape:
+            self.buffer = np.empty_like(img)
+        np.copyto(self.buffer, img)
+        return self.buffer
+
+
+class SplitCanvas:
+    """Preallocated side-by-side canvas (left | right) reused every frame instead of np.hstack."""
+
+    def __init__(self):
+        self.canvas = None
+        self.left = self.right = None
+
+    def _ensure(self, shape):
+        h, w = shape[:2]
+        if self.canvas is None or self.canvas.shape[:2] != (h, 2 * w):
+            self.canvas = np.zeros((h, 2 * w, 3), dtype=np.uint8)
+            self.left = self.canvas[:, :w]
+            self.right = self.canvas[:, w:]
+
+    def compose(self, left, right):
+        # Copies both halves in; annotate self.left afterwards to draw straight onto the canvas
+        self._ensure(left.shape)
+        np.copyto(self.left, left)
+        if right.shape == self.right.shape:
+            np.copyto(self.right, right)
+        else:
+            cv2.resize(right, (self.right.shape[1], self.right.shape[0]), dst=self.right)
+        return self.canvas
+
+
+# -----------------------------
+# Benchmark: r.plot() / per-box cv2 drawing + np.hstack vs Annotator + SplitCanvas
+# -----------------------------
+def _synthetic_detections(n, width=640, height=480, seed=0):
+    rng = np.random.default_rng(seed)
+    cx, cy = rng.uniform(40, width - 40, n), rng.uniform(40, height - 40, n)
+    r = rng.uniform(15, 40, n)
+    t = np.linspace(0, 2 * np.pi, 48, endpoint=False)
+    polygons = [np.stack([x + rr * np.cos(t), y + rr * np.sin(t)], axis=1).astype(np.float32)
+                for x, y, rr in zip(cx, cy, r)]
+    xyxy = np.stack([cx - r, cy - r, cx + r, cy + r], axis=1).astype(np.float32)
+    return Detections(xyxy, rng.uniform(0.3, 1.0, n).astype(np.float32), rng.integers(0, 5, n), polygons)
+
+
+def _legacy_render(img, depth_colormap, det, names, extra):
+    # Previous realsense_split_yolo.py path without ultralytics: mask overlay, draw_box loop, hstack
+    from detections import draw_masks
+    annotated = draw_masks(img.copy(), det)
+    for i in range(len(det.xyxy)):
+        x1, y1, x2, y2 = det.xyxy[i].astype(int)
+        text = f"{names[int(det.cls[i])]} {det.conf[i]:.2f} {extra[i]}"
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        (w, h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(annotated, (x1, y1 - h - 8), (x1 + w + 4, y1), (0, 255, 0), -1)
+        cv2.putText(annotated, text, (x1 + 2, y1 - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return np.hstack((annotated, depth_colormap))
+
+
+def _plot_render(img, depth_colormap, det, names):
+    # r.plot() on an ultralytics Results built from the same detections (needs ultralytics + torch)
+    try:
+        import torch
+        from ultralytics.engine.results import Results
+    except ImportError:
+        return None
+    h, w = img.shape[:2]
+    masks = np.zeros((len(det.xyxy), h, w), dtype=np.uint8)
+    for m, poly in zip(masks, det.polygons):
+        cv2.fillPoly(m, [poly.astype(np.int32)], 1)
+    boxes = torch.from_numpy(np.concatenate([det.xyxy, det.conf[:, None], det.cls[:, None]], axis=1))
+    r = Results(img, path="", names=names, boxes=boxes, masks=torch.from_numpy(masks).float())
+    return lambda: np.hstack((r.plot(), depth_colormap))
+
+
+def benchmark(counts=(5, 20, 50), repeats=100):
+    names = {0: "Apple", 1: "Banana", 2: "Orange", 3: "Avocado", 4: "Strawberry"}
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    depth_colormap = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    annotator = Annotator(names)
+    canvas = SplitCanvas()
+
+    def timed(fn):
+        fn(0)
+        t0 = time.perf_counter()
+        for k in range(repeats):
+            fn(k)
+        return (time.perf_counter() - t0) * 1000 / repeats
+
+    # Labels change every frame like the live scripts' (depth, or track id + depth + XYZ in 3d.py)
+    print(f"{'fruit':>6} {'labels':>7} {'r.plot ms':>10} {'legacy ms':>10} {'annotator ms':>13} {'speedup':>8}")
+    for n in counts:
+        det = _synthetic_detections(n)
+        depths = rng.uniform(0.4, 1.2, (repeats, n))
+        xyz = rng.uniform(-0.5, 1.2, (repeats, n, 3))
+        styles = {
+            "depth": [[f"{d:.2f}m" for d in row] for row in depths],
+            "3d": [[f"#{i} {d:.2f}m ({x:.2f},{y:.2f},{z:.2f})" for i, (d, (x, y, z)) in enumerate(zip(dr, xr))]
+                   for dr, xr in zip(depths, xyz)],
+        }
+        plot = _plot_render(img, depth_colormap, det, names)
+        plot_ms = timed(lambda k: plot()) if plot else float("nan")
+        for style, extras in styles.items():
+            def fast(k):
+                out = canvas.compose(img, depth_colormap)
+                annotator.draw(canvas.left, det, extras[k])
+                return out
+
+            legacy_ms = timed(lambda k: _legacy_render(img, depth_colormap, det, names, extras[k]))
+            fast_ms = timed(fast)
+            base = plot_ms if plot else legacy_ms
+            print(f"{n:>6} {style:>7} {plot_ms:>10.2f} {legacy_ms:>10.2f} {fast_ms:>13.2f} {base / fast_ms:>7.1f}x")
+    if _plot_render(img, depth_colormap, _synthetic_detections(1), names) is None:
+        print("(r.plot() column needs ultralytics + torch; speedup is against the legacy cv2 path)")
+
+
+if __name__ == "__main__":
+    benchmark()
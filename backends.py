@@ -0,0 +1,295 @@
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+YOLO_MODEL_PATH = "best.pt"
+FAKE_PREFIX = "fake:"  # weights "fake:MS,PER_IMG_MS[,FRUIT]" -> SimulatedModel
+BACKENDS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+# -----------------------------
+# Where each backend's exported model lives next to best.pt
+# -----------------------------
+def exported_path(weights, backend):
+    stem = os.path.splitext(weights)[0]
+    return {
+        "torch": weights,
+        "onnx": stem + ".onnx",
+        "onnx-int8": stem + "_int8.onnx",
+        "openvino": stem + "_openvino_model",
+        "openvino-int8": stem + "_int8_openvino_model",
+    }[backend]
+
+
+def _calibration_images(calib_dir, limit=300):
+    paths = sorted(p for p in glob.glob(os.path.join(calib_dir, "**", "*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise FileNotFoundError(f"No calibration images in {calib_dir}")
+    return paths[:limit]
+
+
+def _letterbox(img, size):
+    # Same preprocessing as ultralytics for a fixed square input: resize, pad 114, RGB, CHW, 0-1
+    h, w = img.shape[:2]
+    gain = min(size / h, size / w)
+    nh, nw = int(round(h * gain)), int(round(w * gain))
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    canvas[top:top + nh, left:left + nw] = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return canvas[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def _quantize_onnx(fp32_path, int8_path, calib_dir, imgsz):
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class FolderReader(CalibrationDataReader):
+        def __init__(self, paths, input_name):
+            self.paths = iter(paths)
+            self.input_name = input_name
+
+        def get_next(self):
+            for path in self.paths:
+                img = cv2.imread(path)
+                if img is not None:
+                    return {self.input_name: _letterbox(img, imgsz)}
+            return None
+
+    fp32 = onnx.load(fp32_path)
+    reader = FolderReader(_calibration_images(calib_dir), fp32.graph.input[0].name)
+    quantize_static(fp32_path, int8_path, reader, quant_format=QuantFormat.QDQ,
+                    per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    # Keep the ultralytics metadata (names, stride, task, imgsz) so YOLO() can load the result
+    int8 = onnx.load(int8_path)
+    del int8.metadata_props[:]
+    int8.metadata_props.extend(fp32.metadata_props)
+    onnx.save(int8, int8_path)
+
+
+def export(weights=YOLO_MODEL_PATH, backend="onnx", calib_dir=None, imgsz=640):
+    from ultralytics import YOLO
+
+    target = exported_path(weights, backend)
+    if backend == "torch":
+        return target
+    if backend.endswith("int8") and not calib_dir:
+        raise ValueError(f"{backend} needs a calibration image folder (--calib)")
+
+    model = YOLO(weights)
+    if backend == "onnx":
+        out = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    elif backend == "onnx-int8":
+        fp32 = exported_path(weights, "onnx")
+        if not os.path.exists(fp32):
+            export(weights, "onnx", imgsz=imgsz)
+        _quantize_onnx(fp32, target, calib_dir, imgsz)
+        out = target
+    elif backend == "openvino":
+        out = model.export(format="openvino", imgsz=imgsz, dynamic=True)
+    else:
+        # ultralytics runs NNCF post-training quantization over the dataset in a data yaml;
+        # point both splits at the calibration folder (labels are not needed for calibration)
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            folder = os.path.abspath(calib_dir)
+            f.write(f"path: {folder}\ntrain: {folder}\nval: {folder}\nnames:\n")
+            for k, v in model.names.items():
+                f.write(f"  {k}: {v}\n")
+            data_yaml = f.name
+        try:
+            out = model.export(format="openvino", imgsz=imgsz, int8=True, data=data_yaml)
+        finally:
+            os.remove(data_yaml)
+
+    # ultralytics names int8 OpenVINO exports <stem>_int8_openvino_model already; normalize anyway
+    if os.path.abspath(str(out)) != os.path.abspath(target) and not os.path.exists(target):
+        os.rename(str(out), target)
+    return target
+
+
+# -----------------------------
+# Load any backend behind the same ultralytics YOLO interface
+# -----------------------------
+def load_model(weights=YOLO_MODEL_PATH, backend="torch", calib_dir=None, imgsz=640):
+    if str(weights).startswith(FAKE_PREFIX):
+        return SimulatedModel.from_spec(weights[len(FAKE_PREFIX):])
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "torch":
+        return YOLO(weights)
+    path = exported_path(weights, backend)
+    if not os.path.exists(path):
+        print(f"Exporting {weights} to {backend} ({path}) ...")
+        export(weights, backend, calib_dir, imgsz)
+    # Results, r.masks, r.plot() etc. behave exactly as with the PyTorch model
+    return YOLO(path, task="segment")
+
+
+def add_backend_args(parser):
+    parser.add_argument("--backend", default="torch", choices=BACKENDS,
+                        help="Inference backend (exported next to the weights on first use)")
+    parser.add_argument("--calib", help="Calibration image folder for the int8 backends")
+    parser.add_argument("--fake-model", metavar="MS,PER_IMG_MS[,FRUIT]",
+                        help="Benchmark with a simulated model of this cost instead of the weights (see SimulatedModel)")
+    return parser
+
+
+def weights_from_args(args, weights=YOLO_MODEL_PATH):
+    # The weights to load, or the simulated model's spec when --fake-model is given
+    return FAKE_PREFIX + args.fake_model if getattr(args, "fake_model", None) else weights
+
+
+# -----------------------------
+# Simulated model: pipeline/batching/cache benchmarks without weights, ultralytics or a GPU
+# -----------------------------
+class _Array(np.ndarray):
+    # Just enough of torch.Tensor for detections.from_result
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.asarray(self)
+
+
+class _Boxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy, self.conf, self.cls = (np.asarray(a).view(_Array) for a in (xyxy, conf, cls))
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class _Masks:
+    def __init__(self, data, xy):
+        self.data = data
+        self.xy = xy
+
+
+class _Results:
+    def __init__(self, image, names, boxes, masks, speed):
+        self.orig_img = image
+        self.orig_shape = image.shape[:2]
+        self.names = names
+        self.boxes = boxes
+        self.masks = masks
+        self.speed = speed
+
+
+class SimulatedModel:
+    """Stand-in for a YOLO model with a known cost and fixed detections.
+
+    A call sleeps ms plus per_image_ms for every image, scaled by its
+    letterboxed area relative to 640x640 (so ROI canvases and small tiles
+    are cheaper, as on the real model), then returns `fruit` boxes with
+    rectangular masks on a grid. Sleeping releases the GIL like a GPU or
+    OpenVINO forward pass. Only timings mean anything: the detections do not
+    depend on the image, so recall/precision benchmarks need the real
+    weights. Load it with load_model("fake:20,4") or --fake-model 20,4.
+    """
+
+    names = {0: "Apple", 1: "Banana", 2: "Orange", 3: "Avocado", 4: "Strawberry"}
+
+    def __init__(self, ms=20.0, per_image_ms=4.0, fruit=6):
+        self.ms = ms
+        self.per_image_ms = per_image_ms
+        self.fruit = int(fruit)
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(*(float(v) for v in spec.split(",") if v))
+
+    def _result(self, image, imgsz):
+        h, w = image.shape[:2]
+        th, tw = (imgsz, imgsz) if np.isscalar(imgsz) else imgsz
+        gain = min(th / h, tw / w)
+        nh, nw = int(np.ceil(h * gain / 32) * 32), int(np.ceil(w * gain / 32) * 32)
+        # Boxes on a grid, about a tenth of the shorter side each
+        cols = max(int(np.ceil(np.sqrt(self.fruit))), 1)
+        size = min(h, w) / 10
+        i = np.arange(self.fruit)
+        cx = (i % cols + 0.5) * w / cols
+        cy = (i // cols + 0.5) * h / max(int(np.ceil(self.fruit / cols)), 1)
+        xyxy = np.stack([cx - size / 2, cy - size / 2, cx + size / 2, cy + size / 2], axis=1).astype(np.float32)
+        polygons = [np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], np.float32) for x0, y0, x1, y1 in xyxy]
+        # Masks at a quarter of the letterboxed input, like YOLO-seg's prototype resolution
+        mh, mw = nh // 4, nw // 4
+        g = min(mh / h, mw / w)
+        px, py = (mw - w * g) / 2, (mh - h * g) / 2
+        data = np.zeros((self.fruit, mh, mw), np.float32)
+        for k, (x0, y0, x1, y1) in enumerate(xyxy):
+            data[k, int(y0 * g + py):int(np.ceil(y1 * g + py)), int(x0 * g + px):int(np.ceil(x1 * g + px))] = 1.0
+        boxes = _Boxes(xyxy, np.linspace(0.95, 0.5, self.fruit, dtype=np.float32), i % len(self.names))
+        return _Results(image, self.names, boxes, _Masks(data.view(_Array), polygons), {}), nh * nw / (640 * 640)
+
+    def __call__(self, source, imgsz=640, verbose=False, **params):
+        t0 = time.perf_counter()
+        images = [source] if isinstance(source, np.ndarray) else list(source)
+        results, areas = zip(*(self._result(img, imgsz) for img in images)) if images else ((), ())
+        cost = (self.ms + self.per_image_ms * sum(areas)) / 1000.0
+        time.sleep(max(cost - (time.perf_counter() - t0), 0.0))
+        for r in results:
+            r.speed = {"preprocess": 0.0, "inference": cost * 1000 / len(results), "postprocess": 0.0}
+        return list(results)
+
+
+# -----------------------------
+# Benchmark: latency and mAP drift against PyTorch
+# -----------------------------
+def benchmark(data_yaml, backends=BACKENDS, weights=YOLO_MODEL_PATH, calib_dir=None, imgsz=640, images=50):
+    import yaml
+
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    val = data["val"] if os.path.isabs(data["val"]) else os.path.join(data.get("path", ""), data["val"])
+    val_images = _calibration_images(val, limit=images)
+    frames = [cv2.imread(p) for p in val_images]
+
+    rows = []
+    for backend in backends:
+        model = load_model(weights, backend, calib_dir, imgsz)
+        model(frames[0], imgsz=imgsz, verbose=False)  # warm-up
+        lat = []
+        for img in frames:
+            t0 = time.perf_counter()
+            model(img, imgsz=imgsz, verbose=False)
+            lat.append((time.perf_counter() - t0) * 1000)
+        metrics = model.val(data=data_yaml, imgsz=imgsz, batch=1, device="cpu", verbose=False, plots=False)
+        rows.append((backend, np.mean(lat), np.percentile(lat, 95), metrics.box.map, metrics.seg.map))
+
+    base = rows[0]
+    print(f"{'backend':<15} {'mean ms':>8} {'p95 ms':>8} {'box mAP':>8} {'mask mAP':>9} {'drift box/mask':>16}")
+    for backend, mean, p95, box_map, seg_map in rows:
+        print(f"{backend:<15} {mean:>8.1f} {p95:>8.1f} {box_map:>8.4f} {seg_map:>9.4f} "
+              f"{box_map - base[3]:>+8.4f}/{seg_map - base[4]:+.4f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export best.pt for CPU inference and compare backends")
+    parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    parser.add_argument("--export", nargs="*", choices=BACKENDS, help="Backends to export")
+    parser.add_argument("--bench", metavar="DATA_YAML", help="Validation data.yaml for latency + mAP drift")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--calib", help="Calibration image folder for the int8 backends")
+    parser.add_argument("--imgsz", type=int, default=640)
+    args = parser.parse_args()
+
+    for backend in args.export or []:
+        print(backend, "->", export(args.weights, backend, args.calib, args.imgsz))
+    if args.bench:
+        backends = [b for b in args.backends if args.calib or not b.endswith("int8")]
+        if "torch" in backends:
+            backends.remove("torch")
+        benchmark(args.bench, ["torch"] + backends, args.weights, args.calib, args.imgsz)
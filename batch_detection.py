@@ -0,0 +1,291 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from backends import add_backend_args, weights_from_args
+from detections import draw_detections, from_result, to_dicts
+from image_detection import YOLO_MODEL_PATH, get_model
+from metrics import METRICS, MetricsExporter
+from result_cache import add_cache_args, cache_from_args, cache_key, read_with_digest
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+CSV_FIELDS = ["path", "width", "height", "cls", "label", "conf", "x1", "y1", "x2", "y2", "polygon"]
+
+
+# -----------------------------
+# Input: folder, glob, list file or explicit paths
+# -----------------------------
+def collect_paths(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths += sorted(p for p in glob.glob(os.path.join(item, "**", "*"), recursive=True)
+                            if p.lower().endswith(IMAGE_EXTENSIONS))
+        elif item.endswith(".txt") and os.path.isfile(item):
+            with open(item) as f:
+                paths += [line.strip() for line in f if line.strip()]
+        elif any(ch in item for ch in "*?["):
+            paths += sorted(glob.glob(item, recursive=True))
+        else:
+            paths.append(item)
+    return paths
+
+
+# -----------------------------
+# Output writers (flushed after every batch so a crash loses at most one batch)
+# -----------------------------
+def drop_partial_line(path):
+    # A crash can leave half a record at the end; cut back to the last newline before appending
+    with open(path, "rb+") as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(pos, 1 << 16)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                f.truncate(pos - step + i + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+
+def open_output(path, append, newline=None):
+    # append=False (--no-resume) starts the file over instead of adding a second record per image
+    if append and os.path.exists(path):
+        drop_partial_line(path)
+    return open(path, "a" if append else "w", newline=newline)
+
+
+class JsonlWriter:
+    def __init__(self, path, append=True):
+        self.f = open_output(path, append)
+
+    @staticmethod
+    def done_paths(path):
+        done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["path"])
+                    except (ValueError, KeyError):
+                        pass  # partially written last line
+        return done
+
+    def write(self, path, shape, dets=None, error=None):
+        record = {"path": path}
+        if error:
+            record["error"] = error
+        else:
+            record.update(width=shape[1], height=shape[0], detections=dets)
+        self.f.write(json.dumps(record) + "\n")
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class CsvWriter:
+    # One row per detection; images without detections get a single row with empty fields
+    def __init__(self, path, append=True):
+        self.f = open_output(path, append, newline="")
+        self.writer = csv.DictWriter(self.f, fieldnames=CSV_FIELDS)
+        if self.f.tell() == 0:
+            self.writer.writeheader()
+
+    @staticmethod
+    def done_paths(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, newline="") as f:
+            return {row["path"] for row in csv.DictReader(f) if row.get("path")}
+
+    def write(self, path, shape, dets=None, error=None):
+        if error or not dets:
+            self.writer.writerow({"path": path, "width": shape[1] if shape else "", "height": shape[0] if shape else "",
+                                  "label": error or ""})
+            return
+        for d in dets:
+            x1, y1, x2, y2 = d["box"]
+            polygon = " ".join(f"{x},{y}" for x, y in d.get("polygon", []))
+            self.writer.writerow({"path": path, "width": shape[1], "height": shape[0], "cls": d["cls"],
+                                  "label": d["label"], "conf": d["conf"], "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+                                  "polygon": polygon})
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+# -----------------------------
+# Parallel decode feeding fixed-size batches
+# -----------------------------
+def iter_batches(paths, batch_size, pool, prefetch=2, load=cv2.imread):
+    # Keeps `prefetch` batches of decodes in flight while the model works on the current one
+    pending = deque()
+    it = iter(paths)
+    for path in it:
+        pending.append((path, pool.submit(load, path)))
+        if len(pending) >= batch_size * prefetch:
+            break
+    batch = []
+    while pending:
+        path, future = pending.popleft()
+        nxt = next(it, None)
+        if nxt is not None:
+            pending.append((nxt, pool.submit(load, nxt)))
+        batch.append((path, future.result()))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _save_annotated(img, det, names, out_path):
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    if not cv2.imwrite(out_path, draw_detections(img, det, names)):
+        raise OSError(f"could not write {out_path}")
+
+
+def _annotated_path(annotate_dir, root, path):
+    # Mirror the input's folder layout so crates/a/1.jpg and crates/b/1.jpg don't overwrite each other
+    return os.path.join(annotate_dir, os.path.relpath(os.path.abspath(path), root))
+
+
+def _check_saves(saves, wait=False):
+    # Reports failed annotated-image writes; returns the saves still running and the number that failed
+    pending, failed = [], 0
+    for p, future in saves:
+        if not wait and not future.done():
+            pending.append((p, future))
+            continue
+        exc = future.exception()
+        if exc is not None:
+            failed += 1
+            print(f"Could not save annotated {p}: {exc}")
+    return pending, failed
+
+
+def run_batch(inputs, output="detections.jsonl", batch_size=8, workers=4, annotate_dir=None,
+              resume=True, weights=YOLO_MODEL_PATH, backend="torch", calib_dir=None, cache=None, **params):
+    paths = collect_paths(inputs)
+    writer_cls = CsvWriter if output.endswith(".csv") else JsonlWriter
+    if annotate_dir:
+        os.makedirs(annotate_dir, exist_ok=True)
+        # From every input, not just what is left after resume, so annotated paths are the same across runs
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else ""
+    if resume:
+        done = writer_cls.done_paths(output)
+        paths = [p for p in paths if p not in done]
+
+    model = None
+    if cache is None:
+        model = get_model(weights, backend, calib_dir)
+        load = cv2.imread
+    else:
+        # The model is only loaded once some image misses the cache
+        load = read_with_digest
+    writer = writer_cls(output, append=resume)
+    saves = []
+    n_images = n_dets = n_cached = n_save_errors = 0
+    infer_s = 0.0
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        try:
+            for batch in iter_batches(paths, batch_size, pool, load=load):
+                good, done = [], []
+                for p, item in batch:
+                    key, img = (None, item) if cache is None else item
+                    if img is None:
+                        writer.write(p, None, error="unreadable")
+                        continue
+                    if key is not None:
+                        key = cache_key(key, weights, backend, **params)
+                        hit = cache.get(key)
+                        if hit is not None:
+                            done.append((p, img, hit[0], hit[1]))
+                            continue
+                    good.append((p, img, key))
+
+                if good:
+                    if model is None:
+                        model = get_model(weights, backend, calib_dir)
+                    t0 = time.perf_counter()
+                    results = model([img for _, img, _ in good], verbose=False, **params)
+                    dt = time.perf_counter() - t0
+                    infer_s += dt
+                    METRICS.observe("batch.forward", dt)
+                    for (p, img, key), r in zip(good, results):
+                        det = from_result(r)
+                        if key is not None:
+                            cache.put(key, det, model.names, img.shape)
+                        done.append((p, img, det, model.names))
+                n_cached += len(done) - len(good)
+
+                for p, img, det, names in done:
+                    writer.write(p, img.shape, to_dicts(det, names))
+                    n_dets += len(det.xyxy)
+                    if annotate_dir:
+                        out_path = _annotated_path(annotate_dir, root, p)
+                        saves.append((p, pool.submit(_save_annotated, img, det, names, out_path)))
+                writer.flush()
+                n_images += len(batch)
+                saves, failed = _check_saves(saves)
+                n_save_errors += failed
+        finally:
+            writer.close()
+            n_save_errors += _check_saves(saves, wait=True)[1]
+
+    elapsed = time.perf_counter() - t_start
+    stats = {"images": n_images, "detections": n_dets, "seconds": elapsed,
+             "images_per_s": n_images / elapsed if elapsed else 0.0,
+             "infer_ms_per_image": infer_s * 1000 / max(n_images - n_cached, 1), "cached": n_cached,
+             "annotate_errors": n_save_errors}
+    METRICS.gauge("batch.images_per_s", stats["images_per_s"])
+    METRICS.gauge("batch.images", n_images)
+    print(f"{n_images} images, {n_dets} detections in {elapsed:.1f}s "
+          f"({stats['images_per_s']:.1f} img/s, inference {stats['infer_ms_per_image']:.1f} ms/img, "
+          f"{n_cached} from cache)")
+    if n_save_errors:
+        print(f"{n_save_errors} annotated images could not be saved")
+    if cache is not None:
+        cache.report()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless batch detection over folders, globs or file lists")
+    parser.add_argument("inputs", nargs="+", help="Folders, glob patterns, .txt lists or image files")
+    parser.add_argument("-o", "--output", default="detections.jsonl", help="Results file (.jsonl or .csv)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4, help="Decode/encode threads")
+    parser.add_argument("--annotate-dir", help="Also save annotated images here")
+    parser.add_argument("--no-resume", action="store_true", help="Reprocess images already in the output")
+    parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--metrics-out", help="Write timers and counters here on exit (.json or .prom)")
+    add_backend_args(parser)
+    add_cache_args(parser)
+    args = parser.parse_args()
+
+    exporter = MetricsExporter(path=args.metrics_out, every=60.0) if args.metrics_out else None
+    try:
+        run_batch(args.inputs, args.output, args.batch_size, args.workers, args.annotate_dir,
+                  resume=not args.no_resume, weights=weights_from_args(args, args.weights), backend=args.backend, calib_dir=args.calib,
+                  cache=cache_from_args(args), conf=args.conf, imgsz=args.imgsz)
+    finally:
+        if exporter is not None:
+            exporter.close()
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from frame_pipeline import StageStats
+
+
+# -----------------------------
+# Micro-batching: many callers, one forward pass per batch
+# -----------------------------
+class MicroBatcher:
+    """Collects images submitted from any thread into batches for the model.
+
+    A batch closes when it has max_batch images or when its oldest image has
+    waited max_wait_ms, whichever comes first; max_batch=1 is plain
+    per-frame inference. Several models (one per worker thread) can share
+    the queue. stats() shows where the time goes so the throughput/latency
+    trade-off can be tuned per deployment.
+    """
+
+    def __init__(self, models, max_batch=8, max_wait_ms=5.0, **params):
+        self.models = list(models) if isinstance(models, (list, tuple)) else [models]
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.params = params
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.forward = StageStats("forward", "batcher.forward")
+        self.waits = deque(maxlen=2000)
+        self.latencies = deque(maxlen=2000)
+        self.requests = 0
+        self._started = time.perf_counter()
+        self._threads = [threading.Thread(target=self._loop, args=(m,), name=f"batcher-{i}", daemon=True)
+                         for i, m in enumerate(self.models)]
+        for t in self._threads:
+            t.start()
+
+    @property
+    def names(self):
+        return self.models[0].names
+
+    def submit(self, image):
+        # Returns a Future resolving to this image's ultralytics Results
+        future = Future()
+        with self._cond:
+            if self._stop:
+                raise RuntimeError("batcher is closed")
+            self._pending.append((time.perf_counter(), image, future))
+            self._cond.notify_all()
+        return future
+
+    def infer(self, image, timeout=None):
+        return self.submit(image).result(timeout)
+
+    def _collect(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or self._stop)
+            if not self._pending:
+                return None
+            # Deadline counts from the oldest request, so time spent queued behind a busy model counts too
+            deadline = self._pending[0][0] + self.max_wait
+            while len(self._pending) < self.max_batch and not self._stop:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(self.max_batch, len(self._pending))
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _loop(self, model):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                results = model([image for _, image, _ in batch], verbose=False, **self.params)
+            except Exception as exc:
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                continue
+            t1 = time.perf_counter()
+            self.forward.add(t1 - t0)
+            with self._lock:
+                self.batch_sizes[len(batch)] += 1
+                self.requests += len(batch)
+                for t_sub, _, _ in batch:
+                    self.waits.append(t0 - t_sub)
+                    self.latencies.append(t1 - t_sub)
+            for (_, _, future), r in zip(batch, results):
+                future.set_result(r)
+
+    def stats(self):
+        with self._lock:
+            sizes = dict(sorted(self.batch_sizes.items()))
+            waits = np.array(self.waits or [0.0]) * 1000
+            lat = np.array(self.latencies or [0.0]) * 1000
+            requests = self.requests
+        batches = sum(sizes.values())
+        elapsed = time.perf_counter() - self._started
+        return {"max_batch": self.max_batch, "max_wait_ms": self.max_wait * 1000,
+                "requests": requests, "batches": batches,
+                "mean_batch": requests / batches if batches else 0.0, "batch_sizes": sizes,
+                "wait_ms": {"p50": float(np.percentile(waits, 50)), "p95": float(np.percentile(waits, 95))},
+                "forward_ms": self.forward.snapshot()["mean_ms"],
+                "latency_ms": {"p50": float(np.percentile(lat, 50)), "p95": float(np.percentile(lat, 95)),
+                               "p99": float(np.percentile(lat, 99))},
+                "images_per_s": requests / elapsed if elapsed else 0.0}
+
+    def report(self):
+        s = self.stats()
+        print(f"[batcher] max_batch={s['max_batch']} max_wait={s['max_wait_ms']:.1f}ms  "
+              f"mean batch {s['mean_batch']:.2f}  wait p95 {s['wait_ms']['p95']:.1f}ms  "
+              f"forward {s['forward_ms']:.1f}ms  latency p50 {s['latency_ms']['p50']:.1f}ms "
+              f"p95 {s['latency_ms']['p95']:.1f}ms  {s['images_per_s']:.1f} img/s")
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=5.0)
+        with self._cond:
+            while self._pending:
+                self._pending.popleft()[2].set_exception(RuntimeError("batcher closed"))
+
+
+def add_batch_args(parser, max_batch=1, max_wait_ms=5.0):
+    parser.add_argument("--max-batch", type=int, default=max_batch,
+                        help="Largest inference batch (1 = per-frame inference)")
+    parser.add_argument("--max-wait-ms", type=float, default=max_wait_ms,
+                        help="Longest a frame waits for a batch to fill")
+    return parser
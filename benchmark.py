@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Each case runs one entry point headless over fixed local inputs. {synthetic}, {recorded},
+# {images} and {tmp} are filled in by run_case; every case writes its metrics to {tmp}/metrics.json
+CASES = {
+    "split": ["realsense_split_yolo.py", "--source", "{synthetic}"],
+    "split-adaptive": ["realsense_split_yolo.py", "--source", "{synthetic}", "--adaptive"],
+    "split-depth-filters": ["realsense_split_yolo.py", "--source", "{synthetic}", "--depth-filters", "fast"],
+    "split-depth-roi": ["realsense_split_yolo.py", "--source", "{synthetic}", "--depth-roi"],
+    "split-recorded": ["realsense_split_yolo.py", "--source", "{recorded}"],
+    "3d": ["3d.py", "--source", "{synthetic}"],
+    "webcam-recorded": ["webcam_yolo.py", "--source", "{recorded}"],
+    "images": ["batch_detection.py", "{images}", "-o", "{tmp}/detections.jsonl", "--no-resume", "--no-cache"],
+}
+STREAM_ARGS = ["--fast", "--headless", "--metrics-out", "{tmp}/metrics.json"]
+
+# Lower is better for these, higher for fps
+REGRESSION_KEYS = (("fps", +1), ("latency_p95_ms", -1), ("peak_rss_mb", -1))
+
+
+# -----------------------------
+# Fixed inputs: a seeded synthetic scene, recorded once to a folder (color PNG + depth .npy)
+# -----------------------------
+def prepare_inputs(data_dir, frames=300, fruits=12):
+    from frame_sources import SyntheticSource, record_folder
+
+    recorded = os.path.join(data_dir, f"synthetic_{fruits}x{frames}")
+    if not os.path.exists(os.path.join(recorded, "intrinsics.json")):
+        print(f"[bench] recording {frames} frames to {recorded}")
+        record_folder(SyntheticSource(fruits, frames, seed=1, realtime=False), recorded, frames)
+    return {"synthetic": f"synthetic:{fruits},{frames}", "recorded": f"folder:{recorded}", "images": recorded}
+
+
+# -----------------------------
+# One run: child process, peak RSS from wait4, numbers from its metrics dump
+# -----------------------------
+def _run_child(cmd, env, log_path, timeout):
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+        try:
+            if hasattr(os, "wait4"):
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                # ru_maxrss is KiB on Linux, bytes on macOS
+                rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+            else:
+                proc.wait()
+                rss = None
+        finally:
+            timer.cancel()
+    return proc.returncode, rss
+
+
+def run_case(name, inputs, threads=None, timeout=600.0):
+    argv = CASES[name] + ([] if CASES[name][0] == "batch_detection.py" else STREAM_ARGS)
+    with tempfile.TemporaryDirectory(prefix="fruitbench-") as tmp:
+        fields = dict(inputs, tmp=tmp)
+        argv = [a.format(**fields) for a in argv]
+        if argv[0] == "batch_detection.py":
+            argv += ["--metrics-out", os.path.join(tmp, "metrics.json")]
+        env = dict(os.environ, CUDA_VISIBLE_DEVICES="")  # CPU only, comparable between machines
+        if threads:
+            env.update(OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        log_path = os.path.join(tmp, "log.txt")
+        t0 = time.perf_counter()
+        code, rss = _run_child([sys.executable] + argv, env, log_path, timeout)
+        wall = time.perf_counter() - t0
+        metrics_path = os.path.join(tmp, "metrics.json")
+        if code != 0 or not os.path.exists(metrics_path):
+            with open(log_path) as f:
+                tail = f.read()[-2000:]
+            return {"error": f"exit code {code}", "log": tail, "command": argv}
+        with open(metrics_path) as f:
+            m = json.load(f)
+
+    timers, gauges, counters = m["timers"], m["gauges"], m["counters"]
+    if "pipeline.latency" in timers:
+        latency = timers["pipeline.latency"]
+        frames, fps = latency["count"], gauges.get("pipeline.fps", 0.0)
+    else:
+        # Batch mode: one latency sample per forward pass
+        latency = timers.get("batch.forward", {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0})
+        frames, fps = gauges.get("batch.images", 0), gauges.get("batch.images_per_s", 0.0)
+    return {"command": argv, "frames": frames, "fps": fps,
+            "latency_p50_ms": latency["p50_ms"], "latency_p95_ms": latency["p95_ms"],
+            "latency_p99_ms": latency["p99_ms"], "peak_rss_mb": rss,
+            "detections": counters.get("detections", 0), "wall_s": wall,
+            "stages_ms": {n: round(t["mean_ms"], 3) for n, t in timers.items() if t["count"]}}
+
+
+def _median_run(runs):
+    good = [r for r in runs if "error" not in r]
+    if not good:
+        return runs[-1]
+    good.sort(key=lambda r: r["fps"])
+    return dict(good[len(good) // 2], repeats=len(runs))
+
+
+def _environment():
+    info = {"python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    try:
+        info["git"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                     text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    for pkg in ("ultralytics", "torch", "numpy", "opencv-python"):
+        try:
+            from importlib.metadata import version
+            info[pkg] = version(pkg)
+        except Exception:
+            pass
+    return info
+
+
+# -----------------------------
+# Reporting and regression check
+# -----------------------------
+def print_table(results):
+    print(f"{'case':<22} {'frames':>6} {'fps':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'RSS MB':>7} {'dets':>6}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<22} FAILED ({r['error']})")
+            continue
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "n/a"
+        print(f"{name:<22} {r['frames']:>6} {r['fps']:>7.1f} {r['latency_p50_ms']:>7.1f} {r['latency_p95_ms']:>7.1f} "
+              f"{r['latency_p99_ms']:>7.1f} {rss:>7} {r['detections']:>6}")
+
+
+def compare(results, baseline, threshold=0.1):
+    """Relative change per case against a previous run; returns the list of regressions."""
+    regressions = []
+    print(f"\n{'case':<22} " + " ".join(f"{key:>16}" for key, _ in REGRESSION_KEYS) + f" {'dets':>10}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None or "error" in r or "error" in base:
+            continue
+        cells = []
+        for key, direction in REGRESSION_KEYS:
+            if not r.get(key) or not base.get(key):
+                cells.append(f"{'n/a':>16}")
+                continue
+            change = r[key] / base[key] - 1.0
+            worse = -change * direction > threshold
+            if worse:
+                regressions.append(f"{name}: {key} {base[key]:.1f} -> {r[key]:.1f} ({change:+.0%})")
+            cells.append(f"{change:>+15.1%}{'!' if worse else ' '}")
+        dets = "same" if r["detections"] == base["detections"] else f"{base['detections']}->{r['detections']}"
+        print(f"{name:<22} " + " ".join(cells) + f" {dets:>10}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end FruitVision benchmarks on fixed local inputs (CPU)")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--frames", type=int, default=300, help="Frames per synthetic / recorded sequence")
+    parser.add_argument("--fruits", type=int, default=12, help="Fruit in the synthetic scene")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case (the median by fps is kept)")
+    parser.add_argument("--threads", type=int, help="Pin OMP/MKL threads for repeatable CPU numbers")
+    parser.add_argument("--data", default=os.path.join(ROOT, "bench_data"), help="Where generated inputs are kept")
+    parser.add_argument("-o", "--output", default="bench.json", help="Results JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="Previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    inputs = prepare_inputs(args.data, args.frames, args.fruits)
+    results = {}
+    for name in args.cases:
+        runs = [run_case(name, inputs, args.threads) for _ in range(args.repeat)]
+        results[name] = _median_run(runs)
+        r = results[name]
+        print(f"[bench] {name}: " + (r["error"] if "error" in r else f"{r['fps']:.1f} fps"))
+        if "error" in r:
+            print(r["log"])
+
+    print()
+    print_table(results)
+    report = {"environment": _environment(), "config": vars(args), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nSaved {args.output}")
+
+    failed = [n for n, r in results.items() if "error" in r]
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print("  " + line)
+            failed.append("regressions")
+        else:
+            print(f"\nNo regressions beyond {args.threshold:.0%}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_ring import attach_shared_memory
+
+VIEWER_SCRIPT = os.path.abspath(__file__)
+
+# -----------------------------
+# Shared memory layout
+#   header  int64[4]: latest sequence, stop request, viewer closed, unused
+#   2 slots, each: int64[4] (seq begin, seq end, n points, n fruit),
+#                  points f32[capacity, 3], colors f32[capacity, 3],
+#                  fruit centroids f32[max_fruit, 3], fruit classes i32[max_fruit]
+# The writer alternates slots and the viewer only accepts a slot whose
+# begin/end sequence numbers match, so neither side ever waits on the other.
+# -----------------------------
+def _slot_bytes(capacity, max_fruit):
+    return 32 + capacity * 24 + max_fruit * 16
+
+
+def _views(buf, capacity, max_fruit):
+    header = np.ndarray(4, dtype=np.int64, buffer=buf)
+    slots = []
+    size = _slot_bytes(capacity, max_fruit)
+    for k in range(2):
+        off = 32 + k * size
+        meta = np.ndarray(4, dtype=np.int64, buffer=buf, offset=off)
+        off += 32
+        points = np.ndarray((capacity, 3), dtype=np.float32, buffer=buf, offset=off)
+        off += capacity * 12
+        colors = np.ndarray((capacity, 3), dtype=np.float32, buffer=buf, offset=off)
+        off += capacity * 12
+        fruit = np.ndarray((max_fruit, 3), dtype=np.float32, buffer=buf, offset=off)
+        off += max_fruit * 12
+        classes = np.ndarray(max_fruit, dtype=np.int32, buffer=buf, offset=off)
+        slots.append((meta, points, colors, fruit, classes))
+    return header, slots
+
+
+# -----------------------------
+# Detection side: publish point clouds to a viewer process
+# -----------------------------
+class CloudViewer:
+    """Runs the Open3D window in a separate process fed through shared memory.
+
+    publish() copies the latest cloud and fruit centroids into the next slot
+    and returns immediately; the viewer redraws at its own rate and simply
+    skips frames it did not get to.
+    """
+
+    def __init__(self, capacity=400_000, max_fruit=64, fps=30.0, width=640, height=480):
+        self.capacity = capacity
+        self.max_fruit = max_fruit
+        self.shm = shared_memory.SharedMemory(create=True, size=32 + 2 * _slot_bytes(capacity, max_fruit))
+        self.header, self.slots = _views(self.shm.buf, capacity, max_fruit)
+        self.header[:] = 0
+        self.seq = 0
+        self.publish_ms = 0.0
+        self.proc = subprocess.Popen([sys.executable, VIEWER_SCRIPT, "--shm", self.shm.name,
+                                      "--capacity", str(capacity), "--max-fruit", str(max_fruit),
+                                      "--fps", str(fps), "--width", str(width), "--height", str(height),
+                                      "--parent", str(os.getpid())],
+                                     cwd=os.path.dirname(VIEWER_SCRIPT))
+
+    @property
+    def closed(self):
+        # True once the user closed the 3D window (or the viewer died)
+        return bool(self.header[2]) or self.proc.poll() is not None
+
+    def publish(self, points, colors, centroids=None, classes=None):
+        t0 = time.perf_counter()
+        seq = self.seq + 1
+        meta, dst_pts, dst_cols, dst_fruit, dst_cls = self.slots[seq % 2]
+        n = 0 if points is None else len(points)
+        if n > self.capacity:
+            step = -(-n // self.capacity)
+            points, colors = points[::step], colors[::step]
+            n = len(points)
+        m = 0 if centroids is None else min(len(centroids), self.max_fruit)
+
+        meta[0] = seq
+        if n:
+            dst_pts[:n] = points
+            dst_cols[:n] = colors
+        if m:
+            dst_fruit[:m] = centroids[:m]
+            dst_cls[:m] = classes[:m] if classes is not None else 0
+        meta[2] = n
+        meta[3] = m
+        meta[1] = seq
+        self.header[0] = seq
+        self.seq = seq
+        self.publish_ms = (time.perf_counter() - t0) * 1000
+
+    def close(self, timeout=3.0):
+        self.header[1] = 1
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.terminate()
+        del self.header, self.slots
+        self.shm.close()
+        self.shm.unlink()
+
+
+# -----------------------------
+# Viewer process
+# -----------------------------
+def _fruit_markers(o3d, centroids, classes, size=0.03):
+    # One 3D cross per fruit, colored by class
+    from detections import class_color
+
+    offsets = np.array([[-1, 0, 0], [1, 0, 0], [0, -1, 0], [0, 1, 0], [0, 0, -1], [0, 0, 1]], np.float32) * size
+    pts = (centroids[:, None, :] + offsets[None]).reshape(-1, 3)
+    lines = (np.arange(len(centroids) * 3)[:, None] * 2 + np.array([0, 1])).astype(np.int32)
+    colors = np.repeat(np.array([class_color(c)[::-1] for c in classes], np.float64) / 255.0, 3, axis=0)
+    return (o3d.utility.Vector3dVector(pts.astype(np.float64)), o3d.utility.Vector2iVector(lines),
+            o3d.utility.Vector3dVector(colors))
+
+
+def run_viewer(name, capacity, max_fruit, fps=30.0, width=640, height=480, parent=None):
+    import open3d as o3d
+    from point_cloud import CloudUpdater
+
+    shm = attach_shared_memory(name)
+    header, slots = _views(shm.buf, capacity, max_fruit)
+    pcd = o3d.geometry.PointCloud()
+    markers = o3d.geometry.LineSet()
+    cloud_view = CloudUpdater(pcd)
+    vis = o3d.visualization.Visualizer()
+    vis.create_window("3D Point Cloud", width=width, height=height)
+    vis.add_geometry(pcd)
+    vis.add_geometry(markers)
+
+    period = 1.0 / fps
+    last = 0
+    first = True
+    try:
+        while not header[1]:
+            t0 = time.perf_counter()
+            seq = int(header[0])
+            if seq != last:
+                meta, points, colors, fruit, classes = slots[seq % 2]
+                n, m = int(meta[2]), int(meta[3])
+                pts, cols = points[:n].copy(), colors[:n].copy()
+                fruit_xyz, fruit_cls = fruit[:m].copy(), classes[:m].copy()
+                # Accept the copy only if the writer did not start reusing this slot meanwhile
+                if meta[0] == seq and meta[1] == seq:
+                    last = seq
+                    # Empty frames too, so the previous cloud doesn't linger once the fruit leave
+                    cloud_view.update(pts, cols)
+                    vis.update_geometry(pcd)
+                    markers.points, markers.lines, markers.colors = _fruit_markers(o3d, fruit_xyz, fruit_cls)
+                    vis.update_geometry(markers)
+                    if first and n:
+                        vis.reset_view_point(True)
+                        first = False
+            if not vis.poll_events():
+                break
+            vis.update_renderer()
+            if parent and os.getppid() != parent:
+                break  # detection process is gone
+            time.sleep(max(0.0, period - (time.perf_counter() - t0)))
+    finally:
+        header[2] = 1
+        vis.destroy_window()
+        del header, slots
+        shm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open3D point cloud viewer fed through shared memory")
+    parser.add_argument("--shm", required=True, help="Shared memory block created by CloudViewer")
+    parser.add_argument("--capacity", type=int, default=400_000)
+    parser.add_argument("--max-fruit", type=int, default=64)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--parent", type=int, help="Exit when this process is no longer our parent")
+    args = parser.parse_args()
+
+    run_viewer(args.shm, args.capacity, args.max_fruit, args.fps, args.width, args.height, args.parent)
@@ -0,0 +1,271 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from frame_pipeline import StageStats
+
+# Filters always run in this order (librealsense's recommended post-processing order);
+# spatial/temporal run in disparity space on RealSense frames
+FILTER_ORDER = ("decimation", "threshold", "spatial", "temporal", "holes")
+
+PRESETS = {
+    "fast": "decimation=2,threshold=0.15:3.0,holes=1",
+    "quality": "threshold=0.15:3.0,spatial,temporal,holes=1",
+    "full": "decimation=2,threshold=0.15:3.0,spatial,temporal,holes=1",
+}
+
+
+def parse_spec(spec):
+    """'decimation=2,threshold=0.15:3.0,spatial,temporal,holes=1' or a preset -> {name: params}."""
+    spec = PRESETS.get(spec, spec or "")
+    config = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        if name not in FILTER_ORDER:
+            raise ValueError(f"Unknown depth filter {name!r}, expected one of {FILTER_ORDER}")
+        config[name] = [float(v) for v in value.split(":")] if value else []
+    return config
+
+
+# -----------------------------
+# NumPy fallbacks (replayed / synthetic / shared-memory frames)
+# -----------------------------
+def decimate(depth, n=2):
+    # n x n blocks -> one pixel: median of the valid pixels for n <= 3, their mean above (as librealsense)
+    h, w = depth.shape[0] // n, depth.shape[1] // n
+    blocks = depth[:h * n, :w * n].reshape(h, n, w, n).transpose(0, 2, 1, 3).reshape(h, w, n * n)
+    count = np.count_nonzero(blocks, axis=2)
+    if n == 2:
+        # 5-comparator sorting network, much cheaper than np.sort over a length-4 axis
+        a, b, c, d = (blocks[:, :, i] for i in range(4))
+        lo1, hi1, lo2, hi2 = np.minimum(a, b), np.maximum(a, b), np.minimum(c, d), np.maximum(c, d)
+        m1, m2 = np.maximum(lo1, lo2), np.minimum(hi1, hi2)
+        s = np.stack([np.minimum(lo1, lo2), np.minimum(m1, m2), np.maximum(m1, m2), np.maximum(hi1, hi2)], axis=2)
+        idx = np.clip(4 - count + (count - 1) // 2, 0, 3)
+        out = np.take_along_axis(s, idx[:, :, None], axis=2)[:, :, 0]
+    elif n == 3:
+        s = np.sort(blocks, axis=2)  # zeros sort first
+        idx = np.clip(n * n - count + (count - 1) // 2, 0, n * n - 1)
+        out = np.take_along_axis(s, idx[:, :, None], axis=2)[:, :, 0]
+    else:
+        out = (blocks.sum(axis=2, dtype=np.uint32) // np.maximum(count, 1)).astype(np.uint16)
+    out[count == 0] = 0
+    return out
+
+
+def threshold(depth, depth_scale, min_m=0.15, max_m=3.0):
+    lo, hi = min_m / depth_scale, max_m / depth_scale
+    return np.where((depth >= lo) & (depth <= hi), depth, 0).astype(np.uint16)
+
+
+def spatial(depth, depth_scale, delta_m=0.02, diameter=5, sigma_space=2.0):
+    # Edge-preserving smoothing: holes differ from valid depth by far more than delta, so they get no weight
+    # (parse_spec hands every parameter over as a float; OpenCV wants an integer diameter)
+    z = depth.astype(np.float32)
+    out = cv2.bilateralFilter(z, int(diameter), delta_m / depth_scale, sigma_space)
+    out[depth == 0] = 0
+    return np.rint(out).astype(np.uint16)
+
+
+class TemporalFilter:
+    """Per-pixel EMA that restarts on jumps larger than delta and briefly holds the last value over holes."""
+
+    def __init__(self, alpha=0.4, delta_m=0.02, persistence=2):
+        self.alpha = alpha
+        self.delta_m = delta_m
+        self.persistence = int(persistence)  # frames, may arrive as a float from parse_spec
+        self.prev = None
+        self.age = None
+
+    def __call__(self, depth, depth_scale):
+        z = depth.astype(np.float32)
+        if self.prev is None or self.prev.shape != z.shape:
+            self.prev = z
+            self.age = np.zeros(z.shape, dtype=np.uint8)
+            return depth
+        valid = z > 0
+        close = valid & (self.prev > 0) & (np.abs(z - self.prev) < self.delta_m / depth_scale)
+        out = np.where(close, self.alpha * z + (1 - self.alpha) * self.prev, z)
+        hold = ~valid & (self.age < self.persistence)
+        out[hold] = self.prev[hold]
+        self.age = np.where(valid, 0, np.minimum(self.age.astype(np.int16) + 1, 255)).astype(np.uint8)
+        self.prev = out
+        return np.rint(out).astype(np.uint16)
+
+
+def fill_holes(depth, mode=1):
+    # librealsense modes: 0 fill from left, 1 farthest neighbour, 2 nearest neighbour
+    holes = depth == 0
+    if not holes.any():
+        return depth
+    if mode == 0:
+        cols = np.where(holes, 0, np.arange(depth.shape[1]))
+        np.maximum.accumulate(cols, axis=1, out=cols)
+        out = np.take_along_axis(depth, cols, axis=1)
+    elif mode == 1:
+        out = np.where(holes, cv2.dilate(depth, np.ones((3, 3), np.uint8)), depth)
+    else:
+        far = np.where(holes, np.uint16(65535), depth)
+        near = cv2.erode(far, np.ones((3, 3), np.uint8))
+        out = np.where(holes & (near < 65535), near, depth)
+    return out.astype(np.uint16)
+
+
+# -----------------------------
+# Filter chain
+# -----------------------------
+class DepthFilterChain:
+    """Post-processes frame.depth between alignment and every depth consumer.
+
+    RealSense frames (frame.raw set) go through the pyrealsense2 filters and
+    keep a filtered depth_frame in raw for colorizer / pointcloud; other
+    frames use the NumPy versions above. Decimation shrinks the depth map,
+    so consumers should use depth_intrinsics(frame) and image_shape scaling
+    (see depth_sampling.sample_box_depths). Cost is tracked per filter.
+    """
+
+    def __init__(self, config):
+        self.config = {name: config[name] for name in FILTER_ORDER if name in config}
+        self.stats = {name: StageStats(name, f"depth.{name}") for name in self.config}
+        self.total = StageStats("total", "depth.total" if self.config else None)
+        self._rs = None
+        self._temporal = TemporalFilter(*self.config["temporal"]) if "temporal" in self.config else None
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(parse_spec(spec))
+
+    def __bool__(self):
+        return bool(self.config)
+
+    def _rs_filters(self):
+        import pyrealsense2 as rs
+
+        filters = []
+        for name, params in self.config.items():
+            if name == "decimation":
+                f = rs.decimation_filter()
+                f.set_option(rs.option.filter_magnitude, params[0] if params else 2)
+            elif name == "threshold":
+                f = rs.threshold_filter(*(params or [0.15, 3.0]))
+            elif name == "spatial":
+                f = rs.spatial_filter()
+                if params:
+                    f.set_option(rs.option.filter_smooth_delta, params[0] * 1000)
+            elif name == "temporal":
+                f = rs.temporal_filter()
+                if params:
+                    f.set_option(rs.option.filter_smooth_alpha, params[0])
+            else:
+                f = rs.hole_filling_filter(int(params[0]) if params else 1)
+            filters.append((name, f))
+        # Spatial/temporal work best on disparity
+        names = [n for n, _ in filters]
+        if "spatial" in names or "temporal" in names:
+            first = min(names.index(n) for n in ("spatial", "temporal") if n in names)
+            last = max(names.index(n) for n in ("spatial", "temporal") if n in names)
+            filters.insert(last + 1, (None, rs.disparity_transform(False)))
+            filters.insert(first, (None, rs.disparity_transform(True)))
+        return filters
+
+    def _process_rs(self, frame):
+        if self._rs is None:
+            self._rs = self._rs_filters()
+        frames, depth_frame, color_frame = frame.raw
+        f = depth_frame
+        t0 = time.perf_counter()
+        for step, filt in self._rs:
+            f = filt.process(f)
+            if step is not None:
+                # Disparity transforms are charged to the filter that needs them
+                t1 = time.perf_counter()
+                self.stats[step].add(t1 - t0)
+                t0 = t1
+        depth_frame = f.as_depth_frame()
+        depth = np.asanyarray(depth_frame.get_data())
+        return frame._replace(depth=depth, raw=(frames, depth_frame, color_frame))
+
+    def _process_numpy(self, frame):
+        depth, scale = frame.depth, frame.depth_scale
+        for name, params in self.config.items():
+            t0 = time.perf_counter()
+            if name == "decimation":
+                depth = decimate(depth, int(params[0]) if params else 2)
+            elif name == "threshold":
+                depth = threshold(depth, scale, *params)
+            elif name == "spatial":
+                depth = spatial(depth, scale, *params)
+            elif name == "temporal":
+                depth = self._temporal(depth, scale)
+            else:
+                depth = fill_holes(depth, int(params[0]) if params else 1)
+            self.stats[name].add(time.perf_counter() - t0)
+        return frame._replace(depth=depth)
+
+    def process(self, frame):
+        if frame is None or frame.depth is None or not self.config:
+            return frame
+        t0 = time.perf_counter()
+        frame = self._process_rs(frame) if frame.raw is not None else self._process_numpy(frame)
+        self.total.add(time.perf_counter() - t0)
+        return frame
+
+    def summary(self):
+        out = {name: s.snapshot()["mean_ms"] for name, s in self.stats.items()}
+        out["total"] = self.total.snapshot()["mean_ms"]
+        return out
+
+    def report(self):
+        if self.config:
+            print("[depth] " + "  ".join(f"{n} {ms:.2f}ms" for n, ms in self.summary().items()))
+
+
+def add_depth_filter_args(parser):
+    parser.add_argument("--depth-filters", default="", metavar="SPEC",
+                        help=f"Depth post-processing: preset ({', '.join(PRESETS)}) or e.g. "
+                             "'decimation=2,threshold=0.15:3.0,spatial,temporal,holes=1'")
+    return parser
+
+
+# -----------------------------
+# Benchmark: cost and depth error per preset on noisy synthetic frames
+# -----------------------------
+def benchmark(frames=60, noise_mm=6.0, holes=0.05, seed=0):
+    from frame_sources import SyntheticSource
+
+    rng = np.random.default_rng(seed)
+    source = SyntheticSource(frames=frames, realtime=False)
+    clean = [f for f in source]
+    noisy = []
+    for f in clean:
+        d = f.depth.astype(np.float32) + rng.normal(0, noise_mm, f.depth.shape)
+        d[rng.random(d.shape) < holes] = 0
+        noisy.append(f._replace(depth=np.clip(d, 0, 65535).astype(np.uint16)))
+
+    print(f"{'chain':<10} {'ms/frame':>9} {'depth px':>9} {'valid %':>8} {'RMSE mm':>8}  per filter")
+    for name in ["raw"] + list(PRESETS):
+        chain = DepthFilterChain.from_spec("" if name == "raw" else name)
+        errs, valid = [], []
+        t0 = time.perf_counter()
+        outs = [chain.process(f) for f in noisy]
+        ms = (time.perf_counter() - t0) * 1000 / frames
+        for f, out in zip(clean, outs):
+            truth = f.depth
+            if out.depth.shape != truth.shape:
+                truth = cv2.resize(truth, out.depth.shape[::-1], interpolation=cv2.INTER_NEAREST)
+            ok = (out.depth > 0) & (truth > 0)
+            valid.append(ok.mean())
+            errs.append(out.depth[ok].astype(np.float32) - truth[ok])
+        rmse = float(np.sqrt(np.mean(np.concatenate(errs[5:]) ** 2)))
+        per = "  ".join(f"{n} {v:.2f}" for n, v in chain.summary().items() if n != "total")
+        print(f"{name:<10} {ms:>9.2f} {outs[0].depth.size:>9} {np.mean(valid) * 100:>7.1f}% {rmse:>8.2f}  {per}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare depth filter chains on noisy synthetic depth")
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--noise-mm", type=float, default=6.0)
+    args = parser.parse_args()
+    benchmark(args.frames, args.noise_mm)
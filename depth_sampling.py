@@ -0,0 +1,263 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Per-box depth statistics, all in meters (0 where a box has no valid pixel)
+BoxDepths = namedtuple("BoxDepths", ["median", "trimmed_mean", "valid_ratio"])
+
+# Per-instance geometry from segmentation masks: median depth (m), 3D centroid
+# (N, 3) in camera coordinates (m), equivalent diameter (m) and valid-pixel ratio
+MaskGeometry = namedtuple("MaskGeometry", ["depth", "centroid", "size", "valid_ratio"])
+
+
+# -----------------------------
+# Zero-copy access to the z16 depth buffer
+# -----------------------------
+def depth_array(depth_frame):
+    # np.asanyarray over get_data() wraps the librealsense buffer, no copy is made.
+    # The view is only valid while depth_frame is alive.
+    return np.asanyarray(depth_frame.get_data())
+
+
+def depth_units(depth_frame, default=0.001):
+    # Meters per z16 unit (0.001 on D400 cameras unless changed in the sensor)
+    try:
+        return depth_frame.get_units()
+    except AttributeError:
+        return default
+
+
+def deproject_pixels(intrinsics, u, v, z):
+    # Vectorized pinhole deprojection to (N, 3) camera coordinates; the aligned
+    # color stream on D400 cameras reports zero distortion, so this matches
+    # rs2_deproject_pixel_to_point there
+    u = np.asarray(u, dtype=np.float32)
+    v = np.asarray(v, dtype=np.float32)
+    z = np.asarray(z, dtype=np.float32)
+    return np.stack([(u - intrinsics.ppx) / intrinsics.fx * z,
+                     (v - intrinsics.ppy) / intrinsics.fy * z,
+                     z], axis=-1)
+
+
+def scale_boxes(boxes, image_shape, depth_shape):
+    # xyxy boxes from image pixels to depth pixels (depth may be decimated)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if image_shape is None or tuple(image_shape[:2]) == tuple(depth_shape[:2]):
+        return boxes
+    sy, sx = depth_shape[0] / image_shape[0], depth_shape[1] / image_shape[1]
+    return boxes * np.array([sx, sy, sx, sy], dtype=np.float32)
+
+
+# -----------------------------
+# Batched per-box depth
+# -----------------------------
+def sample_box_depths(depth, boxes, depth_scale=0.001, grid=7, inner=0.5, trim=0.2, image_shape=None):
+    """Robust depth for every box in one vectorized pass.
+
+    depth: (H, W) z16 array, boxes: (N, 4) xyxy in depth pixel coordinates,
+    or in image pixels when image_shape (the color image shape) is given.
+    A grid x grid lattice is sampled over the central `inner` fraction of each
+    box, zeros are treated as invalid, and `trim` is the fraction cut from each
+    end of the sorted samples for the trimmed mean.
+    """
+    boxes = scale_boxes(boxes, image_shape, depth.shape)
+    n = len(boxes)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.float32)
+        return BoxDepths(empty, empty.copy(), empty.copy())
+
+    h, w = depth.shape[:2]
+    cx = (boxes[:, 0] + boxes[:, 2]) * 0.5
+    cy = (boxes[:, 1] + boxes[:, 3]) * 0.5
+    half_w = (boxes[:, 2] - boxes[:, 0]) * (inner * 0.5)
+    half_h = (boxes[:, 3] - boxes[:, 1]) * (inner * 0.5)
+
+    # Lattice offsets in (-1, 1), same for every box
+    t = (np.arange(grid, dtype=np.float32) + 0.5) / grid * 2.0 - 1.0
+    xs = np.clip(np.rint(cx[:, None] + half_w[:, None] * t), 0, w - 1).astype(np.intp)
+    ys = np.clip(np.rint(cy[:, None] + half_h[:, None] * t), 0, h - 1).astype(np.intp)
+
+    # (N, grid, grid) gather -> (N, grid * grid)
+    samples = depth[ys[:, :, None], xs[:, None, :]].reshape(n, -1).astype(np.float32)
+    valid = samples > 0
+    count = valid.sum(axis=1)
+    m = samples.shape[1]
+
+    # Invalid samples sort to the end of each row
+    samples[~valid] = np.inf
+    samples.sort(axis=1)
+
+    has = count > 0
+    lo = np.maximum((count - 1) // 2, 0)
+    hi = np.maximum(count // 2, 0)
+    rows = np.arange(n)
+    median = np.where(has, (samples[rows, lo] + samples[rows, np.minimum(hi, m - 1)]) * 0.5, 0.0)
+
+    k = (count * trim).astype(np.intp)
+    j = np.arange(m)
+    keep = (j >= k[:, None]) & (j < (count - k)[:, None])
+    kept = keep.sum(axis=1)
+    trimmed = np.where(keep, samples, 0.0).sum(axis=1) / np.maximum(kept, 1)
+
+    return BoxDepths(
+        (median * depth_scale).astype(np.float32),
+        (trimmed * depth_scale).astype(np.float32),
+        (count / m).astype(np.float32),
+    )
+
+
+# -----------------------------
+# Batched per-mask depth, centroid and size
+# -----------------------------
+def _mask_lookup(mask_hw, depth_hw, ys, xs):
+    # Map depth pixel rows/cols into the letterboxed mask grid (same as ultralytics scale_image)
+    mh, mw = mask_hw
+    h, w = depth_hw
+    gain = min(mh / h, mw / w)
+    pad_y = (mh - h * gain) / 2
+    pad_x = (mw - w * gain) / 2
+    my = np.clip(np.rint(ys * gain + pad_y), 0, mh - 1).astype(np.intp)
+    mx = np.clip(np.rint(xs * gain + pad_x), 0, mw - 1).astype(np.intp)
+    return my, mx
+
+
+def sample_mask_depths(masks, depth, intrinsics, depth_scale=0.001, stride=4):
+    """Median depth, 3D centroid and rough size for every mask in one pass.
+
+    masks: (N, mh, mw) YOLO-seg masks (r.masks.data, tensor or array) in the
+    letterboxed inference resolution. depth: (H, W) z16 array aligned to the
+    color image the model saw, possibly decimated. intrinsics: anything with
+    fx, fy, ppx, ppy (rs.intrinsics) at the depth resolution (see
+    frame_sources.depth_intrinsics). Pixels are sampled every `stride` rows/cols.
+    """
+    n = len(masks)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.float32)
+        return MaskGeometry(empty, np.zeros((0, 3), dtype=np.float32), empty.copy(), empty.copy())
+
+    h, w = depth.shape[:2]
+    ys = np.arange(0, h, stride)
+    xs = np.arange(0, w, stride)
+    gh, gw = len(ys), len(xs)
+
+    # Subsample and threshold before leaving the device so only a bool grid is copied
+    if tuple(masks.shape[1:]) == (h, w):
+        inside = masks[:, ::stride, ::stride] > 0.5
+    else:
+        my, mx = _mask_lookup(masks.shape[1:], (h, w), ys, xs)
+        if hasattr(masks, "cpu"):
+            masks = masks.cpu().numpy()
+        inside = masks[:, my[:, None], mx[None, :]] > 0.5
+    if hasattr(inside, "cpu"):
+        inside = inside.cpu().numpy()
+    inside = np.asarray(inside)
+
+    # Mask pixel centroid (u, v) and area from row/column sums
+    area = inside.sum(axis=(1, 2))
+    u_mean = inside.sum(axis=1) @ xs / np.maximum(area, 1)
+    v_mean = inside.sum(axis=2) @ ys / np.maximum(area, 1)
+
+    # Exact per-instance median: sort (instance, depth) pairs packed into one key
+    d = depth[::stride, ::stride].reshape(-1)
+    flat = np.flatnonzero(inside.reshape(n, -1) & (d > 0))
+    inst = flat // (gh * gw)
+    key = (inst.astype(np.int64) << 16) | d[flat % (gh * gw)].astype(np.int64)
+    key.sort()
+    z = (key & 0xFFFF).astype(np.float32)
+    counts = np.bincount(inst, minlength=n)
+    starts = np.cumsum(counts) - counts
+    has = counts > 0
+    last = max(len(z) - 1, 0)
+    lo = np.clip(starts + (counts - 1) // 2, 0, last)
+    hi = np.clip(starts + counts // 2, 0, last)
+    if len(z):
+        median = np.where(has, (z[lo] + z[hi]) * 0.5 * depth_scale, 0.0)
+    else:
+        median = np.zeros(n)
+
+    # Deproject the mask centroid at the median depth
+    centroid = deproject_pixels(intrinsics, u_mean, v_mean, median)
+
+    # Equivalent circle diameter of the mask, scaled to meters at the median depth
+    diameter_px = 2.0 * np.sqrt(area * stride * stride / np.pi)
+    size = diameter_px * median * 2.0 / (intrinsics.fx + intrinsics.fy)
+
+    return MaskGeometry(
+        median.astype(np.float32),
+        centroid.astype(np.float32),
+        size.astype(np.float32),
+        (counts / np.maximum(area, 1)).astype(np.float32),
+    )
+
+
+# -----------------------------
+# Microbenchmark: batched sampling vs the old get_distance loop
+# -----------------------------
+class _ArrayDepthFrame:
+    # Stands in for rs.depth_frame so the benchmark runs without a camera
+    def __init__(self, depth, scale):
+        self._depth = depth
+        self._scale = scale
+
+    def get_width(self):
+        return self._depth.shape[1]
+
+    def get_height(self):
+        return self._depth.shape[0]
+
+    def get_distance(self, x, y):
+        return float(self._depth[y, x]) * self._scale
+
+    def get_data(self):
+        return self._depth
+
+    def get_units(self):
+        return self._scale
+
+
+def _loop_avg_depth(depth_frame, cx, cy, size=7):
+    # Previous 3d.py implementation, kept here for comparison
+    x_min = max(cx - size//2, 0)
+    x_max = min(cx + size//2, depth_frame.get_width() - 1)
+    y_min = max(cy - size//2, 0)
+    y_max = min(cy + size//2, depth_frame.get_height() - 1)
+    depth_values = []
+    for x in range(x_min, x_max+1):
+        for y in range(y_min, y_max+1):
+            d = depth_frame.get_distance(x, y)
+            if d > 0:
+                depth_values.append(d)
+    if len(depth_values) == 0:
+        return 0
+    return float(np.mean(depth_values))
+
+
+def benchmark(counts=(1, 5, 20, 50), repeats=200, seed=0):
+    rng = np.random.default_rng(seed)
+    depth = rng.integers(300, 2000, size=(480, 640), dtype=np.uint16)
+    depth[rng.random(depth.shape) < 0.1] = 0  # 10% holes like a real z16 frame
+    frame = _ArrayDepthFrame(depth, 0.001)
+
+    print(f"{'boxes':>6} {'loop ms':>10} {'batched ms':>11} {'speedup':>8}")
+    for n in counts:
+        x1 = rng.integers(0, 560, n)
+        y1 = rng.integers(0, 400, n)
+        boxes = np.stack([x1, y1, x1 + 80, y1 + 80], axis=1)
+
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            for x1_, y1_, x2_, y2_ in boxes:
+                _loop_avg_depth(frame, int((x1_ + x2_) / 2), int((y1_ + y2_) / 2), size=7)
+        loop_ms = (time.perf_counter() - t0) * 1000 / repeats
+
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            sample_box_depths(depth_array(frame), boxes, depth_units(frame), grid=7)
+        batch_ms = (time.perf_counter() - t0) * 1000 / repeats
+
+        print(f"{n:>6} {loop_ms:>10.3f} {batch_ms:>11.3f} {loop_ms / batch_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
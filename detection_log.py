@@ -0,0 +1,514 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# One row per detection; fixed-width little-endian columns, one raw file each.
+# Missing depth / xyz are NaN, a missing track id is -1. mask_box is the (x, y, w, h)
+# crop the mask RLE covers; its runs live in masks.rle at mask_offset (mask_len uint16 runs)
+DETECTION_COLUMNS = {
+    "frame": ("<i8", ()),
+    "time": ("<f8", ()),
+    "box": ("<f4", (4,)),
+    "cls": ("<i2", ()),
+    "conf": ("<f4", ()),
+    "depth": ("<f4", ()),
+    "xyz": ("<f4", (3,)),
+    "track": ("<i4", ()),
+    "mask_box": ("<i4", (4,)),
+    "mask_offset": ("<i8", ()),
+    "mask_len": ("<i4", ()),
+}
+
+# One row per logged frame, including frames without detections
+FRAME_COLUMNS = {
+    "index": ("<i8", ()),
+    "time": ("<f8", ()),
+    "first_row": ("<i8", ()),
+    "count": ("<i4", ()),
+}
+
+
+def _itemsize(spec):
+    dtype, shape = spec
+    return np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+
+
+# -----------------------------
+# Mask run-length encoding (row-major, runs start with background)
+# -----------------------------
+def rle_encode(mask):
+    flat = np.asarray(mask, dtype=bool).ravel()
+    if not len(flat):
+        return np.zeros(0, dtype=np.uint16)
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], edges, [len(flat)])))
+    if flat[0]:
+        runs = np.concatenate(([0], runs))
+    if (runs > 0xFFFF).any():
+        # Split long runs with zero-length runs of the other value so every run fits in uint16
+        out = []
+        for r in runs.tolist():
+            while r > 0xFFFF:
+                out += [0xFFFF, 0]
+                r -= 0xFFFF
+            out.append(r)
+        runs = np.array(out)
+    return runs.astype(np.uint16)
+
+
+def rle_decode(runs, shape):
+    values = np.arange(len(runs)) % 2 == 1
+    return np.repeat(values, runs.astype(np.int64)).reshape(shape)
+
+
+def polygon_rle(polygon):
+    # Rasterize one polygon inside its own bounding box -> ((x, y, w, h), runs)
+    pts = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+    if len(pts) < 3:
+        return (0, 0, 0, 0), np.zeros(0, dtype=np.uint16)
+    x0, y0 = np.floor(pts.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(pts.max(axis=0)).astype(int) + 1
+    crop = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.fillPoly(crop, [np.rint(pts - (x0, y0)).astype(np.int32)], 1)
+    return (x0, y0, x1 - x0, y1 - y0), rle_encode(crop)
+
+
+# -----------------------------
+# Writer: append() only queues, a background thread packs and writes columns
+# -----------------------------
+class DetectionRecorder:
+    """Append-only columnar log of per-frame detections.
+
+    append() is safe to call from the pipeline threads and only hands the
+    arrays to a writer thread, which encodes masks, packs rows into the
+    column files and then updates meta.json. Each batch is written in time
+    order; a frame older than what is already on disk (e.g. one that
+    reached append() late from a parallel infer worker) clears
+    meta["sorted"] so readers stop relying on binary search. If the writer
+    fails (disk full, malformed detections) append() drops frames with one
+    warning instead of blocking the pipeline, and close() raises the error.
+    Rows past meta.json's count
+    (an interrupted write) are truncated when the log is reopened, so a
+    crash loses at most the unflushed batch.
+    """
+
+    def __init__(self, path, flush_rows=4096, flush_every=1.0, masks=True, max_pending=10000):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_every = flush_every
+        self.masks = masks
+        os.makedirs(path, exist_ok=True)
+        self.meta_path = os.path.join(path, "meta.json")
+        meta = {"rows": 0, "frames": 0, "mask_runs": 0, "names": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        meta.setdefault("sorted", True)
+        meta.setdefault("last_time", None)
+        self.meta = meta
+        self._files = {}
+        for prefix, columns, rows in (("detections", DETECTION_COLUMNS, meta["rows"]),
+                                      ("frames", FRAME_COLUMNS, meta["frames"])):
+            for name, spec in columns.items():
+                self._files[f"{prefix}.{name}"] = self._open(f"{prefix}.{name}.bin", rows * _itemsize(spec))
+        self._files["masks"] = self._open("masks.rle", meta["mask_runs"] * 2)
+        self._queue = queue.Queue(max_pending)
+        self.write_seconds = 0.0
+        self.error = None  # first exception in the writer thread
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._loop, name="detection-log", daemon=True)
+        self._thread.start()
+
+    def _open(self, name, size):
+        f = open(os.path.join(self.path, name), "ab")
+        f.truncate(size)  # drop anything written after the last committed meta.json
+        f.seek(size)
+        return f
+
+    def append(self, index, timestamp, det, depths=None, xyz=None, track_ids=None, names=None):
+        # Hot path: no copies, no encoding. Blocks only if the writer is max_pending frames behind
+        if names is not None and self.meta["names"] is None:
+            self.meta["names"] = {int(k): v for k, v in dict(names).items()}
+        if not self._put((index, timestamp, det, depths, xyz, track_ids)):
+            if not self.dropped:
+                print(f"[log] writer failed ({self.error!r}), dropping frames", flush=True)
+            self.dropped += 1
+
+    def _put(self, item):
+        # False once the writer is dead, so nobody waits on a queue nothing drains
+        while self.error is None:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _loop(self):
+        try:
+            self._consume()
+        except Exception as exc:
+            self.error = exc
+            # Free whatever was queued; append() stops queueing once error is set
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _consume(self):
+        batch, rows = [], 0
+        deadline = time.monotonic() + self.flush_every
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self._write(batch)
+                return
+            if item:
+                batch.append(item)
+                rows += len(item[2].xyxy)
+            if rows >= self.flush_rows or (batch and time.monotonic() >= deadline):
+                self._write(batch)
+                batch, rows = [], 0
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_every
+
+    def _pack(self, batch):
+        # Per-frame arrays -> one array per column for the whole batch
+        batch.sort(key=lambda item: item[1])
+        counts = np.array([len(item[2].xyxy) for item in batch], dtype=np.int64)
+        n = int(counts.sum())
+        first = self.meta["rows"] + np.concatenate(([0], np.cumsum(counts)[:-1]))
+        frames = {"index": np.array([item[0] for item in batch], dtype=np.int64),
+                  "time": np.array([item[1] for item in batch], dtype=np.float64),
+                  "first_row": first, "count": counts.astype(np.int32)}
+        cols = {"frame": np.repeat(frames["index"], counts), "time": np.repeat(frames["time"], counts),
+                "track": np.full(n, -1, dtype=np.int32), "depth": np.full(n, np.nan, dtype=np.float32),
+                "xyz": np.full((n, 3), np.nan, dtype=np.float32), "mask_box": np.zeros((n, 4), dtype=np.int32),
+                "mask_offset": np.zeros(n, dtype=np.int64), "mask_len": np.zeros(n, dtype=np.int32)}
+        if n:
+            cols["box"] = np.concatenate([item[2].xyxy for item in batch]).reshape(-1, 4)
+            cols["cls"] = np.concatenate([item[2].cls for item in batch])
+            cols["conf"] = np.concatenate([item[2].conf for item in batch])
+        else:
+            cols.update(box=np.zeros((0, 4)), cls=np.zeros(0), conf=np.zeros(0))
+
+        runs, offset, row = [], self.meta["mask_runs"], 0
+        for (_, _, det, depths, xyz, track_ids), k in zip(batch, counts):
+            sl = slice(row, row + k)
+            if depths is not None:
+                cols["depth"][sl] = depths
+            if xyz is not None:
+                cols["xyz"][sl] = xyz
+            if track_ids is not None:
+                cols["track"][sl] = track_ids
+            if self.masks and det.polygons is not None:
+                for i, polygon in enumerate(det.polygons):
+                    mask_box, r = polygon_rle(polygon)
+                    cols["mask_box"][row + i] = mask_box
+                    cols["mask_offset"][row + i] = offset
+                    cols["mask_len"][row + i] = len(r)
+                    runs.append(r)
+                    offset += len(r)
+            row += k
+        return cols, frames, runs, offset
+
+    def _write(self, batch):
+        if not batch:
+            return
+        t0 = time.perf_counter()
+        cols, frames, runs, mask_runs = self._pack(batch)
+        for prefix, columns, values in (("detections", DETECTION_COLUMNS, cols), ("frames", FRAME_COLUMNS, frames)):
+            for name, (dtype, _) in columns.items():
+                f = self._files[f"{prefix}.{name}"]
+                f.write(np.ascontiguousarray(values[name], dtype=dtype).tobytes())
+                f.flush()
+        if runs:
+            self._files["masks"].write(np.concatenate(runs).astype("<u2").tobytes())
+            self._files["masks"].flush()
+        t_first, t_last = float(frames["time"][0]), float(frames["time"][-1])
+        last = self.meta["last_time"]
+        if last is not None and t_first < last:
+            self.meta["sorted"] = False
+        self.meta.update(rows=self.meta["rows"] + len(cols["frame"]), frames=self.meta["frames"] + len(batch),
+                         mask_runs=mask_runs, last_time=t_last if last is None else max(last, t_last))
+        # meta.json is the commit point: readers and reopened writers trust its counts
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+        self.write_seconds += time.perf_counter() - t0
+
+    def close(self):
+        self._put(None)
+        self._thread.join()
+        for f in self._files.values():
+            f.close()
+        print(f"[log] {self.meta['rows']} detections / {self.meta['frames']} frames in {self.path} "
+              f"(writer busy {self.write_seconds:.2f}s)")
+        if self.error is not None:
+            raise RuntimeError(f"detection log writer failed, {self.dropped} frames dropped: {self.error!r}") \
+                from self.error
+
+
+def add_log_args(parser):
+    parser.add_argument("--log", metavar="DIR", help="Append detections to a columnar log in DIR")
+    parser.add_argument("--log-masks", action="store_true", help="Also store segmentation masks (RLE)")
+    return parser
+
+
+def recorder_from_args(args):
+    return DetectionRecorder(args.log, masks=args.log_masks) if args.log else None
+
+
+# -----------------------------
+# Reader: memory-mapped columns and chunked queries
+# -----------------------------
+class DetectionLog:
+    """Read-only view of a log; columns are np.memmap so nothing is loaded up front.
+
+    While the recorder saw frames in time order (meta["sorted"]) time ranges
+    are found with a binary search over the memory-mapped time column;
+    otherwise every chunk is filtered on time. Aggregations run in chunks
+    and only touch the columns they need.
+    """
+
+    def __init__(self, path, chunk=1 << 20):
+        self.path = path
+        self.chunk = chunk
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.names = {int(k): v for k, v in (self.meta.get("names") or {}).items()}
+        self.rows = self.meta["rows"]
+        self.sorted = self.meta.get("sorted", True)
+        self.columns = {name: self._map(f"detections.{name}.bin", spec, self.rows)
+                        for name, spec in DETECTION_COLUMNS.items()}
+        self.frames = {name: self._map(f"frames.{name}.bin", spec, self.meta["frames"])
+                       for name, spec in FRAME_COLUMNS.items()}
+        self._runs = self._map("masks.rle", ("<u2", ()), self.meta["mask_runs"])
+
+    def _map(self, name, spec, rows):
+        dtype, shape = spec
+        if rows == 0:
+            return np.zeros((0,) + shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=(rows,) + shape)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def time_slice(self, t0=None, t1=None):
+        # Rows that can lie in [t0, t1): exact for a sorted log, every row otherwise (see _in_time)
+        if not self.sorted:
+            return slice(0, self.rows)
+        t = self.columns["time"]
+        lo = 0 if t0 is None else int(np.searchsorted(t, t0, side="left"))
+        hi = self.rows if t1 is None else int(np.searchsorted(t, t1, side="left"))
+        return slice(lo, hi)
+
+    def _in_time(self, c, t0, t1):
+        # Per-chunk time filter for unsorted logs; None when time_slice was already exact
+        if self.sorted or (t0 is None and t1 is None):
+            return None
+        t = self.columns["time"][c]
+        keep = np.ones(len(t), dtype=bool)
+        if t0 is not None:
+            keep &= t >= t0
+        if t1 is not None:
+            keep &= t < t1
+        return keep
+
+    def _chunks(self, sl):
+        for start in range(sl.start, sl.stop, self.chunk):
+            yield slice(start, min(start + self.chunk, sl.stop))
+
+    def select(self, cls=None, min_conf=0.0, t0=None, t1=None, track=None):
+        # Row indices matching every given condition
+        sl = self.time_slice(t0, t1)
+        out = []
+        for c in self._chunks(sl):
+            keep = self.columns["conf"][c] >= min_conf
+            if cls is not None:
+                keep &= self.columns["cls"][c] == cls
+            if track is not None:
+                keep &= self.columns["track"][c] == track
+            in_time = self._in_time(c, t0, t1)
+            if in_time is not None:
+                keep &= in_time
+            out.append(np.flatnonzero(keep) + c.start)
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.int64)
+
+    def counts_per_class(self, bin_s=60.0, t0=None, t1=None, min_conf=0.0):
+        """(bin start times, counts of shape (bins, classes)) over the time range."""
+        sl = self.time_slice(t0, t1)
+        if sl.stop <= sl.start:
+            return np.zeros(0), np.zeros((0, max(len(self.names), 1)), dtype=np.int64)
+        t = self.columns["time"]
+        if t0 is not None:
+            start = t0
+        else:
+            start = t[sl.start] if self.sorted else t[sl].min()
+        if t1 is not None:
+            end = t1
+        else:
+            end = t[sl.stop - 1] if self.sorted else t[sl].max()
+        n_bins = int((end - start) // bin_s) + 1
+        n_cls = max(len(self.names), int(self.columns["cls"][sl].max()) + 1)
+        counts = np.zeros(n_bins * n_cls, dtype=np.int64)
+        for c in self._chunks(sl):
+            b = ((self.columns["time"][c] - start) // bin_s).astype(np.int64)
+            keep = (self.columns["conf"][c] >= min_conf) & (b >= 0) & (b < n_bins)
+            in_time = self._in_time(c, t0, t1)
+            if in_time is not None:
+                keep &= in_time
+            counts += np.bincount(b[keep] * n_cls + self.columns["cls"][c][keep], minlength=n_bins * n_cls)
+        return start + np.arange(n_bins) * bin_s, counts.reshape(n_bins, n_cls)
+
+    def depth_histogram(self, bins=60, range=(0.0, 3.0), cls=None, t0=None, t1=None):
+        """(counts, bin edges) of the logged depths in meters, NaN depths skipped."""
+        edges = np.linspace(range[0], range[1], bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        for c in self._chunks(self.time_slice(t0, t1)):
+            d = self.columns["depth"][c]
+            keep = self._in_time(c, t0, t1)
+            if cls is not None:
+                keep = (self.columns["cls"][c] == cls) if keep is None else keep & (self.columns["cls"][c] == cls)
+            if keep is not None:
+                d = d[keep]
+            counts += np.histogram(d[np.isfinite(d)], edges)[0]
+        return counts, edges
+
+    def mask(self, row):
+        # -> (x, y, bool mask of shape (h, w)) in image pixels, or None when no mask was stored
+        x, y, w, h = (int(v) for v in self.columns["mask_box"][row])
+        n = int(self.columns["mask_len"][row])
+        if not n:
+            return None
+        off = int(self.columns["mask_offset"][row])
+        return x, y, rle_decode(np.asarray(self._runs[off:off + n]), (h, w))
+
+    def summary(self):
+        t = self.columns["time"]
+        span = float((t[-1] - t[0]) if self.sorted else (t.max() - t.min())) if self.rows else 0.0
+        size = sum(os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path))
+        return {"detections": self.rows, "frames": self.meta["frames"], "span_s": span, "bytes": size}
+
+
+# -----------------------------
+# Benchmark: hot-path cost, disk footprint and query speed over simulated hours
+# -----------------------------
+def _fake_frames(n_frames, per_frame=10, seed=0, polygons=False):
+    from detections import Detections
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 2 * np.pi, 24, endpoint=False)
+    for i in range(n_frames):
+        k = int(rng.integers(0, 2 * per_frame))
+        xy = rng.uniform(40, 600, (k, 2)).astype(np.float32)
+        r = rng.uniform(10, 40, k).astype(np.float32)
+        xyxy = np.concatenate([xy - r[:, None], xy + r[:, None]], axis=1)
+        polys = [np.stack([x + rr * np.cos(t), y + rr * np.sin(t)], 1) for (x, y), rr in zip(xy, r)] if polygons else None
+        det = Detections(xyxy, rng.uniform(0.3, 1, k).astype(np.float32), rng.integers(0, 5, k), polys)
+        yield i, det, rng.uniform(0.4, 1.5, k).astype(np.float32), rng.normal(0, 0.3, (k, 3)).astype(np.float32)
+
+
+def benchmark(path, hours=1.0, fps=30, per_frame=10, mask_minutes=1.0):
+    import shutil
+    import tempfile
+
+    shutil.rmtree(path, ignore_errors=True)
+    n_frames = int(hours * 3600 * fps)
+    names = {0: "Apple", 1: "Banana", 2: "Orange", 3: "Avocado", 4: "Strawberry"}
+
+    rec = DetectionRecorder(path, flush_rows=16384, masks=False)
+    frames = list(_fake_frames(n_frames, per_frame))
+    t_append = 0.0
+    t_start = time.perf_counter()
+    for i, det, depths, xyz in frames:
+        t0 = time.perf_counter()
+        rec.append(i, 1.7e9 + i / fps, det, depths, xyz, np.arange(len(det.xyxy)), names)
+        t_append += time.perf_counter() - t0
+    rec.close()
+    t_total = time.perf_counter() - t_start
+
+    log = DetectionLog(path)
+    s = log.summary()
+    print(f"{hours:g} h at {fps} fps: {s['detections']} detections, {s['bytes'] / 1e6:.1f} MB on disk "
+          f"({s['bytes'] / max(s['detections'], 1):.0f} B/detection)")
+    print(f"append {t_append / n_frames * 1e6:.1f} us/frame on the hot path, "
+          f"writer {rec.write_seconds:.2f}s total, end-to-end {t_total:.1f}s")
+
+    jsonl = os.path.join(tempfile.gettempdir(), "detection_log_bench.jsonl")
+    from detections import to_dicts
+    with open(jsonl, "w") as f:
+        for i, det, depths, xyz in frames[:fps * 60]:
+            f.write(json.dumps({"frame": i, "detections": to_dicts(det, names)}) + "\n")
+    per_min = os.path.getsize(jsonl)
+    os.remove(jsonl)
+    print(f"JSON lines with boxes/classes only: ~{per_min * hours * 60 / 1e6:.0f} MB for the same footage")
+
+    for label, fn in (("open (memmap)", lambda: DetectionLog(path)),
+                      ("counts per class per minute", lambda: log.counts_per_class(60.0)),
+                      ("depth histogram", lambda: log.depth_histogram()),
+                      ("one minute, apples, conf>0.5", lambda: log.select(cls=0, min_conf=0.5,
+                                                                         t0=1.7e9 + 1800, t1=1.7e9 + 1860))):
+        t0 = time.perf_counter()
+        fn()
+        print(f"  {label:<32} {(time.perf_counter() - t0) * 1000:8.2f} ms")
+    _, counts = log.counts_per_class(60.0)
+    assert counts.sum() == len(log)
+
+    # Masks: RLE size for a shorter stretch
+    mask_path = path + "_masks"
+    shutil.rmtree(mask_path, ignore_errors=True)
+    rec = DetectionRecorder(mask_path, masks=True)
+    for i, det, depths, xyz in _fake_frames(int(mask_minutes * 60 * fps), per_frame, polygons=True):
+        rec.append(i, 1.7e9 + i / fps, det, depths, xyz)
+    rec.close()
+    mlog = DetectionLog(mask_path)
+    rle_bytes = os.path.getsize(os.path.join(mask_path, "masks.rle"))
+    x, y, m = mlog.mask(0)
+    print(f"masks: {rle_bytes / max(len(mlog), 1):.0f} B/detection as RLE "
+          f"(first mask {m.shape[1]}x{m.shape[0]} at ({x}, {y}), {m.mean():.0%} filled)")
+    shutil.rmtree(mask_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a detection log, or benchmark the format")
+    parser.add_argument("log", nargs="?", help="Log directory written with --log")
+    parser.add_argument("--per-minute", action="store_true", help="Detections per class per minute")
+    parser.add_argument("--depths", action="store_true", help="Depth distribution")
+    parser.add_argument("--bench", type=float, metavar="HOURS", help="Benchmark on simulated footage")
+    args = parser.parse_args()
+
+    if args.bench:
+        import tempfile
+        benchmark(os.path.join(tempfile.gettempdir(), "detection_log_bench"), hours=args.bench)
+    elif args.log:
+        log = DetectionLog(args.log)
+        s = log.summary()
+        print(f"{s['detections']} detections in {s['frames']} frames over {s['span_s'] / 60:.1f} min, "
+              f"{s['bytes'] / 1e6:.1f} MB")
+        if args.per_minute:
+            starts, counts = log.counts_per_class(60.0)
+            names = [log.names.get(c, str(c)) for c in range(counts.shape[1])]
+            print(f"{'minute':<20}" + "".join(f"{n:>12}" for n in names))
+            for t, row in zip(starts, counts):
+                print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(t)):<20}" + "".join(f"{v:>12}" for v in row))
+        if args.depths:
+            counts, edges = log.depth_histogram()
+            peak = max(counts.max(), 1)
+            for c, lo in zip(counts, edges):
+                print(f"{lo:5.2f} m {c:>9} " + "#" * int(40 * c / peak))
+    else:
+        parser.print_help()
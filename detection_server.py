@@ -0,0 +1,338 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from backends import BACKENDS
+from batcher import MicroBatcher, add_batch_args
+from detections import from_dicts, from_result, to_dicts
+from result_cache import add_cache_args, cache_from_args, cache_key, read_with_digest
+
+YOLO_MODEL_PATH = "best.pt"
+HOST = "127.0.0.1"
+PORT = 8765
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detection_server.py")
+
+# -----------------------------
+# Wire format: 4-byte header length, JSON header, optional raw payload
+# (header["size"] bytes, e.g. a BGR frame of header["shape"])
+# -----------------------------
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:], n - got)
+        if k == 0:
+            raise ConnectionError("connection closed")
+        got += k
+    return buf
+
+
+def send_message(sock, header, payload=b""):
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    (n,) = struct.unpack("!I", _recv_exact(sock, 4))
+    header = json.loads(_recv_exact(sock, n))
+    payload = _recv_exact(sock, header["size"]) if header.get("size") else b""
+    return header, payload
+
+
+# -----------------------------
+# Server: loads the model once and keeps it warm
+# -----------------------------
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        service = self.server.service
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                reply = service.handle(header, payload)
+            except Exception as exc:
+                reply = {"ok": False, "error": str(exc)}
+            send_message(self.request, reply)
+            if header.get("op") == "shutdown":
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+
+class DetectionService:
+    def __init__(self, weights=YOLO_MODEL_PATH, backend="torch", max_batch=1, max_wait_ms=5.0, cache=None):
+        t0 = time.perf_counter()
+        from backends import FAKE_PREFIX, load_model
+        if not str(weights).startswith(FAKE_PREFIX):
+            # Imported only to time it separately from the model load (startup["import_s"])
+            import ultralytics  # noqa: F401
+        t_import = time.perf_counter()
+        self.model = load_model(weights, backend)
+        # Warm-up pass so the first real request doesn't pay for lazy init
+        self.model(np.zeros((480, 640, 3), dtype=np.uint8), verbose=False)
+        t_ready = time.perf_counter()
+        self.weights = weights
+        self.backend = backend
+        self.names = self.model.names
+        self.startup = {"import_s": t_import - t0, "load_s": t_ready - t_import, "total_s": t_ready - t0}
+        self.latencies = deque(maxlen=1000)
+        self.requests = 0
+        self._stats_lock = threading.Lock()  # handler threads update requests/latencies concurrently
+        self._lock = threading.Lock()  # one forward pass at a time on the direct model
+        # Concurrent clients (e.g. several cameras) share forward passes when batching is on
+        self.batcher = MicroBatcher(self.model, max_batch, max_wait_ms) if max_batch > 1 else None
+        self._direct_model = None if self.batcher is not None else self.model
+        # Only path requests are cached; streamed frames practically never repeat byte for byte
+        self.cache = cache
+
+    def detect(self, image, **params):
+        if self.batcher is not None and not params:
+            return self.batcher.infer(image)
+        # The batcher thread owns self.model, so requests with their own conf/imgsz
+        # get a second copy (loaded on first use) instead of racing it
+        with self._lock:
+            if self._direct_model is None:
+                from backends import load_model
+                self._direct_model = load_model(self.weights, self.backend)
+            return self._direct_model(image, verbose=False, **params)[0]
+
+    def handle(self, header, payload):
+        op = header.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "stats":
+            return dict(self.stats(), ok=True)
+        if op == "shutdown":
+            return {"ok": True}
+        if op != "detect":
+            raise ValueError(f"unknown op: {op}")
+
+        t0 = time.perf_counter()
+        params = header.get("params", {})
+        key = None
+        if "path" in header:
+            if self.cache is not None and header.get("cache", True):
+                digest, image = read_with_digest(header["path"])
+                if image is not None:
+                    key = cache_key(digest, self.weights, self.backend, **params)
+                    hit = self.cache.get(key)
+                    if hit is not None:
+                        det, names, shape = hit
+                        elapsed = time.perf_counter() - t0
+                        with self._stats_lock:
+                            self.requests += 1
+                        return {"ok": True, "detections": to_dicts(det, names), "shape": list(shape),
+                                "server_ms": elapsed * 1000, "cached": True}
+            else:
+                import cv2
+                image = cv2.imread(header["path"])
+            if image is None:
+                raise ValueError(f"cannot read image: {header['path']}")
+        else:
+            image = np.frombuffer(payload, dtype=np.uint8).reshape(header["shape"])
+        det = from_result(self.detect(image, **params))
+        if key is not None:
+            self.cache.put(key, det, self.names, image.shape)
+        elapsed = time.perf_counter() - t0
+        with self._stats_lock:
+            self.latencies.append(elapsed)
+            self.requests += 1
+        return {"ok": True, "detections": to_dicts(det, self.names),
+                "shape": list(image.shape), "server_ms": elapsed * 1000}
+
+    def stats(self):
+        with self._stats_lock:
+            lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+            requests = self.requests
+        batching = self.batcher.stats() if self.batcher is not None else None
+        cache = self.cache.stats() if self.cache is not None else None
+        return {"batching": batching, "cache": cache, "weights": self.weights, "backend": self.backend, "names": {int(k): v for k, v in self.names.items()},
+                "startup": self.startup, "requests": requests,
+                "latency_ms": {"mean": float(lat.mean()), "p50": float(np.percentile(lat, 50)),
+                               "p95": float(np.percentile(lat, 95))}}
+
+
+def serve(weights=YOLO_MODEL_PATH, host=HOST, port=PORT, backend="torch", max_batch=1, max_wait_ms=5.0, cache=None):
+    service = DetectionService(weights, backend, max_batch, max_wait_ms, cache)
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), _Handler) as server:
+        server.daemon_threads = True
+        server.service = service
+        print(f"Detection server on {host}:{port} ready in {service.startup['total_s']:.2f}s", flush=True)
+        server.serve_forever()
+
+
+# -----------------------------
+# Client
+# -----------------------------
+class DetectionClient:
+    def __init__(self, host=HOST, port=PORT, timeout=30.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._names = None
+        self.last_ms = 0.0
+
+    def request(self, header, payload=b""):
+        send_message(self.sock, header, payload)
+        reply, _ = recv_message(self.sock)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "detection server error"))
+        return reply
+
+    def ping(self):
+        return self.request({"op": "ping"})["ok"]
+
+    def stats(self):
+        return self.request({"op": "stats"})
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = {int(k): v for k, v in self.stats()["names"].items()}
+        return self._names
+
+    def detect_path(self, path, use_cache=True, **params):
+        t0 = time.perf_counter()
+        reply = self.request({"op": "detect", "path": os.path.abspath(path), "params": params, "cache": use_cache})
+        self.last_ms = (time.perf_counter() - t0) * 1000
+        return from_dicts(reply["detections"])
+
+    def detect_frame(self, image, **params):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        t0 = time.perf_counter()
+        reply = self.request({"op": "detect", "shape": list(image.shape), "params": params},
+                             memoryview(image).cast("B"))
+        self.last_ms = (time.perf_counter() - t0) * 1000
+        return from_dicts(reply["detections"])
+
+    def shutdown(self):
+        self.request({"op": "shutdown"})
+
+    def close(self):
+        self.sock.close()
+
+
+def server_log_path(port=PORT):
+    return os.path.join(os.path.dirname(SERVER_SCRIPT), f"detection_server_{port}.log")
+
+
+def _log_tail(path, lines=15):
+    try:
+        with open(path, errors="replace") as f:
+            return "".join(f.readlines()[-lines:]).rstrip()
+    except OSError:
+        return ""
+
+
+def start_server(weights=YOLO_MODEL_PATH, host=HOST, port=PORT, backend="torch"):
+    # Launch the server in the background, detached from the caller's console; returns immediately.
+    # Its output goes to server_log_path(port) so a failed start can be diagnosed
+    with open(server_log_path(port), "w") as log:
+        return subprocess.Popen([sys.executable, "-u", SERVER_SCRIPT, "--weights", weights, "--backend", backend,
+                                 "--host", host, "--port", str(port)],
+                                cwd=os.path.dirname(SERVER_SCRIPT), stdin=subprocess.DEVNULL,
+                                stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def connect(weights=YOLO_MODEL_PATH, host=HOST, port=PORT, backend=None, start=True, timeout=120.0):
+    # Connect to a running server, starting one (with `backend`, default torch) if needed and
+    # waiting until it is warm. An already running server keeps its backend; asking for a
+    # different one is reported rather than silently ignored.
+    deadline = time.perf_counter() + timeout
+    proc = None
+    while True:
+        try:
+            client = DetectionClient(host, port)
+        except OSError:
+            if not start:
+                raise
+            if proc is None:
+                proc = start_server(weights, host, port, backend or "torch")
+            elif proc.poll() is not None:
+                log = server_log_path(port)
+                raise RuntimeError(f"detection server exited with code {proc.returncode} while starting "
+                                   f"({log}):\n{_log_tail(log)}")
+            if time.perf_counter() > deadline:
+                log = server_log_path(port)
+                raise TimeoutError(f"detection server did not start within {timeout:.0f}s ({log}):\n{_log_tail(log)}")
+            time.sleep(0.25)
+            continue
+        if backend is not None:
+            running = client.stats()["backend"]
+            if running != backend:
+                print(f"Warning: detection server on {host}:{port} runs the {running} backend, not {backend} "
+                      f"(stop it with --stop to switch)")
+        return client
+
+
+# -----------------------------
+# Benchmark: cold subprocess launch vs warm server
+# -----------------------------
+def benchmark(image_path, weights=YOLO_MODEL_PATH, repeats=20):
+    cold_code = ("import cv2; from ultralytics import YOLO; "
+                 f"YOLO({weights!r})(cv2.imread({os.path.abspath(image_path)!r}), verbose=False)")
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", cold_code], check=True)
+    cold_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    client = connect(weights)
+    client.ping()
+    connect_s = time.perf_counter() - t0
+
+    lat = []
+    for _ in range(repeats):
+        client.detect_path(image_path, use_cache=False)
+        lat.append(client.last_ms)
+    lat = np.array(lat)
+    client.detect_path(image_path)  # fills the result cache if the server has one
+    cached = []
+    for _ in range(repeats):
+        client.detect_path(image_path)
+        cached.append(client.last_ms)
+    stats = client.stats()
+    client.close()
+
+    print(f"Current launch path (new interpreter + model load + 1 image): {cold_s:.2f}s")
+    print(f"Server startup (import {stats['startup']['import_s']:.2f}s, load+warmup {stats['startup']['load_s']:.2f}s), "
+          f"time to first connection here: {connect_s:.2f}s")
+    print(f"Warm request latency over {repeats}: mean {lat.mean():.1f}ms  p50 {np.percentile(lat, 50):.1f}ms  "
+          f"p95 {np.percentile(lat, 95):.1f}ms  -> {cold_s * 1000 / lat.mean():.0f}x faster per image")
+    if stats["cache"] is not None:
+        print(f"Repeat request (result cache): mean {np.mean(cached):.2f}ms  p95 {np.percentile(cached, 95):.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent FruitVision detection server")
+    parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    add_batch_args(parser)
+    add_cache_args(parser)
+    parser.add_argument("--bench", metavar="IMAGE", help="Compare cold launch vs warm server on an image")
+    parser.add_argument("--stop", action="store_true", help="Shut down a running server")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.bench, args.weights)
+    elif args.stop:
+        connect(args.weights, args.host, args.port, start=False).shutdown()
+    else:
+        serve(args.weights, args.host, args.port, args.backend, args.max_batch, args.max_wait_ms,
+              cache_from_args(args))
@@ -0,0 +1,103 @@
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# Framework-independent detections for one image: xyxy (N, 4) float32,
+# conf (N,) float32, cls (N,) int, polygons = list of (K, 2) arrays or None
+Detections = namedtuple("Detections", ["xyxy", "conf", "cls", "polygons"])
+
+# BGR colors per class id (Apple, Banana, Orange, Avocado, Strawberry, ...)
+CLASS_COLORS = [(60, 60, 220), (40, 210, 240), (30, 140, 250), (60, 140, 60), (120, 40, 230),
+                (200, 120, 40), (180, 60, 180), (90, 200, 200)]
+
+
+def class_color(cls):
+    return CLASS_COLORS[int(cls) % len(CLASS_COLORS)]
+
+
+def empty():
+    return Detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, int), None)
+
+
+# -----------------------------
+# Conversion from ultralytics Results
+# -----------------------------
+def from_result(r):
+    # ultralytics' own timings: preprocess, inference, postprocess (NMS + mask decode), in ms
+    for stage, ms in (getattr(r, "speed", None) or {}).items():
+        if ms is not None:
+            METRICS.observe(f"model.{stage}", ms / 1000.0)
+    boxes = r.boxes
+    if boxes is None or len(boxes) == 0:
+        return empty()
+    xyxy = boxes.xyxy.cpu().numpy().astype(np.float32)
+    conf = boxes.conf.cpu().numpy().astype(np.float32)
+    cls = boxes.cls.cpu().numpy().astype(int)
+    polygons = None
+    if r.masks is not None:
+        # masks.xy is already scaled back to original image coordinates
+        polygons = [np.asarray(p, dtype=np.float32) for p in r.masks.xy]
+    METRICS.count("detections", len(xyxy))
+    return Detections(xyxy, conf, cls, polygons)
+
+
+# -----------------------------
+# JSON-friendly form (server responses, batch logs)
+# -----------------------------
+def to_dicts(det, names, decimals=1):
+    out = []
+    for i in range(len(det.xyxy)):
+        item = {
+            "box": [round(float(v), decimals) for v in det.xyxy[i]],
+            "cls": int(det.cls[i]),
+            "label": names[int(det.cls[i])],
+            "conf": round(float(det.conf[i]), 4),
+        }
+        if det.polygons is not None:
+            item["polygon"] = np.round(det.polygons[i], decimals).tolist()
+        out.append(item)
+    return out
+
+
+def from_dicts(items):
+    if not items:
+        return empty()
+    xyxy = np.array([d["box"] for d in items], dtype=np.float32)
+    conf = np.array([d["conf"] for d in items], dtype=np.float32)
+    cls = np.array([d["cls"] for d in items], dtype=int)
+    polygons = None
+    if "polygon" in items[0]:
+        polygons = [np.asarray(d["polygon"], dtype=np.float32).reshape(-1, 2) for d in items]
+    return Detections(xyxy, conf, cls, polygons)
+
+
+# -----------------------------
+# Drawing without ultralytics (r.plot() equivalent)
+# -----------------------------
+def draw_masks(img, det, alpha=0.4):
+    if det.polygons is not None and len(det.polygons):
+        overlay = img.copy()
+        for poly, cls in zip(det.polygons, det.cls):
+            if len(poly) >= 3:
+                cv2.fillPoly(overlay, [poly.astype(np.int32)], class_color(cls))
+        cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, dst=img)
+    return img
+
+
+def draw_detections(img, det, names, extra=None, alpha=0.4):
+    # extra: optional list of strings appended to each label (e.g. depth)
+    draw_masks(img, det, alpha)
+    for i in range(len(det.xyxy)):
+        x1, y1, x2, y2 = det.xyxy[i].astype(int)
+        color = class_color(det.cls[i])
+        text = f"{names[int(det.cls[i])]} {det.conf[i]:.2f}"
+        if extra is not None:
+            text += f" {extra[i]}"
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        (w, h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(img, (x1, y1 - h - 8), (x1 + w + 4, y1), color, -1)
+        cv2.putText(img, text, (x1 + 2, y1 - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return img
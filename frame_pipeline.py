@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS
+
+
+# -----------------------------
+# Bounded queue where the latest frame wins
+# -----------------------------
+class LatestQueue:
+    def __init__(self, maxsize=1, drop=True):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._drop = drop
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item, timeout=None):
+        # With drop=True this never blocks: when full, the oldest item is dropped.
+        # With drop=False (offline replay) it waits for room so every frame is processed.
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                if self._drop:
+                    self._items.popleft()
+                    self.dropped += 1
+                elif not self._cond.wait_for(lambda: len(self._items) < self._maxsize, timeout):
+                    raise queue.Full
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+# -----------------------------
+# Per-stage timing
+# -----------------------------
+class StageStats:
+    # Running count/mean/max; with `metric` every sample also goes to that METRICS histogram
+    def __init__(self, name, metric=None):
+        self.name = name
+        self.hist = METRICS.histogram(metric) if metric else None
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            self.max = max(self.max, seconds)
+        if self.hist is not None:
+            self.hist.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            mean = self.total / self.count if self.count else 0.0
+            return {"count": self.count, "mean_ms": mean * 1000,
+                    "last_ms": self.last * 1000, "max_ms": self.max * 1000}
+
+
+# -----------------------------
+# Capture -> inference -> render pipeline
+# -----------------------------
+class Pipeline:
+    """Runs capture and inference on worker threads, render on the calling thread.
+
+    capture() returns the next frame or None at end of stream, infer(frame)
+    returns a result and render(result) returns False to stop. Render stays
+    on the caller's thread because cv2.imshow/Open3D windows must be driven
+    from the thread that created them. With infer_workers > 1 several frames
+    are in inference at once (e.g. feeding a MicroBatcher) and results may
+    reach render slightly out of order.
+    """
+
+    def __init__(self, capture, infer, render, queue_size=1, report_every=0.0, drop_frames=True,
+                 infer_workers=1):
+        self.capture = capture
+        self.infer = infer
+        self.render = render
+        self.report_every = report_every
+        self.infer_workers = infer_workers
+        self.frames = LatestQueue(max(queue_size, infer_workers), drop_frames)
+        self.results = LatestQueue(queue_size, drop_frames)
+        self._started = None
+        self.stats = {name: StageStats(name, f"pipeline.{name}") for name in ("capture", "infer", "render", "latency")}
+        self._stop = threading.Event()
+        self._capture_done = threading.Event()
+        self._infer_done = threading.Event()
+        self._infer_running = infer_workers
+        self._infer_lock = threading.Lock()
+        self._error = None
+        self._threads = []
+
+    def _capture_loop(self):
+        try:
+            while not self._stop.is_set():
+                t0 = time.perf_counter()
+                frame = self.capture()
+                if frame is None:
+                    break
+                self.stats["capture"].add(time.perf_counter() - t0)
+                self._put(self.frames, (t0, frame))
+        except Exception as exc:  # surfaced again from run()
+            self._error = exc
+            self._stop.set()
+        finally:
+            self._capture_done.set()
+
+    def _infer_loop(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    t_cap, frame = self.frames.get(timeout=0.1)
+                except queue.Empty:
+                    if self._capture_done.is_set() and not len(self.frames):
+                        break
+                    continue
+                t0 = time.perf_counter()
+                result = self.infer(frame)
+                self.stats["infer"].add(time.perf_counter() - t0)
+                self._put(self.results, (t_cap, result))
+        except Exception as exc:
+            self._error = exc
+            self._stop.set()
+        finally:
+            with self._infer_lock:
+                self._infer_running -= 1
+                if not self._infer_running:
+                    self._infer_done.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def start(self):
+        self._started = time.perf_counter()
+        targets = [("capture", self._capture_loop)]
+        targets += [(f"infer-{i}", self._infer_loop) for i in range(self.infer_workers)]
+        for name, target in targets:
+            t = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, wait=True):
+        # wait=False only signals the threads (e.g. from a GUI thread); run() still joins them on its way out
+        self._stop.set()
+        if not wait:
+            return
+        for t in self._threads:
+            t.join(timeout=2.0)
+        self._threads = []
+
+    def run(self):
+        self.start()
+        last_report = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    t_cap, result = self.results.get(timeout=0.1)
+                except queue.Empty:
+                    # Stream ended and every queued frame has been rendered
+                    if self._infer_done.is_set() and not len(self.results):
+                        break
+                    continue
+                t0 = time.perf_counter()
+                keep_going = self.render(result)
+                now = time.perf_counter()
+                self.stats["render"].add(now - t0)
+                self.stats["latency"].add(now - t_cap)
+                METRICS.gauge("pipeline.dropped_capture", self.frames.dropped)
+                METRICS.gauge("pipeline.dropped_infer", self.results.dropped)
+                if keep_going is False:
+                    break
+                if self.report_every and now - last_report >= self.report_every:
+                    self.report()
+                    last_report = now
+        finally:
+            self.stop()
+        if self._error is not None:
+            raise self._error
+        return self.summary()
+
+    def summary(self):
+        out = {name: s.snapshot() for name, s in self.stats.items()}
+        out["dropped"] = {"capture": self.frames.dropped, "infer": self.results.dropped}
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        out["fps"] = self.stats["render"].count / elapsed if elapsed else 0.0
+        METRICS.gauge("pipeline.fps", out["fps"])
+        return out
+
+    def report(self):
+        s = self.summary()
+        stages = "  ".join(f"{n} {s[n]['mean_ms']:.1f}ms" for n in ("capture", "infer", "render", "latency"))
+        print(f"[pipeline] {s['fps']:.1f} fps  {stages}  "
+              f"dropped capture={s['dropped']['capture']} infer={s['dropped']['infer']}")
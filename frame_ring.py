@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_sources import FrameSource, Frame, Intrinsics, add_source_args, source_from_args
+
+RING_NAME = "fruitvision"
+MAGIC = 0x46525631  # "FRV1"
+
+# -----------------------------
+# Shared memory layout
+#   header  int64[8]:   magic, slots, width, height, has depth, latest seq, writer closed, writer pid
+#           float64[8]: fx, fy, ppx, ppy, depth scale, unused...
+#   slots x (int64[4]: seq begin, seq end, source index, unused
+#            float64[2]: capture timestamp (time.time), write time (time.monotonic)
+#            color uint8[H, W, 3], depth uint16[H, W])
+# A slot is valid for sequence s while begin == end == s; readers check this
+# after using a view to know whether the writer lapped them.
+# -----------------------------
+_HEADER = 128
+
+
+def _slot_bytes(width, height):
+    return 48 + width * height * 5
+
+
+def attach_shared_memory(name):
+    # Attach without letting this process's resource tracker unlink the block on exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+class _Ring:
+    def __init__(self, shm):
+        self.shm = shm
+        buf = shm.buf
+        self.header = np.ndarray(8, dtype=np.int64, buffer=buf)
+        self.params = np.ndarray(8, dtype=np.float64, buffer=buf, offset=64)
+
+    def _map_slots(self):
+        buf = self.shm.buf
+        n, w, h = (int(v) for v in self.header[1:4])
+        self.slots = []
+        for k in range(n):
+            off = _HEADER + k * _slot_bytes(w, h)
+            meta = np.ndarray(4, dtype=np.int64, buffer=buf, offset=off)
+            times = np.ndarray(2, dtype=np.float64, buffer=buf, offset=off + 32)
+            color = np.ndarray((h, w, 3), dtype=np.uint8, buffer=buf, offset=off + 48)
+            depth = np.ndarray((h, w), dtype=np.uint16, buffer=buf, offset=off + 48 + w * h * 3)
+            self.slots.append((meta, times, color, depth))
+
+    def _release(self):
+        del self.header, self.params, self.slots
+        self.shm.close()
+
+
+# -----------------------------
+# Writer (capture daemon side)
+# -----------------------------
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by someone else
+    return True
+
+
+def _remove_stale_ring(name, settle=0.5):
+    # Unlink a segment left over from a crashed daemon, but never a ring another daemon is still
+    # writing (e.g. a second camera started without --name) or memory that isn't a frame ring
+    shm = attach_shared_memory(name)
+    header = np.ndarray(8, dtype=np.int64, buffer=shm.buf) if shm.size >= _HEADER else None
+    try:
+        if header is None or header[0] != MAGIC:
+            raise RuntimeError(f"Shared memory '{name}' exists and is not a frame ring; pick another --name")
+        pid = int(header[7])
+        if not header[6]:
+            if pid:
+                live = _pid_alive(pid)
+            else:
+                # Ring written before the pid was recorded: alive if its sequence still moves
+                seq = int(header[5])
+                time.sleep(settle)
+                live = int(header[5]) != seq
+            if live:
+                raise RuntimeError(f"Frame ring '{name}' is in use by a running capture daemon"
+                                   f"{f' (pid {pid})' if pid else ''}; start this one with another --name")
+    finally:
+        del header
+        shm.close()
+    stale = shared_memory.SharedMemory(name=name)  # tracked attach, so unlink() deregisters cleanly
+    stale.close()
+    stale.unlink()
+
+
+class RingWriter(_Ring):
+    """Owns a fixed-size ring of aligned color/depth frames in shared memory."""
+
+    def __init__(self, width, height, slots=8, name=RING_NAME):
+        size = _HEADER + slots * _slot_bytes(width, height)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            _remove_stale_ring(name)
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        super().__init__(shm)
+        self.header[:] = (MAGIC, slots, width, height, 0, 0, 0, os.getpid())
+        self.params[:] = 0
+        self._map_slots()
+        self.name = name
+        self.seq = 0
+        self.bytes_written = 0
+
+    def write(self, frame):
+        if self.seq == 0:
+            intr = frame.intrinsics
+            self.params[:5] = (intr.fx, intr.fy, intr.ppx, intr.ppy, frame.depth_scale)
+            self.header[4] = frame.depth is not None
+        seq = self.seq + 1
+        meta, times, color, depth = self.slots[seq % len(self.slots)]
+        meta[0] = seq
+        meta[2] = frame.index
+        # The only copy on the way to every consumer: camera buffer -> ring slot
+        color[...] = frame.color
+        if frame.depth is not None:
+            depth[...] = frame.depth
+        times[0] = frame.timestamp
+        times[1] = time.monotonic()
+        meta[1] = seq
+        self.header[5] = seq
+        self.seq = seq
+        self.bytes_written += color.nbytes + (depth.nbytes if frame.depth is not None else 0)
+
+    def close(self):
+        self.header[6] = 1
+        self._release()
+        self.shm.unlink()
+
+
+def run_daemon(source, name=RING_NAME, slots=8, frames=0):
+    # Capture loop: source -> ring until the source ends, `frames` is reached or Ctrl+C
+    writer = None
+    t0 = time.perf_counter()
+    try:
+        for frame in source:
+            if writer is None:
+                h, w = frame.color.shape[:2]
+                writer = RingWriter(w, h, slots, name)
+                print(f"Frame ring '{name}' ready: {w}x{h}, {slots} slots", flush=True)
+            writer.write(frame)
+            if frames and writer.seq >= frames:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        if writer is not None:
+            n = writer.seq
+            writer.close()
+            elapsed = time.perf_counter() - t0
+            print(f"Frame ring '{name}': {n} frames in {elapsed:.1f}s ({n / elapsed:.1f} fps)")
+
+
+# -----------------------------
+# Reader: a FrameSource over the ring (open_source("ring[:name]"))
+# -----------------------------
+class RingSource(FrameSource, _Ring):
+    """Frames from a capture daemon's ring buffer as zero-copy views.
+
+    latest=True (live consumers) always jumps to the newest frame;
+    latest=False (recording) reads every frame and only skips ahead when it
+    has fallen a whole ring behind. Views stay valid until the writer laps
+    the slot (slots - 1 frames later); use copy=True or check valid(frame)
+    for consumers that hold frames longer than that. The views are
+    read-only; draw on a copy (annotate.DrawCanvas).
+    """
+
+    def __init__(self, name=RING_NAME, latest=True, copy=False, timeout=10.0, poll=0.0005):
+        FrameSource.__init__(self, fps=0, realtime=False)  # the daemon paces the stream
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                shm = attach_shared_memory(name)
+                break
+            except FileNotFoundError:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"No frame ring '{name}' (start: python frame_ring.py --source ...)")
+                time.sleep(0.1)
+        _Ring.__init__(self, shm)
+        if self.header[0] != MAGIC:
+            raise RuntimeError(f"Shared memory '{name}' is not a frame ring")
+        self._map_slots()
+        self.latest = latest
+        self.copy = copy
+        self.poll = poll
+        self.last = int(self.header[5]) - (0 if latest else 1)
+        self.last = max(self.last, 0)
+        self.dropped = 0
+        self.intrinsics = None
+
+    def _wait(self):
+        while True:
+            newest = int(self.header[5])
+            if newest > self.last:
+                return newest
+            if self.header[6]:
+                return None  # writer closed and everything was read
+            time.sleep(self.poll)
+
+    def read(self):
+        while True:
+            newest = self._wait()
+            if newest is None:
+                return None
+            seq = newest if self.latest else self.last + 1
+            if newest - seq >= len(self.slots) - 1:
+                seq = newest - len(self.slots) + 2  # fell a whole ring behind
+            self.dropped += seq - self.last - 1
+            meta, times, color, depth = self.slots[seq % len(self.slots)]
+            if meta[0] == seq and meta[1] == seq:
+                break
+            self.last = seq  # overwritten while we looked at it, try again
+
+        if self.intrinsics is None:
+            fx, fy, ppx, ppy = (float(v) for v in self.params[:4])
+            self.intrinsics = Intrinsics(color.shape[1], color.shape[0], fx, fy, ppx, ppy)
+        has_depth = bool(self.header[4])
+        if self.copy:
+            color, depth = color.copy(), depth.copy() if has_depth else None
+        else:
+            # Read-only views: other consumers read the same slot, so nobody may draw into it
+            color = color.view()
+            color.setflags(write=False)
+            if has_depth:
+                depth = depth.view()
+                depth.setflags(write=False)
+            else:
+                depth = None
+        self.last = seq
+        self.write_time = float(times[1])
+        return Frame(color, depth, self.intrinsics, float(self.params[4]), float(times[0]), seq, None)
+
+    def valid(self, frame):
+        # True while the zero-copy views of `frame` still hold that frame's data
+        meta = self.slots[frame.index % len(self.slots)][0]
+        return meta[0] == frame.index and meta[1] == frame.index
+
+    def close(self):
+        if hasattr(self, "slots"):
+            self._release()
+
+
+# -----------------------------
+# Benchmark: one daemon fanning out to N consumer processes
+# -----------------------------
+def _consume(name, frames):
+    # Consumer process body for the benchmark: read every frame, touch it, report latency
+    lat = []
+    with RingSource(name, latest=False) as ring:
+        for frame in ring:
+            _ = int(frame.color[0, 0, 0]) + int(frame.depth[0, 0])
+            lat.append((time.monotonic() - ring.write_time) * 1000)
+            if len(lat) >= frames:
+                break
+        dropped = ring.dropped
+    lat = np.array(lat[10:] or [0.0])
+    print(json.dumps({"frames": len(lat), "dropped": dropped, "p50": float(np.percentile(lat, 50)),
+                      "p95": float(np.percentile(lat, 95)), "max": float(lat.max())}), flush=True)
+
+
+def benchmark(max_consumers=4, frames=300, width=640, height=480, fps=30, name=RING_NAME + "_bench"):
+    from frame_sources import SyntheticSource
+
+    frame_mb = width * height * 5 / 1e6
+    print(f"{'consumers':>9} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'dropped':>8} {'MB not copied':>14}")
+    for n in range(1, max_consumers + 1):
+        source = SyntheticSource(frames=frames + 40, width=width, height=height, fps=fps)
+        writer = RingWriter(width, height, name=name)
+        procs = [subprocess.Popen([sys.executable, __file__, "--consume", name, "--frames", str(frames)],
+                                  stdout=subprocess.PIPE, text=True) for _ in range(n)]
+        time.sleep(1.0)  # let the consumers attach
+        for frame in source:
+            writer.write(frame)
+        writer.close()
+        stats = [json.loads(p.communicate()[0]) for p in procs]
+        # Each consumer would otherwise receive its own serialized copy through a pipe/queue
+        avoided = frame_mb * n * writer.seq
+        print(f"{n:>9} {max(s['p50'] for s in stats):>7.2f} {max(s['p95'] for s in stats):>7.2f} "
+              f"{max(s['max'] for s in stats):>7.2f} {sum(s['dropped'] for s in stats):>8} {avoided:>14.0f}")
+
+
+if __name__ == "__main__":
+    parser = add_source_args(argparse.ArgumentParser(description="Capture daemon: one camera, many consumers"))
+    parser.add_argument("--name", default=RING_NAME, help="Shared memory name consumers attach to (ring:<name>)")
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=0, help="Stop after this many frames (0 = run until Ctrl+C)")
+    parser.add_argument("--bench", type=int, metavar="N", help="Measure fan-out latency for 1..N consumers")
+    parser.add_argument("--consume", metavar="NAME", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.consume:
+        _consume(args.consume, args.frames)
+    elif args.bench:
+        benchmark(args.bench)
+    else:
+        run_daemon(source_from_args(args), args.name, args.slots, args.frames)
@@ -0,0 +1,417 @@
+import argparse
+import glob
+import json
+import os
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# One aligned capture: color (H, W, 3) BGR uint8, depth (H, W) z16 or None,
+# depth_scale in meters per unit, raw = backend frames (rs frameset) or None
+Frame = namedtuple("Frame", ["color", "depth", "intrinsics", "depth_scale", "timestamp", "index", "raw"])
+
+# Pinhole intrinsics with the same attribute names as rs.intrinsics
+Intrinsics = namedtuple("Intrinsics", ["width", "height", "fx", "fy", "ppx", "ppy"])
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def default_intrinsics(width, height, hfov_deg=69.0):
+    # D435 color HFOV, good enough when a recording has no intrinsics file
+    fx = width / (2.0 * np.tan(np.radians(hfov_deg) / 2.0))
+    return Intrinsics(width, height, fx, fx, width / 2.0, height / 2.0)
+
+
+def scale_intrinsics(intrinsics, width, height):
+    # Same camera at another resolution (e.g. a decimated depth map)
+    sx, sy = width / intrinsics.width, height / intrinsics.height
+    return Intrinsics(width, height, intrinsics.fx * sx, intrinsics.fy * sy, intrinsics.ppx * sx, intrinsics.ppy * sy)
+
+
+def depth_intrinsics(frame):
+    # frame.intrinsics describe the color image; depth filters may have shrunk the depth map
+    h, w = frame.depth.shape[:2]
+    if (w, h) == (frame.intrinsics.width, frame.intrinsics.height):
+        return frame.intrinsics
+    return scale_intrinsics(frame.intrinsics, w, h)
+
+
+def to_intrinsics(rs_intrin):
+    return Intrinsics(rs_intrin.width, rs_intrin.height, rs_intrin.fx, rs_intrin.fy, rs_intrin.ppx, rs_intrin.ppy)
+
+
+def colorize_depth(frame, colorizer=None):
+    # Use the librealsense colorizer on live/bag frames, an OpenCV colormap otherwise
+    if colorizer is not None and frame.raw is not None:
+        return np.asanyarray(colorizer.colorize(frame.raw[1]).get_data())
+    if frame.depth is None:
+        return np.zeros_like(frame.color)
+    return cv2.applyColorMap(cv2.convertScaleAbs(frame.depth, alpha=0.03), cv2.COLORMAP_JET)
+
+
+# -----------------------------
+# Base class
+# -----------------------------
+class FrameSource:
+    """Yields Frame tuples until the source is exhausted (read() returns None).
+
+    realtime=False replays recorded/synthetic sources as fast as possible
+    instead of pacing them to their nominal fps.
+    """
+
+    def __init__(self, fps=30, realtime=True):
+        self.fps = fps
+        self.realtime = realtime
+        self.index = 0
+        self._next_time = None
+
+    def _pace(self):
+        if not self.realtime or not self.fps:
+            return
+        now = time.perf_counter()
+        if self._next_time is None:
+            self._next_time = now
+        delay = self._next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time, now) + 1.0 / self.fps
+
+    def _make(self, color, depth, intrinsics, depth_scale=0.001, raw=None):
+        frame = Frame(color, depth, intrinsics, depth_scale, time.time(), self.index, raw)
+        self.index += 1
+        return frame
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -----------------------------
+# Webcam (color only)
+# -----------------------------
+class WebcamSource(FrameSource):
+    def __init__(self, index=0, width=640, height=480, fps=30, realtime=True):
+        super().__init__(fps, realtime=False)  # the camera paces itself
+        self.cap = cv2.VideoCapture(index)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Could not open camera {index}")
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.intrinsics = None
+
+    def read(self):
+        ret, color = self.cap.read()
+        if not ret:
+            return None
+        if self.intrinsics is None:
+            self.intrinsics = default_intrinsics(color.shape[1], color.shape[0])
+        return self._make(color, None, self.intrinsics)
+
+    def close(self):
+        self.cap.release()
+
+
+# -----------------------------
+# RealSense: live camera or .bag playback
+# -----------------------------
+class RealSenseSource(FrameSource):
+    def __init__(self, width=640, height=480, fps=30, serial=None, bag=None, loop=False,
+                 realtime=True, align=True):
+        super().__init__(fps, realtime=False)  # librealsense paces live and bag streams
+        import pyrealsense2 as rs
+
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        if bag:
+            config.enable_device_from_file(bag, repeat_playback=loop)
+        else:
+            if serial:
+                config.enable_device(serial)
+            config.enable_stream(rs.stream.depth, width, height, rs.format.z16, fps)
+            config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
+        profile = self.pipeline.start(config)
+        if bag:
+            playback = profile.get_device().as_playback()
+            playback.set_real_time(realtime)
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+        self.align = rs.align(rs.stream.color) if align else None
+        self.bag = bag
+        self.intrinsics = None
+
+    def read(self):
+        while True:
+            try:
+                with METRICS.timer("realsense.wait"):
+                    frames = self.pipeline.wait_for_frames()
+            except RuntimeError:
+                # Playback reached the end of the file
+                if self.bag:
+                    return None
+                raise
+            if self.align is not None:
+                with METRICS.timer("realsense.align"):
+                    frames = self.align.process(frames)
+            depth_frame = frames.get_depth_frame()
+            color_frame = frames.get_color_frame()
+            if depth_frame and color_frame:
+                break
+
+        if self.intrinsics is None:
+            self.intrinsics = to_intrinsics(color_frame.profile.as_video_stream_profile().intrinsics)
+        # Zero-copy views; raw keeps the frameset alive for as long as the Frame is used
+        color = np.asanyarray(color_frame.get_data())
+        depth = np.asanyarray(depth_frame.get_data())
+        return self._make(color, depth, self.intrinsics, self.depth_scale, raw=(frames, depth_frame, color_frame))
+
+    def close(self):
+        self.pipeline.stop()
+
+
+class BagSource(RealSenseSource):
+    def __init__(self, path, loop=False, realtime=True, align=True):
+        super().__init__(bag=path, loop=loop, realtime=realtime, align=align)
+
+
+# -----------------------------
+# Recorded RGB images/video + .npy depth
+# -----------------------------
+class FolderSource(FrameSource):
+    """Color from a directory of images or a video file, depth from .npy files.
+
+    Depth is looked up as <depth_dir>/<image stem>.npy for image folders, or
+    as frame i of an (N, H, W) .npy stack (memory-mapped). An intrinsics.json
+    next to the color data ({"fx", "fy", "ppx", "ppy", "depth_scale"}) is used
+    if present.
+    """
+
+    def __init__(self, path, depth=None, fps=30, loop=False, realtime=True):
+        super().__init__(fps, realtime)
+        self.loop = loop
+        self.video = None
+        self.images = []
+        if os.path.isdir(path):
+            self.images = sorted(p for p in glob.glob(os.path.join(path, "*"))
+                                 if p.lower().endswith(IMAGE_EXTENSIONS))
+            root = path
+        else:
+            self.video = cv2.VideoCapture(path)
+            root = os.path.dirname(path)
+        if depth is None and os.path.isdir(os.path.join(root, "depth")):
+            depth = os.path.join(root, "depth")
+        self.depth_dir = depth if depth and os.path.isdir(depth) else None
+        self.depth_stack = np.load(depth, mmap_mode="r") if depth and not self.depth_dir else None
+
+        self.meta = {}
+        meta_path = os.path.join(root, "intrinsics.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        self.depth_scale = self.meta.get("depth_scale", 0.001)
+        self.intrinsics = None
+        self._pos = 0
+
+    def _next_color(self):
+        if self.video is not None:
+            ret, color = self.video.read()
+            if not ret and self.loop:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self._pos = 0
+                ret, color = self.video.read()
+            return (color, None) if ret else (None, None)
+        if self._pos >= len(self.images):
+            if not self.loop or not self.images:
+                return None, None
+            self._pos = 0
+        path = self.images[self._pos]
+        return cv2.imread(path), path
+
+    def read(self):
+        color, path = self._next_color()
+        if color is None:
+            return None
+        depth = None
+        if self.depth_dir and path:
+            depth_path = os.path.join(self.depth_dir, os.path.splitext(os.path.basename(path))[0] + ".npy")
+            if os.path.exists(depth_path):
+                depth = np.load(depth_path)
+        elif self.depth_stack is not None:
+            depth = self.depth_stack[self._pos % len(self.depth_stack)]
+        self._pos += 1
+
+        if self.intrinsics is None:
+            h, w = color.shape[:2]
+            if "fx" in self.meta:
+                m = self.meta
+                self.intrinsics = Intrinsics(w, h, m["fx"], m["fy"], m["ppx"], m["ppy"])
+            else:
+                self.intrinsics = default_intrinsics(w, h)
+        self._pace()
+        return self._make(color, depth, self.intrinsics, self.depth_scale)
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+
+# -----------------------------
+# Synthetic fruit on a conveyor
+# -----------------------------
+class SyntheticSource(FrameSource):
+    # BGR colors for the five classes the model knows
+    FRUIT_COLORS = [(40, 40, 200), (40, 220, 240), (30, 140, 250), (40, 90, 40), (60, 30, 220)]
+
+    def __init__(self, num_fruits=12, frames=300, width=640, height=480, fps=30,
+                 belt_depth=1.0, speed=4.0, seed=0, loop=False, realtime=True):
+        super().__init__(fps, realtime)
+        self.num_fruits = num_fruits
+        self.frames = frames
+        self.width = width
+        self.height = height
+        self.belt_depth = belt_depth
+        self.speed = speed
+        self.loop = loop
+        self.intrinsics = default_intrinsics(width, height)
+        rng = np.random.default_rng(seed)
+        self.x = rng.uniform(0, width, num_fruits)
+        self.y = rng.uniform(40, height - 40, num_fruits)
+        self.r = rng.uniform(15, 40, num_fruits)
+        self.kind = rng.integers(0, len(self.FRUIT_COLORS), num_fruits)
+        self.noise = rng
+        yy, xx = np.mgrid[0:height, 0:width]
+        self._yy = yy.astype(np.float32)
+        self._xx = xx.astype(np.float32)
+
+    def read(self):
+        if self.frames and self.index >= self.frames and not self.loop:
+            return None
+        t = self.index
+        color = np.full((self.height, self.width, 3), (70, 70, 70), dtype=np.uint8)
+        depth_m = np.full((self.height, self.width), self.belt_depth, dtype=np.float32)
+
+        xs = (self.x + self.speed * t) % (self.width + 80) - 40
+        for x, y, r, k in zip(xs, self.y, self.r, self.kind):
+            # Spherical bulge above the belt, radius in meters from the pixel radius
+            x0, x1 = max(int(x - r), 0), min(int(x + r) + 1, self.width)
+            y0, y1 = max(int(y - r), 0), min(int(y + r) + 1, self.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            d2 = (self._xx[y0:y1, x0:x1] - x) ** 2 + (self._yy[y0:y1, x0:x1] - y) ** 2
+            inside = d2 < r * r
+            r_m = r * self.belt_depth / self.intrinsics.fx
+            height_m = np.sqrt(np.maximum(r * r - d2, 0)) * r_m / r
+            patch = depth_m[y0:y1, x0:x1]
+            patch[inside] = np.minimum(patch[inside], self.belt_depth - r_m - height_m[inside])
+            # Shade by the sphere normal so fruit has texture for optical flow/feature code
+            shade = 0.45 + 0.55 * height_m[inside] / r_m
+            color[y0:y1, x0:x1][inside] = (shade[:, None] * self.FRUIT_COLORS[k]).astype(np.uint8)
+
+        depth = (depth_m * 1000).astype(np.uint16)
+        depth[self.noise.random(depth.shape) < 0.02] = 0  # sensor holes
+        self._pace()
+        return self._make(color, depth, self.intrinsics, 0.001)
+
+
+# -----------------------------
+# Factory + command line
+# -----------------------------
+def open_source(spec, realtime=True, loop=False):
+    """Open a source from a spec string.
+
+    webcam[:index]          cv2.VideoCapture
+    realsense[:serial]      live RealSense (aligned color + depth)
+    bag:<file.bag>          RealSense recording
+    folder:<dir|video>[,<depth dir|depth.npy>]
+    synthetic[:num_fruits[,frames]]
+    ring[:name]             frames shared by a capture daemon (frame_ring.py)
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "webcam":
+        return WebcamSource(int(arg or 0))
+    if kind == "realsense":
+        return RealSenseSource(serial=arg or None)
+    if kind == "bag":
+        return BagSource(arg, loop=loop, realtime=realtime)
+    if kind == "folder":
+        path, _, depth = arg.partition(",")
+        return FolderSource(path, depth or None, loop=loop, realtime=realtime)
+    if kind == "synthetic":
+        parts = [int(p) for p in arg.split(",") if p]
+        num_fruits = parts[0] if parts else 12
+        frames = parts[1] if len(parts) > 1 else 300
+        return SyntheticSource(num_fruits, frames, loop=loop, realtime=realtime)
+    if kind == "ring":
+        from frame_ring import RING_NAME, RingSource
+        return RingSource(arg or RING_NAME)
+    raise ValueError(f"Unknown frame source: {spec}")
+
+
+def add_source_args(parser, default="realsense"):
+    parser.add_argument("--source", default=default,
+                        help="webcam[:i], realsense[:serial], bag:<file>, folder:<dir>[,<depth>], synthetic[:n[,frames]], "
+                             "ring[:name]")
+    parser.add_argument("--fast", action="store_true",
+                        help="Replay recorded/synthetic sources as fast as possible (no drops, no pacing)")
+    parser.add_argument("--loop", action="store_true", help="Loop recorded sources")
+    return parser
+
+
+def source_from_args(args):
+    return open_source(args.source, realtime=not args.fast, loop=args.loop)
+
+
+def record_folder(source, out_dir, frames):
+    # Save color PNGs + depth .npy pairs and intrinsics.json in the FolderSource layout
+    os.makedirs(os.path.join(out_dir, "depth"), exist_ok=True)
+    frame = None
+    for frame in source:
+        name = f"{frame.index:06d}"
+        cv2.imwrite(os.path.join(out_dir, name + ".png"), frame.color)
+        if frame.depth is not None:
+            np.save(os.path.join(out_dir, "depth", name + ".npy"), np.asarray(frame.depth))
+        if frame.index + 1 >= frames:
+            break
+    if frame is None:
+        raise RuntimeError(f"Nothing to record: the source produced no frames ({out_dir} left without intrinsics.json)")
+    meta = dict(frame.intrinsics._asdict(), depth_scale=frame.depth_scale)
+    with open(os.path.join(out_dir, "intrinsics.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = add_source_args(argparse.ArgumentParser(description="Measure or record a frame source"),
+                             default="synthetic")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--record", help="Write frames to this folder instead of measuring")
+    args = parser.parse_args()
+
+    with source_from_args(args) as source:
+        if args.record:
+            record_folder(source, args.record, args.frames)
+        else:
+            t0 = time.perf_counter()
+            n = 0
+            for frame in source:
+                n += 1
+                if n >= args.frames:
+                    break
+            elapsed = time.perf_counter() - t0
+            print(f"{args.source}: {n} frames in {elapsed:.2f}s ({n / elapsed:.1f} fps)")
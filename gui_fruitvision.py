@@ -1,26 +1,312 @@
+import argparse
 import sys
+import threading
+import time
+from collections import deque
+
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QLabel, QVBoxLayout,
     QHBoxLayout, QFrame, QFileDialog
 )
-from PyQt5.QtGui import QFont, QPixmap
-from PyQt5.QtCore import Qt
-import subprocess
-
-# Paths to scripts
-WEBCAM_SCRIPT = "webcam_yolo.py"
-SPLIT_SCRIPT = "realsense_split_yolo.py"
-IMAGE_DETECTION_SCRIPT = "image_detection.py"  # Path to the new image detection script
+from PyQt5.QtGui import QFont, QPixmap, QImage, QPainter, QColor
+from PyQt5.QtCore import Qt, QRect, QThread, QTimer, pyqtSignal
+
+import cv2
+import numpy as np
+
+from annotate import Annotator, DrawCanvas, SplitCanvas
+from depth_filters import DepthFilterChain, add_depth_filter_args
+from depth_sampling import sample_box_depths, sample_mask_depths
+from detections import draw_detections, from_result
+from frame_pipeline import Pipeline
+from frame_sources import colorize_depth, depth_intrinsics, open_source
+from metrics import METRICS
+from result_cache import ResultCache, cache_key, read_with_digest
+
 LOGO_PATH = "logo.png"  # your logo file
+YOLO_MODEL_PATH = "best.pt"
+
+# -----------------------------
+# Model shared by every mode, loaded on first use
+# -----------------------------
+class SharedModel:
+    """YOLO weights loaded the first time a worker needs them.
+
+    torch/ultralytics are only imported inside load(), which always runs on
+    a worker thread, so the window appears without paying for them. One
+    forward pass at a time: the live view and an image request can overlap.
+    """
+
+    def __init__(self, weights=YOLO_MODEL_PATH):
+        self.weights = weights
+        self.load_s = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                t0 = time.perf_counter()
+                from backends import load_model
+                self._model = load_model(self.weights)
+                self.load_s = time.perf_counter() - t0
+            return self._model
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def __call__(self, image):
+        model = self.load()
+        with self._lock:
+            return model(image, verbose=False)[0]
+
+# -----------------------------
+# Workers: capture + inference off the UI thread
+# -----------------------------
+class LiveWorker(QThread):
+    """Webcam or RealSense split view inside the GUI.
+
+    Runs a frame_pipeline.Pipeline (capture and inference threads) with
+    this QThread as the render stage. A finished frame is handed to the UI
+    as the numpy array itself; the next one is only drawn once the UI has
+    taken it (frame_shown), and split mode alternates between two canvases
+    so the worker never writes into the buffer on screen.
+    """
+    frame_ready = pyqtSignal(object, float)  # BGR frame, capture time (perf_counter)
+    status = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, mode, source_spec, model, depth_filters="", previous=None):
+        super().__init__()
+        self.mode = mode
+        self.source_spec = source_spec
+        self.model = model
+        self.depth_filters = DepthFilterChain.from_spec(depth_filters)
+        self.previous = previous  # still closing the camera we are about to open
+        self.pipeline = None
+        self._free = threading.Event()
+        self._free.set()
+        self._running = True
+        self.skipped = 0
+
+    def stop(self):
+        self._running = False
+        if self.pipeline is not None:
+            self.pipeline.stop(wait=False)
+
+    def frame_shown(self):
+        self._free.set()
+
+    def run(self):
+        if self.previous is not None:
+            self.previous.wait()
+        source = None
+        try:
+            if not self.model.loaded:
+                self.status.emit("Loading model...")
+            names = self.model.load().names
+            self.status.emit(f"Opening {self.source_spec}...")
+            source = open_source(self.source_spec)
+            annotator = Annotator(names)
+            if self.mode == "split":
+                capture, infer, render = self._split_stages(source, annotator)
+            else:
+                capture, infer, render = self._webcam_stages(source, annotator)
+            if self._running:
+                self.pipeline = Pipeline(capture, infer, render)
+                self.pipeline.run()
+        except Exception as exc:
+            self.failed.emit(str(exc))
+        finally:
+            if source is not None:
+                source.close()
+
+    def _show(self, image, t_cap):
+        self._free.clear()
+        self.frame_ready.emit(image, t_cap)
+        return self._running
+
+    def _webcam_stages(self, source, annotator):
+        canvases = [DrawCanvas(), DrawCanvas()]  # read-only ring frames are copied, alternately
+        shown = [0]
+
+        def capture():
+            t = time.perf_counter()
+            frame = self.depth_filters.process(source.read())
+            return None if frame is None else (t, frame)
+
+        def infer(item):
+            t, frame = item
+            det = from_result(self.model(frame.color))
+            depths = None
+            if frame.depth is not None:
+                depths = sample_box_depths(frame.depth, det.xyxy, frame.depth_scale,
+                                           image_shape=frame.color.shape).median
+            return t, frame, det, depths
+
+        def render(result):
+            if not self._free.is_set():
+                self.skipped += 1  # UI still busy with the previous frame
+                return self._running
+            t, frame, det, depths = result
+            labels = [f"{d:.2f}m" for d in depths] if depths is not None else None
+            # Camera captures are fresh arrays, so boxes go straight onto them and they are shown as is
+            shown[0] ^= 1
+            img = canvases[shown[0]](frame.color)
+            annotator.boxes(img, det, labels)
+            return self._show(img, t)
+
+        return capture, infer, render
+
+    def _split_stages(self, source, annotator):
+        try:
+            import pyrealsense2 as rs
+            colorizer = rs.colorizer()
+        except ImportError:
+            colorizer = None
+        canvases = [SplitCanvas(), SplitCanvas()]
+        shown = [0]
+
+        def capture():
+            t = time.perf_counter()
+            frame = self.depth_filters.process(source.read())
+            return None if frame is None else (t, frame, colorize_depth(frame, colorizer))
+
+        def infer(item):
+            t, frame, depth_colormap = item
+            color_image = cv2.convertScaleAbs(frame.color, alpha=1.25, beta=20)
+            r = self.model(color_image)
+            det = from_result(r)
+            depths, sizes = np.zeros(len(det.xyxy), dtype=np.float32), None
+            if frame.depth is not None and r.masks is not None:
+                geometry = sample_mask_depths(r.masks.data, frame.depth, depth_intrinsics(frame), frame.depth_scale)
+                depths, sizes = geometry.depth, geometry.size
+            elif frame.depth is not None:
+                depths = sample_box_depths(frame.depth, det.xyxy, frame.depth_scale,
+                                           image_shape=color_image.shape).median
+            return t, color_image, depth_colormap, det, depths, sizes
+
+        def render(result):
+            if not self._free.is_set():
+                self.skipped += 1
+                return self._running
+            t, color_image, depth_colormap, det, depths, sizes = result
+            shown[0] ^= 1
+            canvas = canvases[shown[0]]  # the other one may still be on screen
+            combined = canvas.compose(color_image, depth_colormap)
+            labels = [f"{d:.2f}m" for d in depths]
+            if sizes is not None:
+                labels = [f"{label} ~{size * 100:.0f}cm" for label, size in zip(labels, sizes)]
+            annotator.draw(canvas.left, det, labels)
+            return self._show(combined, t)
+
+        return capture, infer, render
+
+class ImageWorker(QThread):
+    # One image through the result cache, falling back to the shared model
+    finished_image = pyqtSignal(object, str)  # annotated BGR image or None, title / error
+
+    def __init__(self, filename, model, cache):
+        super().__init__()
+        self.filename = filename
+        self.model = model
+        self.cache = cache
+
+    def run(self):
+        try:
+            t0 = time.perf_counter()
+            digest, img = read_with_digest(self.filename)
+            if img is None:
+                raise ValueError(f"cannot read image: {self.filename}")
+            key = hit = None
+            if self.cache is not None:
+                key = cache_key(digest, self.model.weights, "torch")
+                hit = self.cache.get(key)
+            if hit is not None:
+                det, names, _ = hit
+                source = "cached"
+            else:
+                det = from_result(self.model(img))
+                names = self.model.load().names
+                if key is not None:
+                    self.cache.put(key, det, names, img.shape)
+                source = "model"
+            annotated = draw_detections(img, det, names)
+            ms = (time.perf_counter() - t0) * 1000
+            self.finished_image.emit(annotated, f"{len(det.xyxy)} detections in {ms:.0f} ms ({source})")
+        except Exception as exc:
+            self.finished_image.emit(None, str(exc))
+
+# -----------------------------
+# Frame display: QImage straight over the numpy buffer
+# -----------------------------
+class FrameView(QWidget):
+    """Paints the latest BGR frame scaled to fit, without copies or color conversion.
+
+    The QImage wraps the array's memory (Format_BGR888, Qt >= 5.14) and the
+    array is kept referenced for as long as it is on screen.
+    """
 
-class FruitVisionGUI(QWidget):
     def __init__(self):
         super().__init__()
+        self.frame = None
+        self.image = None
+        self.setMinimumSize(640, 240)
+
+    def set_frame(self, frame):
+        if not hasattr(QImage, "Format_BGR888"):
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # older Qt: one conversion
+            fmt = QImage.Format_RGB888
+        else:
+            fmt = QImage.Format_BGR888
+        frame = np.ascontiguousarray(frame)
+        h, w = frame.shape[:2]
+        self.frame = frame
+        self.image = QImage(frame.data, w, h, frame.strides[0], fmt)
+        self.update()
+
+    def clear(self):
+        self.frame = self.image = None
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#111111"))
+        if self.image is not None:
+            w, h = self.image.width(), self.image.height()
+            scale = min(self.width() / w, self.height() / h)
+            tw, th = int(w * scale), int(h * scale)
+            painter.drawImage(QRect((self.width() - tw) // 2, (self.height() - th) // 2, tw, th), self.image)
+        painter.end()
+
+class FruitVisionGUI(QWidget):
+    def __init__(self, webcam_source="webcam", split_source="realsense", depth_filters="", cache=None,
+                 weights=YOLO_MODEL_PATH):
+        super().__init__()
+        self.model = SharedModel(weights)
+        self.cache = cache
+        self.sources = {"webcam": webcam_source, "split": split_source}
+        self.depth_filters = depth_filters
+        self.live = None
+        self.workers = set()  # keeps running QThreads referenced until they finish
+        self.shown = 0
+        self.latencies = deque(maxlen=60)
+        self._last_tick = (time.perf_counter(), 0)
         self.initUI()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(500)
+
+    def closeEvent(self, event):
+        self.stop_live()
+        for worker in list(self.workers):
+            worker.wait(3000)
+        super().closeEvent(event)
 
     def initUI(self):
         self.setWindowTitle("FruitVision")
-        self.setGeometry(200, 200, 900, 700)
+        self.setGeometry(200, 100, 1100, 900)
         self.setStyleSheet("background-color: #1E1E1E;")
 
         main_layout = QVBoxLayout()
@@ -107,9 +393,36 @@ class FruitVisionGUI(QWidget):
         btn_image.clicked.connect(self.run_image_detection)
         button_layout.addWidget(btn_image)
 
-        main_layout.addStretch()
+        # Stop button for the live modes
+        btn_stop = QPushButton("Stop")
+        btn_stop.setFont(QFont("Arial", 16))
+        btn_stop.setCursor(Qt.PointingHandCursor)
+        btn_stop.setStyleSheet("""
+            QPushButton {
+                background-color: #555555;
+                color: white;
+                border-radius: 15px;
+                padding: 20px 30px;
+            }
+            QPushButton:hover {
+                background-color: #444444;
+            }
+        """)
+        btn_stop.clicked.connect(self.stop_live)
+        button_layout.addWidget(btn_stop)
+
         main_layout.addLayout(button_layout)
-        main_layout.addStretch()
+
+        # -----------------------------
+        # Live view + stats line
+        # -----------------------------
+        self.view = FrameView()
+        main_layout.addWidget(self.view, stretch=1)
+        self.stats_label = QLabel("Idle")
+        self.stats_label.setFont(QFont("Consolas", 12))
+        self.stats_label.setStyleSheet("color: #CCCCCC;")
+        self.stats_label.setAlignment(Qt.AlignCenter)
+        main_layout.addWidget(self.stats_label)
 
         # -----------------------------
         # Separator line
@@ -163,10 +476,62 @@ class FruitVisionGUI(QWidget):
     # Button functions
     # -----------------------------
     def run_webcam(self):
-        subprocess.Popen([sys.executable, WEBCAM_SCRIPT])
+        self.start_live("webcam")
 
     def run_split(self):
-        subprocess.Popen([sys.executable, SPLIT_SCRIPT])
+        self.start_live("split")
+
+    def start_live(self, mode):
+        previous = self.stop_live()
+        worker = LiveWorker(mode, self.sources[mode], self.model, self.depth_filters, previous)
+        worker.frame_ready.connect(self.show_frame)
+        worker.status.connect(self.stats_label.setText)
+        worker.failed.connect(lambda msg: self.stats_label.setText(f"{mode} failed: {msg}"))
+        self._track(worker)
+        self.live = worker
+        self.shown = 0
+        self.latencies.clear()
+        self._last_tick = (time.perf_counter(), 0)
+        worker.start()
+
+    def stop_live(self):
+        # Never waits: the worker closes its source on its own thread
+        worker, self.live = self.live, None
+        if worker is not None:
+            worker.stop()
+            self.stats_label.setText("Stopped")
+        return worker
+
+    def _track(self, worker):
+        self.workers.add(worker)
+        worker.finished.connect(lambda: self.workers.discard(worker))
+
+    def show_frame(self, frame, t_cap):
+        worker = self.sender()
+        if worker is not self.live:
+            return  # late frame from a stopped mode
+        self.view.set_frame(frame)
+        latency = time.perf_counter() - t_cap
+        self.latencies.append(latency)
+        METRICS.observe("gui.latency", latency)
+        self.shown += 1
+        worker.frame_shown()
+
+    def update_stats(self):
+        worker = self.live
+        if worker is None or worker.pipeline is None:
+            return
+        now = time.perf_counter()
+        t_last, n_last = self._last_tick
+        self._last_tick = (now, self.shown)
+        if not self.latencies:
+            return
+        fps = (self.shown - n_last) / (now - t_last)
+        lat = np.array(self.latencies) * 1000
+        infer = worker.pipeline.stats["infer"].snapshot()
+        self.stats_label.setText(
+            f"{worker.mode}  {fps:.1f} fps  latency {np.median(lat):.0f} ms (p95 {np.percentile(lat, 95):.0f})  "
+            f"inference {infer['mean_ms']:.0f} ms  display skipped {worker.skipped}")
 
     def run_image_detection(self):
         # Open file dialog to select image for detection
@@ -175,13 +540,41 @@ class FruitVisionGUI(QWidget):
             self, "Select Image for Detection", "", "Image Files (*.png *.jpg *.jpeg)", options=options
         )
         if filename:
-            subprocess.Popen([sys.executable, IMAGE_DETECTION_SCRIPT, filename])
+            self.detect_image(filename)
+
+    def detect_image(self, filename):
+        # Cache lookup / inference on a worker thread so the UI never blocks
+        self.stop_live()
+        self.stats_label.setText("Detecting..." if self.model.loaded else "Loading model...")
+        worker = ImageWorker(filename, self.model, self.cache)
+        worker.finished_image.connect(self.show_detection_result)
+        self._track(worker)
+        worker.start()
+
+    def show_detection_result(self, img, title):
+        if self.live is not None:
+            return  # a live mode was started meanwhile
+        if img is None:
+            self.view.clear()
+            self.stats_label.setText(f"Detection failed: {title}")
+        else:
+            self.view.set_frame(img)
+            self.stats_label.setText(title)
 
 # -----------------------------
 # Run GUI
 # -----------------------------
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = FruitVisionGUI()
+    parser = argparse.ArgumentParser(description="FruitVision GUI")
+    parser.add_argument("--webcam-source", default="webcam", help="Frame source for Webcam Only (see frame_sources)")
+    parser.add_argument("--split-source", default="realsense", help="Frame source for Camera + Sensor")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the model in Image Detection")
+    parser.add_argument("--weights", default=YOLO_MODEL_PATH,
+                        help="Model weights (fake:MS,PER_IMG_MS for a simulated model, see backends.SimulatedModel)")
+    add_depth_filter_args(parser)
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = FruitVisionGUI(args.webcam_source, args.split_source, args.depth_filters,
+                            None if args.no_cache else ResultCache(), args.weights)
     window.show()
     sys.exit(app.exec_())
@@ -1,26 +1,123 @@
-import sys
+import argparse
 import cv2
-from ultralytics import YOLO
+
+from backends import add_backend_args, weights_from_args
+from metrics import METRICS, Instrumentation, add_metrics_args
+from result_cache import add_cache_args, cache_from_args, cache_key, file_digest
+from tiling import add_tiling_args, sliced_from_args
 
 YOLO_MODEL_PATH = "best.pt"  # Your trained model
 
-def image_detection(image_path):
-    model = YOLO(YOLO_MODEL_PATH)  # Load YOLO model
-    
+_models = {}
+
+def get_model(weights=YOLO_MODEL_PATH, backend="torch", calib_dir=None):
+    # Load each model once per process instead of once per call
+    key = (weights, backend)
+    if key not in _models:
+        from backends import load_model
+        _models[key] = load_model(weights, backend, calib_dir)
+    return _models[key]
+
+def _tiling_params(tiling):
+    # Tiled runs give different detections than a single pass, so they get their own cache entries
+    if tiling is None or not tiling.tiles:
+        return {}
+    return {"tiles": True, "tile": tiling.tile_size, "overlap": tiling.tile_overlap, "merge": tiling.tile_merge,
+            "skip_empty": not tiling.keep_empty_tiles}
+
+def image_detection(image_path, use_server=False, backend="torch", calib_dir=None, instruments=None, tiling=None,
+                    cache=None, weights=YOLO_MODEL_PATH):
     # Step 1: Read the image
-    img = cv2.imread(image_path)
-    
-    # Step 2: Run YOLO detection (no extra preprocessing or adjustments)
-    results = model(img)
-    
-    # Step 3: Annotate the image with detection results
-    annotated_frame = results[0].plot()  # Annotate image with detection boxes
-    
+    with METRICS.timer("image.read"):
+        img = cv2.imread(image_path)
+
+    key = hit = None
+    if cache is not None and not use_server:
+        # Same bytes + same weights + same settings -> same detections; a hit skips loading the model
+        with METRICS.timer("cache.lookup"):
+            key = cache_key(file_digest(image_path), weights, backend, **_tiling_params(tiling))
+            hit = cache.get(key)
+
+    if hit is not None:
+        from detections import draw_detections
+        det, names, _ = hit
+        print(f"{len(det.xyxy)} detections (cached)")
+        with METRICS.timer("draw"):
+            annotated_frame = draw_detections(img.copy(), det, names)
+    elif use_server:
+        # Step 2: Ask the warm detection server (no torch import or model load here)
+        from detection_server import connect
+        from detections import draw_detections
+        client = connect(weights, backend=backend)
+        with METRICS.timer("server.detect"):
+            det = client.detect_path(image_path)
+        print(f"{len(det.xyxy)} detections in {client.last_ms:.1f}ms (server)")
+
+        # Step 3: Annotate the image with detection results
+        with METRICS.timer("draw"):
+            annotated_frame = draw_detections(img.copy(), det, client.names)
+    elif tiling is not None and tiling.tiles:
+        from backends import load_model
+        from detections import draw_detections
+        with METRICS.timer("model.load"):
+            model = get_model(weights, backend, calib_dir)
+            sliced = sliced_from_args(tiling, model, lambda: load_model(weights, backend, calib_dir))
+
+        # Step 2: Overlapping tiles at full resolution so small fruit survive, duplicates merged
+        try:
+            with METRICS.timer("infer"):
+                det = sliced(img)
+        finally:
+            sliced.close()  # stops the --tile-workers batcher threads
+        s = sliced.last
+        print(f"{len(det.xyxy)} detections from {s['tiles'] - s['skipped']}/{s['tiles']} tiles "
+              f"in {s['ms']:.0f}ms")
+        if key is not None:
+            cache.put(key, det, model.names, img.shape)
+
+        # Step 3: Annotate the image with detection results
+        with METRICS.timer("draw"):
+            annotated_frame = draw_detections(img.copy(), det, model.names)
+    else:
+        with METRICS.timer("model.load"):
+            model = get_model(weights, backend, calib_dir)  # Load YOLO model (cached)
+
+        # Step 2: Run YOLO detection (no extra preprocessing or adjustments)
+        with METRICS.timer("infer"):
+            results = model(img)
+        from detections import draw_detections, from_result
+        det = from_result(results[0])  # also records model.* timings
+        if key is not None:
+            cache.put(key, det, model.names, img.shape)
+
+        # Step 3: Annotate the image with detection results (same renderer as a cache hit)
+        with METRICS.timer("draw"):
+            annotated_frame = draw_detections(img.copy(), det, model.names)
+
+    if instruments is not None:
+        instruments.overlay(annotated_frame)
+
     # Step 4: Display the annotated image
     cv2.imshow("Image Detection Result", annotated_frame)
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    image_path = sys.argv[1]  # Get image file path passed from the GUI
-    image_detection(image_path)
+    parser = argparse.ArgumentParser(description="Detect fruit in one image")
+    parser.add_argument("image", help="Image file path (passed from the GUI)")
+    parser.add_argument("--server", action="store_true", help="Use the persistent detection server")
+    add_backend_args(parser)
+    add_metrics_args(parser)
+    add_tiling_args(parser)
+    add_cache_args(parser)
+    args = parser.parse_args()
+    instruments = Instrumentation.from_args(args)
+    cache = cache_from_args(args)
+    try:
+        instruments.profile(image_detection)(args.image, args.server, args.backend, args.calib, instruments, args,
+                                             cache, weights_from_args(args))
+    finally:
+        if cache is not None:
+            cache.report()
+        METRICS.report()
+        instruments.close()
@@ -0,0 +1,377 @@
+import argparse
+import bisect
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+# Latency buckets in seconds (Prometheus histogram upper bounds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+# -----------------------------
+# Timers, counters, gauges
+# -----------------------------
+class Histogram:
+    # Cumulative bucket counts for export plus a window of recent samples for percentiles
+    def __init__(self, buckets=BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.recent.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            recent = np.array(self.recent or [0.0]) * 1000
+            count, total = self.count, self.sum
+        p50, p95, p99 = np.percentile(recent, (50, 95, 99))
+        return {"count": count, "mean_ms": total / count * 1000 if count else 0.0,
+                "recent_ms": float(recent.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+                "p99_ms": float(p99), "max_ms": float(recent.max())}
+
+
+class _Timer:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+
+
+class Metrics:
+    """Process-wide registry of named timers (histograms), counters and gauges.
+
+    Names are dotted ("pipeline.infer", "model.postprocess"); they become
+    fruitvision_pipeline_infer_seconds etc. in the Prometheus text format.
+    Every operation is a dict lookup plus a short lock, cheap enough to call
+    several times per frame from any thread.
+    """
+
+    def __init__(self, prefix="fruitvision"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(name, Histogram())
+        return hist
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def timer(self, name):
+        # with metrics.timer("colorize"): ...
+        return _Timer(self.histogram(name))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            counters, gauges = dict(self.counters), dict(self.gauges)
+            histograms = dict(self.histograms)
+        return {"time": time.time(), "uptime_s": time.time() - self._started,
+                "timers": {n: h.snapshot() for n, h in sorted(histograms.items())},
+                "counters": counters, "gauges": gauges}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1)
+
+    def _name(self, name):
+        return self.prefix + "_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            counters, gauges = dict(self.counters), dict(self.gauges)
+            histograms = dict(self.histograms)
+        for name, value in sorted(counters.items()):
+            n = self._name(name) + "_total"
+            lines += [f"# TYPE {n} counter", f"{n} {value}"]
+        for name, value in sorted(gauges.items()):
+            n = self._name(name)
+            lines += [f"# TYPE {n} gauge", f"{n} {float(value)}"]
+        for name, hist in sorted(histograms.items()):
+            n = self._name(name) + "_seconds"
+            with hist._lock:
+                counts, count, total = list(hist.counts), hist.count, hist.sum
+            lines.append(f"# TYPE {n} histogram")
+            cumulative = 0
+            for bound, c in zip(hist.buckets, counts):
+                cumulative += c
+                lines.append(f'{n}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f'{n}_bucket{{le="+Inf"}} {count}', f"{n}_sum {total:.6f}", f"{n}_count {count}"]
+        return "\n".join(lines) + "\n"
+
+    def report(self, top=12):
+        timers = {n: t for n, t in self.snapshot()["timers"].items() if t["count"]}
+        busiest = sorted(timers.items(), key=lambda kv: -kv[1]["mean_ms"] * kv[1]["count"])[:top]
+        print("[metrics] " + "  ".join(f"{n} {t['mean_ms']:.1f}ms (p95 {t['p95_ms']:.1f})" for n, t in busiest))
+
+
+# Default registry shared by every module in the process
+METRICS = Metrics()
+
+
+# -----------------------------
+# Periodic export: JSON / Prometheus text file and a local /metrics endpoint
+# -----------------------------
+class MetricsExporter:
+    """Writes the registry to `path` every `every` seconds and/or serves it over HTTP.
+
+    Files ending in .prom or .txt get the Prometheus text format, anything
+    else JSON; files are replaced atomically so readers never see half a
+    dump. With a port, GET /metrics (Prometheus) and /metrics.json are
+    served on localhost.
+    """
+
+    def __init__(self, metrics=METRICS, path=None, port=None, every=5.0, host="127.0.0.1"):
+        self.metrics = metrics
+        self.path = path
+        self.every = every
+        self._stop = threading.Event()
+        self._thread = None
+        self.server = None
+        if path:
+            self._thread = threading.Thread(target=self._loop, name="metrics-export", daemon=True)
+            self._thread.start()
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), self._handler())
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"[metrics] serving http://{host}:{self.server.server_port}/metrics")
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, ctype = metrics.to_json(), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, ctype = metrics.to_prometheus(), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def write(self):
+        if not self.path:
+            return
+        prom = self.path.endswith((".prom", ".txt"))
+        text = self.metrics.to_prometheus() if prom else self.metrics.to_json()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.every):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+# -----------------------------
+# cProfile over the first N frames
+# -----------------------------
+class FrameProfiler:
+    """Profiles wrapped stage functions until `frames` frames have been counted.
+
+    cProfile only sees the thread that enabled it, so each wrapped call
+    enables one shared profiler around itself; while profiling, wrapped
+    calls from different threads take turns. The stats are saved to `out`
+    (open with snakeviz or pstats) and the top functions printed.
+    """
+
+    def __init__(self, frames, out="profile.prof", top=25):
+        self.frames = frames
+        self.out = out
+        self.top = top
+        self.seen = 0
+        self.done = frames <= 0
+        self._reported = False
+        self._profile = cProfile.Profile()
+        self._lock = threading.Lock()
+
+    def wrap(self, fn, counts_frames=False):
+        def wrapped(*args, **kwargs):
+            if self.done:
+                return fn(*args, **kwargs)
+            with self._lock:
+                if self.done:
+                    return fn(*args, **kwargs)
+                self._profile.enable()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._profile.disable()
+                    if counts_frames:
+                        self.seen += 1
+                        if self.seen >= self.frames:
+                            self.finish()
+        return wrapped
+
+    def finish(self):
+        # Called after the Nth frame, or on exit when the stream was shorter; only reports once
+        if self._reported:
+            return
+        self.done = self._reported = True
+        self._profile.dump_stats(self.out)
+        buf = io.StringIO()
+        pstats.Stats(self._profile, stream=buf).sort_stats("cumulative").print_stats(self.top)
+        print(f"[profile] {self.seen} frames -> {self.out}\n{buf.getvalue()}")
+
+
+# -----------------------------
+# On-screen FPS / latency overlay
+# -----------------------------
+class Overlay:
+    # Small text panel in the top-left corner: display FPS, end-to-end latency and stage times
+    def __init__(self, metrics=METRICS, stages=("pipeline.capture", "pipeline.infer", "model.inference",
+                                                 "model.postprocess", "pipeline.render")):
+        self.metrics = metrics
+        self.stages = stages
+        self._shown = deque(maxlen=30)
+
+    def draw(self, img):
+        self._shown.append(time.perf_counter())
+        head = []
+        if len(self._shown) > 1:
+            head.append(f"{(len(self._shown) - 1) / (self._shown[-1] - self._shown[0]):.1f} fps")
+        hists = self.metrics.histograms
+        if "pipeline.latency" in hists:
+            s = hists["pipeline.latency"].snapshot()
+            head.append(f"latency {s['p50_ms']:.0f}/{s['p95_ms']:.0f}ms p50/p95")
+        lines = ["  ".join(head)] if head else []
+        for name in self.stages:
+            if name in hists:
+                lines.append(f"{name.split('.', 1)[1]} {hists[name].snapshot()['recent_ms']:.1f}ms")
+        if not lines:
+            return img
+        height = 18 * len(lines) + 8
+        width = max(cv2.getTextSize(t, cv2.FONT_HERSHEY_SIMPLEX, 0.45, 1)[0][0] for t in lines) + 12
+        panel = img[:height, :width]
+        panel //= 3  # darken in place, no extra copy
+        for i, text in enumerate(lines):
+            cv2.putText(img, text, (6, 18 * i + 18), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
+        return img
+
+
+# -----------------------------
+# One object per script: timers, overlay, export and profiling from the command line
+# -----------------------------
+class Instrumentation:
+    def __init__(self, metrics=METRICS, overlay=False, path=None, port=None, every=5.0,
+                 profile=0, profile_out="profile.prof"):
+        self.metrics = metrics
+        self.timer = metrics.timer
+        self._overlay = Overlay(metrics) if overlay else None
+        self.exporter = MetricsExporter(metrics, path, port, every) if (path or port is not None) else None
+        self.profiler = FrameProfiler(profile, profile_out) if profile else None
+
+    @classmethod
+    def from_args(cls, args, metrics=METRICS):
+        return cls(metrics, args.overlay, args.metrics_out, args.metrics_port, args.metrics_every,
+                   args.profile, args.profile_out)
+
+    def profile(self, fn, counts_frames=True):
+        return fn if self.profiler is None else self.profiler.wrap(fn, counts_frames)
+
+    def wrap(self, capture, infer, render):
+        # Pipeline stages, profiled for the first --profile frames (counted at infer)
+        return self.profile(capture, False), self.profile(infer), self.profile(render, False)
+
+    def overlay(self, img):
+        return self._overlay.draw(img) if self._overlay is not None else img
+
+    def close(self):
+        if self.profiler is not None and self.profiler.seen:
+            self.profiler.finish()
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+def add_metrics_args(parser):
+    parser.add_argument("--overlay", action="store_true", help="Draw FPS / latency / stage times on the video")
+    parser.add_argument("--metrics-out", metavar="PATH",
+                        help="Dump metrics periodically (.json, or .prom/.txt for Prometheus text)")
+    parser.add_argument("--metrics-port", type=int, help="Serve /metrics and /metrics.json on localhost")
+    parser.add_argument("--metrics-every", type=float, default=5.0, help="Seconds between metric dumps")
+    parser.add_argument("--profile", type=int, default=0, metavar="N", help="cProfile the first N frames")
+    parser.add_argument("--profile-out", default="profile.prof", help="Where to save the cProfile stats")
+    return parser
+
+
+if __name__ == "__main__":
+    # Overhead of the instrumentation itself
+    parser = argparse.ArgumentParser(description="Measure the cost of timers and exports")
+    parser.add_argument("--n", type=int, default=200000)
+    args = parser.parse_args()
+    m = Metrics()
+    t0 = time.perf_counter()
+    for _ in range(args.n):
+        with m.timer("bench.timer"):
+            pass
+    t1 = time.perf_counter()
+    for _ in range(args.n):
+        m.count("bench.counter")
+    t2 = time.perf_counter()
+    for i in range(20):
+        m.observe(f"bench.stage{i}", 0.001 * i)
+    t3 = time.perf_counter()
+    m.to_prometheus()
+    m.to_json()
+    t4 = time.perf_counter()
+    print(f"timer {(t1 - t0) / args.n * 1e6:.2f}us  counter {(t2 - t1) / args.n * 1e6:.2f}us  "
+          f"export 22 series {(t4 - t3) * 1000:.2f}ms")
@@ -0,0 +1,266 @@
+import argparse
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from backends import add_backend_args, load_model, weights_from_args
+from batcher import MicroBatcher, add_batch_args
+from annotate import Annotator
+from detections import from_result
+from frame_pipeline import LatestQueue, StageStats
+from frame_sources import SyntheticSource, open_source
+
+YOLO_MODEL_PATH = "best.pt"
+
+
+# -----------------------------
+# Device discovery
+# -----------------------------
+def enumerate_cameras(max_webcams=4):
+    # Source specs for every connected RealSense (by serial) and every webcam index that opens
+    specs = []
+    try:
+        import pyrealsense2 as rs
+        for dev in rs.context().query_devices():
+            specs.append("realsense:" + dev.get_info(rs.camera_info.serial_number))
+    except ImportError:
+        pass
+    if not specs:
+        for i in range(max_webcams):
+            cap = cv2.VideoCapture(i)
+            if cap.isOpened():
+                specs.append(f"webcam:{i}")
+            cap.release()
+    return specs
+
+
+# -----------------------------
+# One capture worker and one inference caller per camera
+# -----------------------------
+class CameraStream:
+    """Reads one source on its own thread; only the newest frame waits for inference.
+
+    A second thread hands that frame to the shared MicroBatcher and blocks
+    on its result, so frames from all cameras meet in the same batches.
+    A failing camera stops only its own stream; the exception is kept in
+    `error` and shows up in the runner's stats and report.
+    """
+
+    def __init__(self, name, source, batcher, drop_frames=True, on_result=None):
+        self.name = name
+        self.source = source
+        self.batcher = batcher
+        self.frames = LatestQueue(1, drop_frames)
+        self.on_result = on_result
+        self.stats = {n: StageStats(n) for n in ("capture", "infer", "latency")}
+        self.done = threading.Event()
+        self.latest = None  # (frame, detections) for display
+        self._stop = threading.Event()
+        self._threads = []
+        self.error = None  # "stage: exception" of the first failure, if any
+
+    def _capture_loop(self):
+        try:
+            while not self._stop.is_set():
+                t0 = time.perf_counter()
+                frame = self.source.read()
+                if frame is None:
+                    break
+                t_cap = time.perf_counter()
+                self.stats["capture"].add(t_cap - t0)
+                while not self._stop.is_set():
+                    try:
+                        self.frames.put((t_cap, frame), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as exc:
+            self._fail("capture", exc)
+        finally:
+            self.done.set()
+
+    def _infer_loop(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    t_cap, frame = self.frames.get(timeout=0.1)
+                except queue.Empty:
+                    if self.done.is_set() and not len(self.frames):
+                        break
+                    continue
+                t0 = time.perf_counter()
+                det = from_result(self.batcher.infer(frame.color))
+                now = time.perf_counter()
+                self.stats["infer"].add(now - t0)
+                self.stats["latency"].add(now - t_cap)
+                self.latest = (frame, det)
+                if self.on_result:
+                    self.on_result(self, frame, det)
+        except Exception as exc:
+            self._fail("infer", exc)
+
+    def _fail(self, stage, exc):
+        if self.error is None:
+            self.error = f"{stage}: {type(exc).__name__}: {exc}"
+            print(f"[multi] {self.name} stopped, {self.error}", flush=True)
+        self._stop.set()
+
+    def start(self):
+        for name, target in (("capture", self._capture_loop), ("infer", self._infer_loop)):
+            t = threading.Thread(target=target, name=f"{name}-{self.name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def running(self):
+        return self._threads[-1].is_alive()
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5.0)
+        try:
+            self.source.close()
+        except Exception as exc:
+            self._fail("close", exc)
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+# Streams are threads, not processes: batching frames from different cameras needs them in the
+# process that owns the models, and capture/inference spend their time in native code that
+# releases the GIL. To capture in separate processes anyway, run one frame_ring.py daemon per
+# camera and pass --sources ring:<name> ... (zero-copy shared memory, no pickling).
+class MultiCameraRunner:
+    def __init__(self, sources, names=None, load=None, workers=1, max_batch=0, max_wait_ms=35.0,
+                 drop_frames=True, on_result=None):
+        names = names or [f"cam{i}" for i in range(len(sources))]
+        load = load or (lambda: load_model(YOLO_MODEL_PATH))
+        # Default: a batch closes as soon as every camera has a frame in it; the ~one frame period
+        # deadline only matters when a camera stalls, since unsynchronized cameras are out of phase
+        max_batch = max_batch or len(sources)
+        # One model per worker, shared by every camera
+        self.batcher = MicroBatcher([load() for _ in range(workers)], max_batch, max_wait_ms)
+        self.streams = [CameraStream(n, s, self.batcher, drop_frames, on_result) for n, s in zip(names, sources)]
+        self._started = None
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        cams = {}
+        for s in self.streams:
+            snap = {n: st.snapshot() for n, st in s.stats.items()}
+            processed = snap["infer"]["count"]
+            cams[s.name] = {"captured": snap["capture"]["count"], "processed": processed,
+                            "fps": processed / elapsed if elapsed else 0.0, "dropped": s.frames.dropped,
+                            "latency_ms": snap["latency"]["mean_ms"], "infer_ms": snap["infer"]["mean_ms"],
+                            "error": s.error}
+        batching = self.batcher.stats()
+        total = sum(c["processed"] for c in cams.values())
+        return {"cameras": cams, "total_fps": total / elapsed if elapsed else 0.0,
+                "mean_batch": batching["mean_batch"], "batch_ms": batching["forward_ms"],
+                "batching": batching, "seconds": elapsed}
+
+    def report(self):
+        s = self.stats()
+        cams = "  ".join(f"{n} {c['fps']:.1f}fps/{c['latency_ms']:.0f}ms" + (" FAILED" if c["error"] else "")
+                         for n, c in s["cameras"].items())
+        print(f"[multi] {s['total_fps']:.1f} fps total  batch {s['mean_batch']:.1f} x {s['batch_ms']:.1f}ms  {cams}")
+        for n, c in s["cameras"].items():
+            if c["error"]:
+                print(f"[multi] {n}: {c['error']}")
+
+    def _mosaic(self, annotator, tile=(480, 360)):
+        tiles = []
+        for s in self.streams:
+            img = np.zeros((tile[1], tile[0], 3), np.uint8)
+            if s.latest is not None:
+                frame, det = s.latest
+                img = cv2.resize(annotator.draw(frame.color.copy(), det), tile)
+            cv2.putText(img, s.name, (8, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            tiles.append(img)
+        cols = int(np.ceil(np.sqrt(len(tiles))))
+        tiles += [np.zeros_like(tiles[0])] * (cols * int(np.ceil(len(tiles) / cols)) - len(tiles))
+        return np.vstack([np.hstack(tiles[i:i + cols]) for i in range(0, len(tiles), cols)])
+
+    def run(self, duration=0.0, display=False, report_every=5.0):
+        self._started = time.perf_counter()
+        for s in self.streams:
+            s.start()
+        last_report = time.perf_counter()
+        annotator = Annotator(self.batcher.names)
+        try:
+            while any(s.running() for s in self.streams):
+                now = time.perf_counter()
+                if duration and now - self._started >= duration:
+                    break
+                if display:
+                    cv2.imshow("FruitVision multi-camera", self._mosaic(annotator))
+                    if cv2.waitKey(30) & 0xFF == ord('q'):
+                        break
+                else:
+                    time.sleep(0.05)
+                if report_every and now - last_report >= report_every:
+                    self.report()
+                    last_report = now
+        finally:
+            for s in self.streams:
+                s.stop()
+            self.batcher.close()
+            if display:
+                cv2.destroyAllWindows()
+        return self.stats()
+
+
+# -----------------------------
+# Scaling benchmark: 1..N synthetic (or recorded) streams at camera rate
+# -----------------------------
+def benchmark(max_streams=4, frames=150, specs=None, load=None, workers=1, max_batch=0, max_wait_ms=35.0):
+    print(f"{'streams':>7} {'total fps':>10} {'min cam fps':>12} {'latency ms':>11} {'mean batch':>11} "
+          f"{'batch ms':>9}")
+    rows = []
+    for n in range(1, max_streams + 1):
+        if specs:
+            sources = [open_source(specs[i % len(specs)]) for i in range(n)]
+        else:
+            sources = [SyntheticSource(frames=frames, seed=i) for i in range(n)]
+        runner = MultiCameraRunner(sources, load=load, workers=workers, max_batch=max_batch,
+                                   max_wait_ms=max_wait_ms)
+        s = runner.run(report_every=0)
+        cams = s["cameras"].values()
+        rows.append(s)
+        print(f"{n:>7} {s['total_fps']:>10.1f} {min(c['fps'] for c in cams):>12.1f} "
+              f"{max(c['latency_ms'] for c in cams):>11.1f} {s['mean_batch']:>11.2f} {s['batch_ms']:>9.1f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several cameras through one shared inference pool")
+    parser.add_argument("--sources", nargs="+", help="Source specs (default: every connected camera)")
+    parser.add_argument("--list", action="store_true", help="List connected cameras and exit")
+    parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    parser.add_argument("--workers", type=int, default=1, help="Inference workers (one model copy each)")
+    add_batch_args(parser, max_batch=0, max_wait_ms=35.0)  # 0: one slot per camera
+    parser.add_argument("--duration", type=float, default=0.0, help="Stop after this many seconds")
+    parser.add_argument("--headless", action="store_true", help="No mosaic window")
+    parser.add_argument("--bench", type=int, metavar="N", help="Measure scaling from 1 to N streams")
+    add_backend_args(parser)
+    args = parser.parse_args()
+
+    load = lambda: load_model(weights_from_args(args, args.weights), args.backend, args.calib)
+    if args.list:
+        print("\n".join(enumerate_cameras()) or "No cameras found")
+    elif args.bench:
+        benchmark(args.bench, specs=args.sources, load=load, workers=args.workers, max_batch=args.max_batch,
+                  max_wait_ms=args.max_wait_ms)
+    else:
+        specs = args.sources or enumerate_cameras()
+        if not specs:
+            raise SystemExit("No cameras found; pass --sources (e.g. synthetic:12 bag:a.bag)")
+        runner = MultiCameraRunner([open_source(s) for s in specs], specs, load, args.workers, args.max_batch,
+                                   args.max_wait_ms)
+        runner.run(args.duration, display=not args.headless)
+        runner.report()
+        runner.batcher.report()
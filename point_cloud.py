@@ -0,0 +1,233 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+from depth_sampling import deproject_pixels, scale_boxes
+from frame_sources import depth_intrinsics
+
+
+# -----------------------------
+# Zero-copy views of rs.points buffers
+# -----------------------------
+def vertices_view(points):
+    # get_vertices() is a structured (f0, f1, f2) float32 buffer; view it as (N, 3) without copying
+    return np.asanyarray(points.get_vertices()).view(np.float32).reshape(-1, 3)
+
+
+def texcoords_view(points):
+    # (N, 2) u, v in [0, 1] of the mapped color frame (set by pc.map_to)
+    return np.asanyarray(points.get_texture_coordinates()).view(np.float32).reshape(-1, 2)
+
+
+def colors_from_texcoords(color, uv):
+    # BGR uint8 image + (N, 2) texcoords -> (N, 3) RGB float32 in [0, 1] for Open3D
+    h, w = color.shape[:2]
+    u = np.clip((uv[:, 0] * w).astype(np.int32), 0, w - 1)
+    v = np.clip((uv[:, 1] * h).astype(np.int32), 0, h - 1)
+    return color[v, u, ::-1].astype(np.float32) * (1.0 / 255.0)
+
+
+def voxel_downsample(points, colors, voxel):
+    # Keep the first point of every occupied voxel (one sort, no Open3D round trip)
+    if not len(points):
+        return points, colors
+    keys = np.floor(points / voxel).astype(np.int64)
+    keys -= keys.min(axis=0)
+    dims = keys.max(axis=0) + 1
+    flat = (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+    _, first = np.unique(flat, return_index=True)
+    return points[first], colors[first]
+
+
+# -----------------------------
+# Point cloud builder: valid pixels only, optional stride / ROI / voxel grid
+# -----------------------------
+class PointCloudBuilder:
+    """Builds (points, colors) float32 arrays for the current frame.
+
+    Pixel selection (stride, zero-depth removal, max_depth, detection ROI)
+    happens on the depth grid first, so only the kept points are gathered
+    and colored. RealSense frames go through rs.pointcloud with texture
+    coordinates; replayed frames are deprojected with NumPy.
+    """
+
+    def __init__(self, step=2, voxel=0.0, roi=False, roi_margin=10, max_depth=3.0):
+        self.step = step
+        self.voxel = voxel
+        self.roi = roi
+        self.roi_margin = roi_margin
+        self.max_depth = max_depth
+        self._pc = None
+
+    def _select(self, z, boxes):
+        # z: (H, W) depth in meters -> flat pixel indices to keep
+        h, w = z.shape
+        s = self.step
+        keep = z[::s, ::s] > 0
+        if self.max_depth:
+            keep &= z[::s, ::s] < self.max_depth
+        if self.roi and boxes is not None:
+            inside = np.zeros((h, w), dtype=bool)
+            m = self.roi_margin
+            for x1, y1, x2, y2 in np.asarray(boxes, dtype=int):
+                inside[max(y1 - m, 0):y2 + m, max(x1 - m, 0):x2 + m] = True
+            keep &= inside[::s, ::s]
+        rows, cols = np.nonzero(keep)
+        return rows * s, cols * s
+
+    def from_points(self, points, color, shape, boxes=None):
+        # points: rs.points after pc.map_to(color_frame); shape: depth (H, W)
+        vtx = vertices_view(points)
+        rows, cols = self._select(vtx[:, 2].reshape(shape), boxes)
+        idx = rows * shape[1] + cols
+        pts = vtx[idx]
+        colors = colors_from_texcoords(color, texcoords_view(points)[idx])
+        return self._finish(pts, colors)
+
+    def from_depth(self, depth, intrinsics, depth_scale, color, boxes=None):
+        z = depth * np.float32(depth_scale)
+        rows, cols = self._select(z, boxes)
+        pts = deproject_pixels(intrinsics, cols, rows, z[rows, cols])
+        if color.shape[:2] != depth.shape:
+            # Decimated depth: look the color up at the matching full-resolution pixel
+            rows = rows * color.shape[0] // depth.shape[0]
+            cols = cols * color.shape[1] // depth.shape[1]
+        colors = color[rows, cols, ::-1].astype(np.float32) * (1.0 / 255.0)
+        return self._finish(pts, colors)
+
+    def build(self, frame, boxes=None):
+        if frame.depth is None:
+            return None, None
+        if boxes is not None:
+            boxes = scale_boxes(boxes, frame.color.shape, frame.depth.shape)
+        if frame.raw is not None:
+            if self._pc is None:
+                import pyrealsense2 as rs
+                self._pc = rs.pointcloud()
+            _, depth_frame, color_frame = frame.raw
+            self._pc.map_to(color_frame)
+            points = self._pc.calculate(depth_frame)
+            return self.from_points(points, frame.color, frame.depth.shape, boxes)
+        return self.from_depth(frame.depth, depth_intrinsics(frame), frame.depth_scale, frame.color, boxes)
+
+    def _finish(self, pts, colors):
+        if self.voxel:
+            pts, colors = voxel_downsample(pts, colors, self.voxel)
+        return pts, colors
+
+
+# -----------------------------
+# In-place Open3D geometry updates
+# -----------------------------
+class CloudUpdater:
+    """Writes new points into an Open3D PointCloud's existing buffers.
+
+    The buffers only get reallocated when a frame has more points than the
+    current capacity (which then doubles). Unused slots are parked at the
+    origin in black, so only the slots the previous frame used past the new
+    point count need resetting and an empty frame leaves none of the old
+    cloud behind. The parked slots still draw as a single black point at
+    the origin (the camera position); the buffer length never shrinks, as
+    that would mean reallocating.
+    """
+
+    def __init__(self, pcd):
+        self.pcd = pcd
+        self.capacity = 0
+        self.count = 0
+        self.reallocations = 0
+
+    def _grow(self, n):
+        import open3d as o3d
+        self.capacity = max(n, 2 * self.capacity, 1024)
+        self.pcd.points = o3d.utility.Vector3dVector(np.zeros((self.capacity, 3)))
+        self.pcd.colors = o3d.utility.Vector3dVector(np.zeros((self.capacity, 3)))
+        self.count = 0  # fresh buffers are all parked already
+        self.reallocations += 1
+
+    def update(self, points, colors):
+        n = len(points)
+        if n > self.capacity:
+            self._grow(n)
+        # np.asarray on Vector3dVector is a view of the Open3D buffer
+        dst_pts = np.asarray(self.pcd.points)
+        dst_cols = np.asarray(self.pcd.colors)
+        dst_pts[:n] = points
+        dst_cols[:n] = colors
+        if n < self.count:
+            dst_pts[n:self.count] = 0
+            dst_cols[n:self.count] = 0
+        self.count = n
+        return self.pcd
+
+
+# -----------------------------
+# Benchmark: previous 3d.py point cloud code vs the builder
+# -----------------------------
+class _ArrayPoints:
+    # Stands in for rs.points (structured float32 buffers) so the benchmark runs without a camera
+    def __init__(self, vtx, uv):
+        self._vtx = np.ascontiguousarray(vtx, dtype=np.float32).view([("f0", "<f4"), ("f1", "<f4"), ("f2", "<f4")])
+        self._uv = np.ascontiguousarray(uv, dtype=np.float32).view([("f0", "<f4"), ("f1", "<f4")])
+
+    def get_vertices(self):
+        return self._vtx.reshape(-1)
+
+    def get_texture_coordinates(self):
+        return self._uv.reshape(-1)
+
+
+def _legacy_cloud(points, color):
+    # Previous 3d.py implementation, kept here for comparison
+    vertices = np.asanyarray(points.get_vertices())
+    vtx = np.stack([vertices['f0'], vertices['f1'], vertices['f2']], axis=-1).astype(np.float32)
+    vtx = vtx[::5]
+    colors = (color.reshape(-1, 3) / 255.0).astype(np.float32)
+    return vtx, colors
+
+
+def _measure(fn, repeats):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    ms = (time.perf_counter() - t0) * 1000 / repeats
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ms, peak / 1e6, out
+
+
+def benchmark(width=640, height=480, repeats=30, seed=0):
+    from frame_sources import default_intrinsics
+
+    rng = np.random.default_rng(seed)
+    intr = default_intrinsics(width, height)
+    depth = rng.integers(400, 2500, size=(height, width), dtype=np.uint16)
+    depth[rng.random(depth.shape) < 0.15] = 0  # holes like a real z16 frame
+    color = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    v, u = np.divmod(np.arange(height * width), width)
+    vtx = deproject_pixels(intr, u, v, depth.reshape(-1) * 0.001)
+    uv = np.stack([(u + 0.5) / width, (v + 0.5) / height], axis=1)
+    points = _ArrayPoints(vtx, uv)
+    boxes = np.array([[100, 100, 180, 180], [300, 200, 380, 290], [500, 50, 570, 120]])
+
+    cases = [
+        ("legacy stack + [::5]", lambda: _legacy_cloud(points, color)),
+        ("builder step=1", lambda: PointCloudBuilder(step=1).from_points(points, color, depth.shape)),
+        ("builder step=2", lambda: PointCloudBuilder(step=2).from_points(points, color, depth.shape)),
+        ("builder step=2 voxel 2cm", lambda: PointCloudBuilder(step=2, voxel=0.02).from_points(points, color, depth.shape)),
+        ("builder ROI (3 fruit)",
+         lambda: PointCloudBuilder(step=1, roi=True).from_points(points, color, depth.shape, boxes)),
+    ]
+    print(f"{'variant':<24} {'ms/frame':>9} {'peak MB':>8} {'points':>8} {'colors':>8}")
+    for name, fn in cases:
+        ms, peak, (pts, cols) = _measure(fn, repeats)
+        print(f"{name:<24} {ms:>9.2f} {peak:>8.1f} {len(pts):>8} {len(cols):>8}")
+    print("(legacy colors do not line up with its points; builder drops zero-depth pixels)")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,91 +1,163 @@
+import argparse
+
 import cv2
 import numpy as np
-import pyrealsense2 as rs
-from ultralytics import YOLO
+
+from annotate import Annotator, SplitCanvas
+from backends import add_backend_args, load_model, weights_from_args
+from depth_filters import DepthFilterChain, add_depth_filter_args
+from depth_sampling import sample_box_depths, sample_mask_depths
+from detection_log import add_log_args, recorder_from_args
+from detections import from_result
+from frame_pipeline import Pipeline
+from frame_sources import add_source_args, colorize_depth, depth_intrinsics, source_from_args
+from metrics import METRICS, Instrumentation, add_metrics_args
+from roi import add_roi_args, roi_from_args
+from scheduler import KeyframeScheduler
 
 # -----------------------------
-# Load YOLO model (segmentation enabled)
+# Command line: frame source (RealSense by default) and display
 # -----------------------------
-model = YOLO("best.pt")  # replace with your trained weights
+parser = add_source_args(argparse.ArgumentParser(description="YOLOv8 segmentation + RealSense depth"))
+parser.add_argument("--headless", action="store_true", help="Do not open a window (benchmarking)")
+parser.add_argument("--server", action="store_true", help="Use the persistent detection server")
+parser.add_argument("--adaptive", action="store_true",
+                    help="Detect on adaptive keyframes and track with optical flow in between")
+parser.add_argument("--max-interval", type=int, default=10, help="Longest keyframe interval with --adaptive")
+add_backend_args(parser)
+add_depth_filter_args(parser)
+add_roi_args(parser)
+add_metrics_args(parser)
+add_log_args(parser)
+args = parser.parse_args()
+if args.depth_roi and args.server:
+    parser.error("--depth-roi needs the local model; it cannot be combined with --server")
+instruments = Instrumentation.from_args(args)
+recorder = recorder_from_args(args)
 
 # -----------------------------
-# Configure Intel RealSense
+# Load YOLO model (segmentation enabled) or connect to the warm detection server
 # -----------------------------
-pipeline = rs.pipeline()
-config = rs.config()
-config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
+if args.server:
+    from detection_server import connect
+    client = connect(weights_from_args(args, "best.pt"), backend=args.backend)
+    names = client.names
+else:
+    model = load_model(weights_from_args(args, "best.pt"), args.backend, args.calib)  # replace with your trained weights
+    names = model.names
 
-pipeline.start(config)
-colorizer = rs.colorizer()
-align = rs.align(rs.stream.color)
+# Depth-gated ROI: only the working-volume regions of each frame go through the model
+roi = None if args.server else roi_from_args(args, model)
 
 # -----------------------------
-# Draw professional box function
+# Open the frame source (color + depth aligned to color)
 # -----------------------------
-def draw_box(img, x1, y1, x2, y2, label, conf, depth, color=(0, 255, 0)):
-    thickness = 2
-    cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
-    text = f"{label} {conf:.2f} {depth:.2f}m"
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = 0.6
-    font_thickness = 2
-    (w, h), _ = cv2.getTextSize(text, font, font_scale, font_thickness)
-    cv2.rectangle(img, (x1, y1 - h - 8), (x1 + w + 4, y1), color, -1)
-    cv2.putText(img, text, (x1 + 2, y1 - 4), font, font_scale, (255, 255, 255), font_thickness)
+source = source_from_args(args)
+depth_filters = DepthFilterChain.from_spec(args.depth_filters)
+try:
+    import pyrealsense2 as rs
+    colorizer = rs.colorizer()
+except ImportError:
+    colorizer = None
 
 # -----------------------------
-# Main loop
+# Annotation: cached label sprites drawn onto a reused split-screen canvas
 # -----------------------------
-try:
-    while True:
-        frames = pipeline.wait_for_frames()
-        aligned_frames = align.process(frames)
-        depth_frame = aligned_frames.get_depth_frame()
-        color_frame = aligned_frames.get_color_frame()
-        if not depth_frame or not color_frame:
-            continue
-
-        # Convert to numpy arrays
-        color_image = np.asanyarray(color_frame.get_data())
-        depth_colormap = np.asanyarray(colorizer.colorize(depth_frame).get_data())
-
-        # Brighten RGB camera view
-        color_image = cv2.convertScaleAbs(color_image, alpha=1.25, beta=20)
-
-        # -----------------------------
-        # Run YOLO segmentation
-        # -----------------------------
-        results = model(color_image, stream=True)  # stream=True enables segmentation overlays
-        for r in results:
-            # r.masks contains segmentation masks
-            # r.plot() draws both masks and boxes
-            annotated_frame = r.plot()
-
-            # Draw professional bounding boxes with depth
-            if hasattr(r, 'boxes') and r.boxes is not None:
-                for box in r.boxes:
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    label = model.names[cls]
-
-                    # Get depth at center
-                    cx = int((x1 + x2) / 2)
-                    cy = int((y1 + y2) / 2)
-                    depth = depth_frame.get_distance(cx, cy)
-
-                    draw_box(annotated_frame, x1, y1, x2, y2, label, conf, depth)
-
-        # -----------------------------
-        # Split screen: RGB with segmentation | Depth
-        # -----------------------------
-        combined = np.hstack((annotated_frame, depth_colormap))
-        cv2.imshow("YOLOv8 Segmentation + RealSense Depth", combined)
+annotator = Annotator(names)
+canvas = SplitCanvas()
+
+# -----------------------------
+# Capture: next aligned frame, depth post-processing + colorized depth
+# -----------------------------
+def capture():
+    frame = depth_filters.process(source.read())
+    if frame is None:
+        return None
+    with METRICS.timer("colorize"):
+        return frame, colorize_depth(frame, colorizer)
+
+# -----------------------------
+# Inference: YOLO segmentation + per-fruit depth
+# -----------------------------
+def detect(color_image, frame):
+    if args.server:
+        # Server replies carry boxes + mask polygons, not the mask tensor
+        return client.detect_frame(color_image), None
+    if roi is not None:
+        # Masks come back as polygons in frame coordinates; depth falls back to the boxes
+        return roi(color_image, frame.depth, frame.depth_scale), None
+    r = model(color_image)[0]  # r.masks contains segmentation masks
+    return from_result(r), r
+
+# Between keyframes the scheduler returns tracked detections and r = None
+scheduler = KeyframeScheduler(detect, max_interval=args.max_interval) if args.adaptive else None
+
+def infer(item):
+    frame, depth_colormap = item
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    # Brighten RGB camera view
+    color_image = cv2.convertScaleAbs(frame.color, alpha=1.25, beta=20)
 
+    if scheduler is not None:
+        det, r, _ = scheduler.step(color_image, frame)
+    else:
+        det, r = detect(color_image, frame)
+
+    depths = np.zeros(len(det.xyxy), dtype=np.float32)
+    sizes = xyz = None
+    with METRICS.timer("depth.lookup"):
+        if frame.depth is not None and r is not None and r.masks is not None:
+            # Median depth, 3D centroid and size over each fruit's mask in one batched pass
+            geometry = sample_mask_depths(r.masks.data, frame.depth, depth_intrinsics(frame), frame.depth_scale)
+            depths, sizes, xyz = geometry.depth, geometry.size, geometry.centroid
+        elif frame.depth is not None:
+            # Median depth inside every box in one batched call
+            depths = sample_box_depths(frame.depth, det.xyxy, frame.depth_scale,
+                                       image_shape=color_image.shape).median
+
+    # Persist detections, depths and 3D centroids (queued; written by a background thread)
+    if recorder is not None:
+        recorder.append(frame.index, frame.timestamp, det, depths, xyz, names=names)
+    return item, color_image, r, det, depths, sizes
+
+# -----------------------------
+# Render: split screen RGB with segmentation | Depth
+# -----------------------------
+def render(result):
+    item, color_image, r, det, depths, sizes = result
+    if args.headless:
+        return True  # no annotation or display work
+
+    # Masks (one blend) and labels with depth/size, straight onto the left half of the canvas
+    with METRICS.timer("draw"):
+        combined = canvas.compose(color_image, item[1])
+        labels = [f"{d:.2f}m" for d in depths]
+        if sizes is not None:
+            labels = [f"{label} ~{size * 100:.0f}cm" for label, size in zip(labels, sizes)]
+        annotator.draw(canvas.left, det, labels)
+        instruments.overlay(combined)
+
+    with METRICS.timer("imshow"):
+        cv2.imshow("YOLOv8 Segmentation + RealSense Depth", combined)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+# -----------------------------
+# Main loop: capture, inference and display run concurrently
+# -----------------------------
+stream = Pipeline(*instruments.wrap(capture, infer, render), report_every=5.0, drop_frames=not args.fast)
+try:
+    stream.run()
 finally:
-    pipeline.stop()
-    cv2.destroyAllWindows()
+    source.close()
+    if not args.headless:
+        cv2.destroyAllWindows()
+    stream.report()
+    depth_filters.report()
+    if roi is not None:
+        roi.report()
+    if scheduler is not None:
+        print("[scheduler]", {k: round(v, 2) for k, v in scheduler.stats().items()})
+    METRICS.report()
+    instruments.close()
+    if recorder is not None:
+        recorder.close()
@@ -0,0 +1,283 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from detections import from_dicts, to_dicts
+from metrics import METRICS
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fruitvision")
+
+
+# -----------------------------
+# Content hashes
+# -----------------------------
+def file_digest(path, chunk=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def bytes_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def array_digest(image):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}{image.dtype}".encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+def read_with_digest(path):
+    # One read serves both the cache key and the decode -> (digest, BGR image), (None, None) if unreadable
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None, None
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return bytes_digest(data), img
+
+
+_weights_digests = {}
+
+
+def weights_digest(path):
+    # Hash of the weights file (or exported model directory), memoized on size + mtime
+    # so a 50 MB checkpoint is only read once per process
+    if path.startswith("fake:"):
+        return bytes_digest(path.encode())  # backends.SimulatedModel: the spec is the model
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+    stamp = tuple((f, os.path.getsize(f), os.path.getmtime(f)) for f in files)
+    if stamp not in _weights_digests:
+        h = hashlib.blake2b(digest_size=16)
+        for f in files:
+            h.update(file_digest(f).encode())
+        _weights_digests[stamp] = h.hexdigest()
+    return _weights_digests[stamp]
+
+
+# Inference settings that change the detections, at ultralytics' predict() defaults
+MODEL_DEFAULTS = {"conf": 0.25, "iou": 0.7, "imgsz": 640}
+
+
+def cache_key(image_digest, weights, backend="torch", **params):
+    # The one place keys are built (image, batch, GUI, server): unset settings take the model
+    # defaults so a plain run and an explicit --conf 0.25 run share entries
+    params = dict(MODEL_DEFAULTS, **{k: v for k, v in params.items() if v is not None})
+    return ResultCache.key(image_digest, weights_digest(weights), backend=backend, **params)
+
+
+# -----------------------------
+# Two-tier result cache
+# -----------------------------
+class ResultCache:
+    """Detections keyed by image content + model weights + inference parameters.
+
+    A small in-memory LRU sits in front of a directory of JSON entries
+    (detections, class names, image shape) whose total size is kept under
+    max_bytes by evicting the least recently used files. Class names are
+    stored with each entry so a hit needs no model at all. Hits and misses
+    are counted here and in METRICS (cache.memory_hits, cache.disk_hits,
+    cache.misses).
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=256 << 20, memory_items=256):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._files = None  # path -> size, oldest first; scanned on first disk access
+        self._disk_bytes = 0
+
+    @staticmethod
+    def key(image_digest, model_digest, **params):
+        blob = json.dumps([image_digest, model_digest, params], sort_keys=True, default=str)
+        return bytes_digest(blob.encode())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _scan(self):
+        if self._files is not None:
+            return
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json"):
+                    p = os.path.join(root, name)
+                    try:
+                        st = os.stat(p)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, p, st.st_size))
+        self._files = OrderedDict((p, size) for _, p, size in sorted(entries))
+        self._disk_bytes = sum(self._files.values())
+
+    def _count(self, name):
+        self.counts[name] += 1
+        METRICS.count(f"cache.{name}")
+
+    def get(self, key):
+        # -> (Detections, names, shape) or None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._count("memory_hits")
+                return entry
+            self._scan()
+            path = self._path(key)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                os.utime(path)  # mtime doubles as last-use time for eviction
+            except (FileNotFoundError, ValueError):
+                self._count("misses")
+                return None
+            if path in self._files:
+                self._files.move_to_end(path)
+            names = {int(k): v for k, v in data["names"].items()}
+            entry = (from_dicts(data["detections"]), names, tuple(data["shape"]))
+            self._remember(key, entry)
+            self._count("disk_hits")
+            return entry
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def put(self, key, det, names, shape):
+        names = {int(k): v for k, v in dict(names).items()}
+        text = json.dumps({"detections": to_dicts(det, names, decimals=2), "names": names,
+                           "shape": list(shape), "created": time.time()})
+        path = self._path(key)
+        with self._lock:
+            self._remember(key, (det, names, tuple(shape)))
+            self._scan()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(text)
+            os.replace(tmp, path)
+            self._disk_bytes += len(text) - self._files.pop(path, 0)
+            self._files[path] = len(text)
+            self._evict()
+
+    def _evict(self):
+        while self._disk_bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.counts["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._scan()
+            for path in self._files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._files.clear()
+            self._memory.clear()
+            self._disk_bytes = 0
+
+    def stats(self):
+        lookups = self.counts["memory_hits"] + self.counts["disk_hits"] + self.counts["misses"]
+        hits = lookups - self.counts["misses"]
+        with self._lock:
+            self._scan()
+            entries, size = len(self._files), self._disk_bytes
+        return dict(self.counts, lookups=lookups, hit_rate=hits / lookups if lookups else 0.0,
+                    memory_entries=len(self._memory), disk_entries=entries, disk_bytes=size)
+
+    def report(self):
+        s = self.stats()
+        print(f"[cache] {s['lookups']} lookups  hit rate {s['hit_rate']:.0%} (memory {s['memory_hits']}, "
+              f"disk {s['disk_hits']})  {s['disk_entries']} entries / {s['disk_bytes'] / 1e6:.1f} MB on disk")
+
+
+def add_cache_args(parser):
+    parser.add_argument("--no-cache", action="store_true", help="Always run the model (skip the result cache)")
+    parser.add_argument("--cache-dir", default=DEFAULT_DIR, help="Where cached results are kept")
+    parser.add_argument("--cache-size-mb", type=float, default=256, help="Disk budget of the result cache")
+    return parser
+
+
+def cache_from_args(args):
+    return None if args.no_cache else ResultCache(args.cache_dir, int(args.cache_size_mb * (1 << 20)))
+
+
+# -----------------------------
+# Benchmark: model vs disk hit vs memory hit, each ending in an annotated image
+# -----------------------------
+def benchmark(paths, weights="best.pt"):
+    import tempfile
+    from backends import load_model
+    from detections import draw_detections, from_result
+
+    t0 = time.perf_counter()
+    model = load_model(weights)
+    load_ms = (time.perf_counter() - t0) * 1000
+    rows = {"model": [], "disk hit": [], "memory hit": []}
+    with tempfile.TemporaryDirectory(prefix="fruitcache-") as tmp:
+        cache = ResultCache(tmp)
+        for path in paths:
+            t0 = time.perf_counter()
+            digest, img = read_with_digest(path)
+            det = from_result(model(img, verbose=False)[0])
+            draw_detections(img.copy(), det, model.names)
+            rows["model"].append(time.perf_counter() - t0)
+            cache.put(cache_key(digest, weights), det, model.names, img.shape)
+        for name, fresh in (("disk hit", True), ("memory hit", False)):
+            if fresh:
+                cache = ResultCache(tmp)  # new process: only the disk tier is warm
+            for path in paths:
+                t0 = time.perf_counter()
+                digest, img = read_with_digest(path)
+                det, names, _ = cache.get(cache_key(digest, weights))
+                draw_detections(img.copy(), det, names)
+                rows[name].append(time.perf_counter() - t0)
+        size = cache.stats()["disk_bytes"]
+
+    print(f"{len(paths)} images, model load {load_ms:.0f}ms (skipped entirely when every image hits), "
+          f"{size / max(len(paths), 1) / 1e3:.1f} kB per entry")
+    print(f"{'path':<12} {'mean ms':>8} {'p95 ms':>8}  (read + detect/lookup + draw)")
+    for name, times in rows.items():
+        ms = np.array(times) * 1000
+        print(f"{name:<12} {ms.mean():>8.2f} {np.percentile(ms, 95):>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the detection result cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_DIR)
+    parser.add_argument("--clear", action="store_true")
+    parser.add_argument("--bench", nargs="+", metavar="IMAGE", help="Time cold inference vs cache hits on these images")
+    parser.add_argument("--weights", default="best.pt")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench, args.weights)
+    else:
+        cache = ResultCache(args.cache_dir)
+        if args.clear:
+            cache.clear()
+        s = cache.stats()
+        print(f"{args.cache_dir}: {s['disk_entries']} entries, {s['disk_bytes'] / 1e6:.1f} MB")
@@ -0,0 +1,307 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from detections import Detections, empty, from_result
+from frame_pipeline import StageStats
+from metrics import METRICS
+from tiling import box_overlap
+
+
+def _round_up(v, stride):
+    return int(-(-v // stride) * stride)
+
+
+# -----------------------------
+# Candidate regions from the aligned depth map
+# -----------------------------
+def merge_boxes(boxes, gap=0):
+    # Union of boxes that overlap (or come within `gap` px) until none do; boxes are (x0, y0, x1, y1)
+    boxes = [list(b) for b in boxes]
+    merged = True
+    while merged and len(boxes) > 1:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] - gap < b[2] and b[0] - gap < a[2] and a[1] - gap < b[3] and b[1] - gap < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(b) for b in boxes]
+
+
+def pack_regions(boxes, max_width, gap=8, stride=32):
+    # Shelf packing, tallest first -> canvas (h, w), multiples of stride, and each box's (px, py) on it
+    order = sorted(range(len(boxes)), key=lambda i: boxes[i][3] - boxes[i][1], reverse=True)
+    area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in boxes)
+    widest = max(b[2] - b[0] for b in boxes)
+    width = min(max(widest, int(np.sqrt(area * 1.3))), max_width)
+    places = [None] * len(boxes)
+    x = y = shelf = 0
+    used_w = 0
+    for i in order:
+        bw, bh = boxes[i][2] - boxes[i][0], boxes[i][3] - boxes[i][1]
+        if x and x + bw > width:
+            x, y, shelf = 0, y + shelf + gap, 0
+        places[i] = (x, y)
+        used_w = max(used_w, x + bw)
+        x += bw + gap
+        shelf = max(shelf, bh)
+    return (_round_up(y + shelf, stride), _round_up(used_w, stride)), places
+
+
+# -----------------------------
+# Depth-gated inference
+# -----------------------------
+class RoiDetector:
+    """Runs the model only on the parts of a frame inside the working volume.
+
+    The aligned depth map (every `step`-th pixel) is cut to [near, far]
+    meters; with far=None everything at least `margin` closer than the
+    background (median depth, e.g. the conveyor) counts. With motion=True
+    pixels that changed since the previous frame are added too, for fruit
+    whose depth has holes. Regions are padded, merged and packed at native
+    resolution onto one canvas (sides multiples of 32), so the model sees
+    fruit at the same scale as in the full frame and costs roughly the
+    canvas area. Frames without regions skip the model; when the canvas
+    would not be clearly smaller than the frame, the full frame is used.
+    Every `audit_every` packed frames the full frame is also run to measure
+    the real saving and the recall against full-frame inference.
+    """
+
+    def __init__(self, model, near=0.15, far=None, margin=0.02, motion=False, motion_thresh=25, pad=16,
+                 min_area=150, max_fill=0.7, step=4, gap=8, stride=32, audit_every=0, **params):
+        self.model = model
+        self.near = near
+        self.far = far
+        self.margin = margin
+        self.motion = motion
+        self.motion_thresh = motion_thresh
+        self.pad = pad
+        self.min_area = min_area
+        self.max_fill = max_fill
+        self.step = step
+        self.gap = gap
+        self.stride = stride
+        self.audit_every = audit_every
+        self.params = params
+        self._prev_gray = None
+        self._kernel = np.ones((3, 3), np.uint8)
+        self.gate = StageStats("gate", "roi.gate")
+        self.infer = StageStats("infer", "roi.infer")
+        self.counts = {"frames": 0, "skipped": 0, "packed": 0, "full": 0}
+        self.input_px = 0
+        self.full_px = 0
+        self.audit = {"frames": 0, "roi_s": 0.0, "full_s": 0.0, "full_dets": 0, "found": 0}
+        self.last = {}
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def regions(self, color, depth, depth_scale):
+        # -> list of (x0, y0, x1, y1) in color pixels
+        h, w = color.shape[:2]
+        s = self.step
+        z = depth[::s, ::s]
+        sy, sx = h / z.shape[0], w / z.shape[1]  # also covers decimated depth
+        valid = z > 0
+        lo = self.near / depth_scale
+        if self.far is not None:
+            hi = self.far / depth_scale
+        elif valid.any():
+            hi = float(np.median(z[valid])) - self.margin / depth_scale
+        else:
+            hi = 0
+        mask = (valid & (z >= lo) & (z <= hi)).astype(np.uint8)
+        if self.motion:
+            gray = cv2.cvtColor(cv2.resize(color, z.shape[::-1], interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+            if self._prev_gray is not None and self._prev_gray.shape == gray.shape:
+                mask |= (cv2.absdiff(gray, self._prev_gray) > self.motion_thresh).astype(np.uint8)
+            self._prev_gray = gray
+        # Speckle (single noisy depth samples) out, then components
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        boxes = []
+        for x, y, bw, bh, area in stats[1:]:
+            if area * sx * sy < self.min_area:
+                continue
+            boxes.append((max(int(x * sx) - self.pad, 0), max(int(y * sy) - self.pad, 0),
+                          min(int(np.ceil((x + bw) * sx)) + self.pad, w), min(int(np.ceil((y + bh) * sy)) + self.pad, h)))
+        return merge_boxes(boxes, self.gap)
+
+    def _run(self, image, **extra):
+        t0 = time.perf_counter()
+        r = self.model(image, verbose=False, **extra, **self.params)[0]
+        return r, time.perf_counter() - t0
+
+    def _unpack(self, det, boxes, places):
+        # Canvas detections back to frame coordinates; anything centred in the gaps is dropped
+        if not len(det.xyxy):
+            return det
+        centers = (det.xyxy[:, :2] + det.xyxy[:, 2:]) / 2
+        owner = np.full(len(det.xyxy), -1)
+        offsets = np.zeros((len(det.xyxy), 2), np.float32)
+        for k, ((x0, y0, x1, y1), (px, py)) in enumerate(zip(boxes, places)):
+            inside = ((centers[:, 0] >= px) & (centers[:, 0] < px + x1 - x0) &
+                      (centers[:, 1] >= py) & (centers[:, 1] < py + y1 - y0) & (owner < 0))
+            owner[inside] = k
+            offsets[inside] = (x0 - px, y0 - py)
+        keep = np.flatnonzero(owner >= 0)
+        xyxy = det.xyxy[keep] + np.tile(offsets[keep], 2)
+        lo = np.array([boxes[k][:2] for k in owner[keep]], np.float32).reshape(-1, 2)
+        hi = np.array([boxes[k][2:] for k in owner[keep]], np.float32).reshape(-1, 2)
+        xyxy = np.clip(xyxy, np.tile(lo, 2), np.tile(hi, 2))
+        polygons = None
+        if det.polygons is not None:
+            polygons = [np.clip(det.polygons[i] + offsets[i], lo[j], hi[j]) for j, i in enumerate(keep)]
+        return Detections(xyxy.astype(np.float32), det.conf[keep], det.cls[keep], polygons)
+
+    def __call__(self, color, depth, depth_scale):
+        h, w = color.shape[:2]
+        full_px = _round_up(h, self.stride) * _round_up(w, self.stride)
+        self.counts["frames"] += 1
+        self.full_px += full_px
+        if depth is None:
+            return self._full(color, full_px, 0)
+
+        t0 = time.perf_counter()
+        boxes = self.regions(color, depth, depth_scale)
+        if not boxes:
+            self.gate.add(time.perf_counter() - t0)
+            self.counts["skipped"] += 1
+            METRICS.count("roi.skipped")
+            self.last = {"mode": "skipped", "regions": 0, "input_px": 0}
+            return empty()
+        (ch, cw), places = pack_regions(boxes, _round_up(w, self.stride), self.gap, self.stride)
+        if ch * cw > self.max_fill * full_px:
+            self.gate.add(time.perf_counter() - t0)
+            return self._full(color, full_px, len(boxes))
+        canvas = np.full((ch, cw, 3), 114, np.uint8)  # YOLO's letterbox gray
+        for (x0, y0, x1, y1), (px, py) in zip(boxes, places):
+            canvas[py:py + y1 - y0, px:px + x1 - x0] = color[y0:y1, x0:x1]
+        self.gate.add(time.perf_counter() - t0)
+
+        r, dt = self._run(canvas, imgsz=(ch, cw))
+        self.infer.add(dt)
+        det = self._unpack(from_result(r), boxes, places)
+        self.counts["packed"] += 1
+        self.input_px += ch * cw
+        self.last = {"mode": "packed", "regions": len(boxes), "input_px": ch * cw, "canvas": (ch, cw)}
+        if self.audit_every and self.counts["packed"] % self.audit_every == 0:
+            self._audit(color, det, dt)
+        return det
+
+    def _full(self, color, full_px, regions):
+        r, dt = self._run(color)
+        self.infer.add(dt)
+        self.counts["full"] += 1
+        self.input_px += full_px
+        self.last = {"mode": "full", "regions": regions, "input_px": full_px}
+        return from_result(r)
+
+    def _audit(self, color, det, roi_s):
+        r, full_s = self._run(color)
+        ref = from_result(r)
+        found = 0
+        if len(ref.xyxy) and len(det.xyxy):
+            match = (box_overlap(ref.xyxy, det.xyxy) >= 0.5) & (ref.cls[:, None] == det.cls[None, :])
+            found = int(match.any(axis=1).sum())
+        a = self.audit
+        a["frames"] += 1
+        a["roi_s"] += roi_s
+        a["full_s"] += full_s
+        a["full_dets"] += len(ref.xyxy)
+        a["found"] += found
+
+    def summary(self):
+        c, a = self.counts, self.audit
+        out = dict(c, input_fraction=self.input_px / self.full_px if self.full_px else 1.0,
+                   gate_ms=self.gate.snapshot()["mean_ms"], infer_ms=self.infer.snapshot()["mean_ms"],
+                   # Skipped frames count as zero model time
+                   model_ms_per_frame=self.infer.total * 1000 / max(c["frames"], 1))
+        if a["frames"]:
+            out.update(audit_frames=a["frames"], audit_roi_ms=a["roi_s"] * 1000 / a["frames"],
+                       audit_full_ms=a["full_s"] * 1000 / a["frames"],
+                       audit_recall=a["found"] / a["full_dets"] if a["full_dets"] else 1.0)
+        METRICS.gauge("roi.input_fraction", out["input_fraction"])
+        return out
+
+    def report(self):
+        s = self.summary()
+        line = (f"[roi] {s['frames']} frames: {s['skipped']} skipped, {s['packed']} packed, {s['full']} full frame  "
+                f"model input {s['input_fraction']:.0%} of full-frame pixels (~{1 - s['input_fraction']:.0%} less compute)  "
+                f"gate {s['gate_ms']:.2f}ms  model {s['model_ms_per_frame']:.1f}ms/frame")
+        if "audit_frames" in s:
+            line += (f"  | audit {s['audit_frames']} frames: packed {s['audit_roi_ms']:.1f}ms vs full "
+                     f"{s['audit_full_ms']:.1f}ms, recall {s['audit_recall']:.2f}")
+        print(line)
+
+
+def add_roi_args(parser):
+    parser.add_argument("--depth-roi", action="store_true",
+                        help="Only run the model on regions inside the working volume (skip empty frames)")
+    parser.add_argument("--roi-range", metavar="NEAR:FAR",
+                        help="Working volume in meters (default: anything closer than the background)")
+    parser.add_argument("--roi-margin", type=float, default=0.02, help="Height above the background in meters")
+    parser.add_argument("--roi-motion", action="store_true", help="Also use frame differencing")
+    parser.add_argument("--roi-audit", type=int, default=0, metavar="N",
+                        help="Every N packed frames also run the full frame (measured saving and recall)")
+    return parser
+
+
+def roi_from_args(args, model):
+    if not args.depth_roi:
+        return None
+    near, far = 0.15, None
+    if args.roi_range:
+        near, far = (float(v) for v in args.roi_range.split(":"))
+    return RoiDetector(model, near, far, args.roi_margin, motion=args.roi_motion, audit_every=args.roi_audit)
+
+
+# -----------------------------
+# Benchmark: full frame vs depth-gated ROI on a synthetic belt
+# -----------------------------
+def benchmark(model, frames=200, fruits=(0, 2, 6, 12), motion=False):
+    from frame_sources import SyntheticSource
+
+    print(f"{'fruit':>5} {'full ms':>8} {'roi ms':>7} {'saved':>6} {'input':>6} {'skipped':>8} {'recall':>7}")
+    for n in fruits:
+        roi = RoiDetector(model, motion=motion)
+        full_s = roi_s = 0.0
+        ref_total = found = 0
+        for frame in SyntheticSource(n, frames, seed=3, realtime=False):
+            t0 = time.perf_counter()
+            ref = from_result(model(frame.color, verbose=False)[0])
+            t1 = time.perf_counter()
+            det = roi(frame.color, frame.depth, frame.depth_scale)
+            t2 = time.perf_counter()
+            full_s += t1 - t0
+            roi_s += t2 - t1
+            ref_total += len(ref.xyxy)
+            if len(ref.xyxy) and len(det.xyxy):
+                match = (box_overlap(ref.xyxy, det.xyxy) >= 0.5) & (ref.cls[:, None] == det.cls[None, :])
+                found += int(match.any(axis=1).sum())
+        s = roi.summary()
+        recall = found / ref_total if ref_total else 1.0
+        print(f"{n:>5} {full_s * 1000 / frames:>8.1f} {roi_s * 1000 / frames:>7.1f} {1 - roi_s / full_s:>6.0%} "
+              f"{s['input_fraction']:>6.0%} {s['skipped'] / frames:>8.0%} {recall:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-frame vs depth-gated ROI inference on synthetic belt frames")
+    parser.add_argument("--weights", default="best.pt")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--fruits", type=int, nargs="+", default=[0, 2, 6, 12])
+    parser.add_argument("--motion", action="store_true")
+    args = parser.parse_args()
+    from backends import FAKE_PREFIX, load_model
+    if args.weights.startswith(FAKE_PREFIX):
+        print("Simulated model: time saved is meaningful, recall is not (its detections ignore the image)")
+    benchmark(load_model(args.weights), args.frames, args.fruits, args.motion)
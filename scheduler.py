@@ -0,0 +1,148 @@
+import math
+import time
+
+import cv2
+import numpy as np
+
+from detections import Detections
+
+
+# -----------------------------
+# Detect on keyframes, track with optical flow in between
+# -----------------------------
+class KeyframeScheduler:
+    """Runs detect(image, *context) -> (Detections, payload) only on keyframes.
+
+    Between keyframes boxes and mask polygons are shifted by the median
+    Lucas-Kanade flow of a few points inside each box (one LK call for all
+    fruit). The keyframe interval adapts to motion (the fastest fruit's
+    median flow; the scene grid only when no fruit is tracked) and to the
+    inference budget: slow scenes stretch towards max_interval, fast ones
+    shrink towards min_interval, and it never drops below what is needed to
+    keep the amortized per-frame cost within frame_budget_ms.
+    """
+
+    def __init__(self, detect, min_interval=1, max_interval=10, frame_budget_ms=33.0,
+                 motion_low=0.5, motion_high=6.0, max_lost=0.3, scale=0.5, points_per_side=3):
+        self.detect = detect
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.frame_budget_ms = frame_budget_ms
+        self.motion_low = motion_low
+        self.motion_high = motion_high
+        self.max_lost = max_lost
+        self.scale = scale
+
+        # Fixed lattice of offsets inside each box (in box-relative units) and a global scene grid
+        t = (np.arange(points_per_side) + 0.5) / points_per_side * 0.6 + 0.2
+        gx, gy = np.meshgrid(t, t)
+        self._box_offsets = np.stack([gx.ravel(), gy.ravel()], axis=1).astype(np.float32)
+        self._k = len(self._box_offsets)
+
+        self.det = None
+        self.prev_gray = None
+        self.since_key = 0
+        self.interval = min_interval
+        self.force_key = True
+        self.detect_ms = 0.0
+        self.track_ms = 1.0
+        self.motion = 0.0
+        self.keyframes = 0
+        self.tracked = 0
+
+    def _gray(self, image):
+        small = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _scene_points(self, shape):
+        h, w = shape
+        ys, xs = np.mgrid[h * 0.1:h * 0.9:6j, w * 0.1:w * 0.9:8j]
+        return np.stack([xs.ravel(), ys.ravel()], axis=1).astype(np.float32)
+
+    def _next_interval(self):
+        # Motion: linear from max_interval (still) to min_interval (fast)
+        f = np.clip((self.motion - self.motion_low) / max(self.motion_high - self.motion_low, 1e-6), 0.0, 1.0)
+        by_motion = self.max_interval - f * (self.max_interval - self.min_interval)
+        # Budget: smallest k with (detect + (k - 1) * track) / k <= frame budget
+        spare = self.frame_budget_ms - self.track_ms
+        by_budget = math.ceil((self.detect_ms - self.track_ms) / spare) if spare > 0 else self.max_interval
+        return int(np.clip(max(round(by_motion), by_budget), self.min_interval, self.max_interval))
+
+    def _keyframe(self, image, gray, context=()):
+        t0 = time.perf_counter()
+        det, payload = self.detect(image, *context)
+        ms = (time.perf_counter() - t0) * 1000
+        self.detect_ms = ms if not self.keyframes else 0.8 * self.detect_ms + 0.2 * ms
+        self.det = det
+        self.prev_gray = gray
+        self.since_key = 0
+        self.force_key = False
+        self.keyframes += 1
+        return det, payload, True
+
+    def _track(self, gray):
+        t0 = time.perf_counter()
+        det = self.det
+        n = len(det.xyxy)
+        s = self.scale
+
+        # Points: k per box followed by the scene grid, all in one LK call
+        wh = det.xyxy[:, 2:] - det.xyxy[:, :2]
+        box_pts = (det.xyxy[:, None, :2] + wh[:, None, :] * self._box_offsets[None]).reshape(-1, 2) * s
+        scene_pts = self._scene_points(gray.shape)
+        pts = np.concatenate([box_pts, scene_pts]).astype(np.float32).reshape(-1, 1, 2)
+        new_pts, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, pts, None,
+                                                      winSize=(15, 15), maxLevel=2)
+        flow = (new_pts - pts).reshape(-1, 2) / s
+        ok = status.reshape(-1).astype(bool)
+
+        shift = np.zeros((n, 2), dtype=np.float32)
+        has = np.zeros(n, dtype=bool)
+        lost = 0.0
+        if n:
+            box_flow = np.where(ok[:n * self._k, None], flow[:n * self._k], np.nan).reshape(n, self._k, 2)
+            good = ~np.isnan(box_flow[:, :, 0])
+            has = good.any(axis=1)
+            shift[has] = np.nanmedian(box_flow[has], axis=1)
+            # A box is lost when fewer than half of its points were tracked
+            lost = 1.0 - (good.mean(axis=1) >= 0.5).mean()
+        if lost > self.max_lost:
+            self.force_key = True
+
+        # Motion (px/frame at full resolution): the fastest fruit, so one moving fruit in a still
+        # scene isn't outvoted by the background; the scene grid only when no fruit is tracked
+        if has.any():
+            self.motion = float(np.linalg.norm(shift[has], axis=1).max())
+        else:
+            scene_ok = ok[n * self._k:]
+            scene_flow = flow[n * self._k:][scene_ok]
+            self.motion = float(np.median(np.linalg.norm(scene_flow, axis=1))) if scene_ok.any() else self.motion_high
+
+        xyxy = det.xyxy + np.tile(shift, 2)
+        polygons = None
+        if det.polygons is not None:
+            polygons = [p + d for p, d in zip(det.polygons, shift)]
+        self.det = Detections(xyxy.astype(np.float32), det.conf, det.cls, polygons)
+        self.prev_gray = gray
+        self.since_key += 1
+        self.tracked += 1
+        ms = (time.perf_counter() - t0) * 1000
+        self.track_ms = 0.8 * self.track_ms + 0.2 * ms
+        return self.det, None, False
+
+    def step(self, image, *context):
+        # Returns (detections, payload or None, is_keyframe); context is passed on to detect (e.g. the frame)
+        gray = self._gray(image)
+        if self.det is None or self.force_key or self.since_key + 1 >= self.interval:
+            result = self._keyframe(image, gray, context)
+        else:
+            result = self._track(gray)
+        self.interval = self._next_interval()
+        return result
+
+    def stats(self):
+        total = self.keyframes + self.tracked
+        return {"keyframes": self.keyframes, "tracked": self.tracked,
+                "keyframe_ratio": self.keyframes / total if total else 0.0,
+                "interval": self.interval, "motion_px": self.motion,
+                "detect_ms": self.detect_ms, "track_ms": self.track_ms}
@@ -1,54 +1,58 @@
+import argparse
+
 import cv2
 from ultralytics import YOLO
 
+from annotate import Annotator, DrawCanvas
+from detection_log import add_log_args, recorder_from_args
+from detections import from_result
+from frame_pipeline import Pipeline
+from frame_sources import add_source_args, source_from_args
+from metrics import METRICS, Instrumentation, add_metrics_args
+
+parser = add_source_args(argparse.ArgumentParser(description="YOLOv8 segmentation on a webcam"), default="webcam:0")
+parser.add_argument("--headless", action="store_true", help="Do not open a window (benchmarking)")
+add_metrics_args(parser)
+add_log_args(parser)
+args = parser.parse_args()
+instruments = Instrumentation.from_args(args)
+recorder = recorder_from_args(args)
+
 model = YOLO("best.pt")
-cap = cv2.VideoCapture(0)
+annotator = Annotator(model.names)
+draw_canvas = DrawCanvas()  # ring frames are read-only shared memory
 
-if not cap.isOpened():
+try:
+    source = source_from_args(args)
+except RuntimeError:
     print("Error: Could not open camera.")
     exit()
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-    results = model(frame, stream=True)
-    for r in results:
-        annotated_frame = r.plot()
-    cv2.imshow("YOLOv8 Segmentation", annotated_frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
-Possible Improvements to Mention:
-
-Fine-Tuning the YOLO Model:
-
-If you retrained or fine-tuned the YOLO model on a specific dataset, especially for fruits or fruit bunches, mention how this fine-tuning has improved the detection performance.
-
-Data Augmentation:
-
-If you increased the variety of your training data using techniques like rotation, flipping, scaling, or adding noisy images, explain how this helped improve the model's ability to detect fruits in different conditions (e.g., bunches, varied lighting, etc.).
-
-Adjusting the Model's Hyperparameters:
-
-If you modified the confidence threshold, IOU (Intersection over Union) threshold, or the size of the images fed into the model, mention how this affected the detection accuracy.
-
-Post-processing Techniques:
-
-If you implemented post-processing steps like Non-Maximum Suppression (NMS) tuning to reduce false positives or combine overlapping detections, explain this and how it improved the results.
-
-Using Additional Sensors or Features:
-
-If you incorporated other sensors (e.g., depth sensors) alongside the vision model to improve detection accuracy in cluttered or overlapping situations, mention this.
-
-Optimizing for Speed or Efficiency:
-
-If you made the algorithm run faster or more efficiently (e.g., using a faster variant of YOLO like YOLO-Tiny or optimizing inference time), highlight these improvements.
-
-Example Answer:
-
-If you have worked on any of these aspects, here’s a possible response you can craft:
-
-# "To improve the baseline YOLO algorithm, I have fine-tuned the model by training it on a specific dataset containing fruits in various lighting and clustering scenarios. This helped the model to better detect fruits in bunches. Additionally, I adjusted the confidence threshold to detect smaller or less confident objects, and I tuned the Intersection over Union (IoU) threshold to help merge detections more accurately. Lastly, I employed data augmentation techniques to further improve the model's robustness, ensuring it can handle varying fruit shapes and orientations."
\ No newline at end of file
+def infer(frame):
+    det = from_result(model(frame.color)[0])
+    if recorder is not None:
+        recorder.append(frame.index, frame.timestamp, det, names=model.names)
+    return frame, det
+
+def render(result):
+    if args.headless:
+        return True
+    frame, det = result
+    with METRICS.timer("draw"):
+        img = instruments.overlay(annotator.draw(draw_canvas(frame.color), det))
+    with METRICS.timer("imshow"):
+        cv2.imshow("YOLOv8 Segmentation", img)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+stream = Pipeline(*instruments.wrap(source.read, infer, render), report_every=5.0, drop_frames=not args.fast)
+try:
+    stream.run()
+finally:
+    source.close()
+    if not args.headless:
+        cv2.destroyAllWindows()
+    stream.report()
+    METRICS.report()
+    instruments.close()
+    if recorder is not None:
+        recorder.close()
@@ -0,0 +1,319 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detections import Detections, empty, from_result
+
+
+# -----------------------------
+# Tile layout and empty-tile test
+# -----------------------------
+def tile_grid(width, height, tile=640, overlap=0.2):
+    # (x0, y0, x1, y1) windows of at most tile x tile covering the image; the last row/column is
+    # shifted back inside the image instead of being padded
+    stride = max(int(tile * (1 - overlap)), 1)
+
+    def starts(size):
+        if size <= tile:
+            return [0]
+        s = list(range(0, size - tile, stride))
+        return s + [size - tile]
+
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def is_background(tile_img, max_dev=30, thumb=64):
+    # Uniform tiles (empty crate floor, belt, sky): no thumbnail cell differs much from the
+    # tile's median color. The peak deviation, unlike the std, still catches a single small
+    # fruit on plain background. Costs well under a millisecond
+    small = cv2.resize(tile_img, (thumb, thumb), interpolation=cv2.INTER_AREA).reshape(-1, 3).astype(np.int16)
+    return int(np.abs(small - np.median(small, axis=0)).max()) < max_dev
+
+
+# -----------------------------
+# Merging duplicates from overlapping tiles
+# -----------------------------
+def box_overlap(a, b, metric="iou"):
+    # (N, 4) x (M, 4) -> (N, M); "ios" = intersection over the smaller box, which also
+    # matches a box cut off at a tile edge with the complete box from the neighbouring tile
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)[:, None]
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)[None, :]
+    if metric == "ios":
+        return inter / np.maximum(np.minimum(area_a, area_b), 1e-6)
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def _clusters(det, thresh, metric):
+    # Greedy, class-aware: each box joins the highest-confidence kept box it overlaps
+    order = np.argsort(-det.conf, kind="stable")
+    xyxy, cls = det.xyxy[order], det.cls[order]
+    overlap = box_overlap(xyxy, xyxy, metric) >= thresh
+    overlap &= cls[:, None] == cls[None, :]
+    assigned = np.full(len(order), -1)
+    groups = []
+    for i in range(len(order)):
+        if assigned[i] >= 0:
+            continue
+        members = np.flatnonzero(overlap[i] & (assigned < 0))
+        assigned[members] = len(groups)
+        groups.append(order[members])  # members[0] == i, the highest confidence
+    return groups
+
+
+def merge_detections(det, method="nms", thresh=0.5, metric="ios"):
+    """Merge duplicates from overlapping tiles (and the full-image pass).
+
+    nms keeps the most confident box of each cluster; wbf replaces it with
+    the confidence-weighted average of the cluster's boxes. The polygon of
+    the most confident member is kept either way.
+    """
+    if len(det.xyxy) < 2:
+        return det
+    groups = _clusters(det, thresh, metric)
+    keep = np.array([g[0] for g in groups])
+    xyxy = det.xyxy[keep].copy()
+    conf = det.conf[keep].copy()
+    if method == "wbf":
+        for j, g in enumerate(groups):
+            w = det.conf[g]
+            xyxy[j] = (det.xyxy[g] * w[:, None]).sum(axis=0) / w.sum()
+            conf[j] = w.mean()
+    polygons = [det.polygons[i] for i in keep] if det.polygons is not None else None
+    return Detections(xyxy, conf, det.cls[keep], polygons)
+
+
+def concat_detections(parts):
+    parts = [d for d in parts if len(d.xyxy)]
+    if not parts:
+        return empty()
+    polygons = None
+    if all(d.polygons is not None for d in parts):
+        polygons = [p for d in parts for p in d.polygons]
+    return Detections(np.concatenate([d.xyxy for d in parts]), np.concatenate([d.conf for d in parts]),
+                      np.concatenate([d.cls for d in parts]), polygons)
+
+
+def shift_detections(det, dx, dy):
+    offset = np.array([dx, dy], dtype=np.float32)
+    polygons = [p + offset for p in det.polygons] if det.polygons is not None else None
+    return Detections(det.xyxy + np.tile(offset, 2), det.conf, det.cls, polygons)
+
+
+# -----------------------------
+# Sliced inference
+# -----------------------------
+class SlicedDetector:
+    """Detects small objects in large images by running the model on overlapping tiles.
+
+    model is an ultralytics model (tiles go through it in batches of
+    `batch`) or a MicroBatcher, which spreads tiles over its worker models
+    and runs them with the params it was created with (sliced_from_args
+    passes the same ones to both); close() shuts such a batcher down.
+    Tiles that look like plain background are skipped. With full_image the
+    downscaled whole image is also run so objects larger than a tile are
+    still found. Images no larger than one tile go straight to the model.
+    """
+
+    def __init__(self, model, tile=640, overlap=0.2, batch=8, merge="nms", merge_thresh=0.5,
+                 metric="ios", skip_empty=True, max_dev=30, full_image=True, **params):
+        self.model = model
+        self.tile = tile
+        self.overlap = overlap
+        self.batch = batch
+        self.merge = merge
+        self.merge_thresh = merge_thresh
+        self.metric = metric
+        self.skip_empty = skip_empty
+        self.max_dev = max_dev
+        self.full_image = full_image
+        self.params = params
+        self.last = {}
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def close(self):
+        if hasattr(self.model, "submit"):
+            self.model.close()
+
+    def _run(self, images):
+        if hasattr(self.model, "submit"):
+            futures = [self.model.submit(img) for img in images]
+            return [f.result() for f in futures]
+        results = []
+        for i in range(0, len(images), self.batch):
+            results += list(self.model(images[i:i + self.batch], verbose=False, **self.params))
+        return results
+
+    def __call__(self, img):
+        h, w = img.shape[:2]
+        t0 = time.perf_counter()
+        windows = tile_grid(w, h, self.tile, self.overlap)
+        if len(windows) == 1:
+            det = from_result(self._run([img])[0])
+            self.last = {"tiles": 1, "skipped": 0, "ms": (time.perf_counter() - t0) * 1000}
+            return det
+        crops, offsets = [], []
+        for x0, y0, x1, y1 in windows:
+            crop = img[y0:y1, x0:x1]
+            if self.skip_empty and is_background(crop, self.max_dev):
+                continue
+            crops.append(crop)  # views, no copies
+            offsets.append((x0, y0))
+        images = crops + ([img] if self.full_image else [])
+        t1 = time.perf_counter()
+        results = self._run(images) if images else []
+        t2 = time.perf_counter()
+        parts = [shift_detections(from_result(r), x0, y0) for r, (x0, y0) in zip(results, offsets)]
+        if self.full_image and results:
+            parts.append(from_result(results[-1]))
+        det = concat_detections(parts)
+        raw = len(det.xyxy)
+        det = merge_detections(det, self.merge, self.merge_thresh, self.metric)
+        t3 = time.perf_counter()
+        self.last = {"tiles": len(windows), "skipped": len(windows) - len(crops), "raw": raw,
+                     "detections": len(det.xyxy), "slice_ms": (t1 - t0) * 1000, "infer_ms": (t2 - t1) * 1000,
+                     "merge_ms": (t3 - t2) * 1000, "ms": (t3 - t0) * 1000}
+        return det
+
+
+def add_tiling_args(parser):
+    parser.add_argument("--tiles", action="store_true", help="Sliced inference for large images (small fruit)")
+    parser.add_argument("--tile-size", type=int, default=640)
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="Overlap between neighbouring tiles")
+    parser.add_argument("--tile-merge", choices=("nms", "wbf"), default="nms", help="How duplicates are merged")
+    parser.add_argument("--tile-workers", type=int, default=1, help="Model copies running tiles in parallel")
+    parser.add_argument("--keep-empty-tiles", action="store_true", help="Do not skip plain background tiles")
+    return parser
+
+
+def sliced_from_args(args, model, load=None, **params):
+    # With --tile-workers > 1, `load()` makes the extra model copies fed by a MicroBatcher
+    # (call close() on the result when done). params (conf, imgsz, ...) reach the model either way
+    if args.tile_workers > 1 and load is not None:
+        from batcher import MicroBatcher
+        model = MicroBatcher([model] + [load() for _ in range(args.tile_workers - 1)], max_batch=8, **params)
+    return SlicedDetector(model, args.tile_size, args.tile_overlap, merge=args.tile_merge,
+                          skip_empty=not args.keep_empty_tiles, **params)
+
+
+# -----------------------------
+# Benchmark: whole image vs tiles, time and recall against labels
+# -----------------------------
+def _read_labels(image_path, shape):
+    # YOLO txt labels next to the image or in a sibling labels/ folder (Roboflow export layout)
+    stem = os.path.splitext(image_path)[0]
+    candidates = [stem + ".txt", stem.replace(os.sep + "images" + os.sep, os.sep + "labels" + os.sep) + ".txt"]
+    for path in candidates:
+        if os.path.exists(path):
+            rows = np.loadtxt(path, ndmin=2)
+            if not rows.size:
+                return np.zeros((0, 4), np.float32), np.zeros(0, int)
+            h, w = shape[:2]
+            xy = rows[:, 1:3] * (w, h)
+            if rows.shape[1] > 5:  # segmentation labels: polygon -> box
+                pts = rows[:, 1:].reshape(len(rows), -1, 2) * (w, h)
+                boxes = np.concatenate([pts.min(axis=1), pts.max(axis=1)], axis=1)
+            else:
+                wh = rows[:, 3:5] * (w, h)
+                boxes = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+            return boxes.astype(np.float32), rows[:, 0].astype(int)
+    return None
+
+
+def _match(det, boxes, cls, iou=0.5):
+    # Greedy one-to-one matching -> (true positives, detections, ground truth)
+    if not len(det.xyxy) or not len(boxes):
+        return 0, len(det.xyxy), len(boxes)
+    ov = box_overlap(det.xyxy, boxes, "iou") * (det.cls[:, None] == cls[None, :])
+    tp, used = 0, np.zeros(len(boxes), bool)
+    for i in np.argsort(-det.conf):
+        j = np.argmax(np.where(used, -1, ov[i]))
+        if ov[i, j] >= iou and not used[j]:
+            used[j] = True
+            tp += 1
+    return tp, len(det.xyxy), len(boxes)
+
+
+def synthetic_crates(out_dir, count=4, width=3840, height=2160, fruit=120, seed=0):
+    # 4K frames with a plain background, a textured crate area and small strawberries + YOLO labels
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for k in range(count):
+        img = np.full((height, width, 3), (70, 80, 90), np.uint8)
+        cx0, cy0, cx1, cy1 = width // 6, height // 5, width * 5 // 6, height * 4 // 5
+        crate = rng.integers(90, 150, ((cy1 - cy0) // 8, (cx1 - cx0) // 8, 1)).astype(np.uint8)
+        img[cy0:cy1, cx0:cx1] = cv2.resize(np.repeat(crate, 3, axis=2), (cx1 - cx0, cy1 - cy0))
+        lines = []
+        for _ in range(fruit):
+            r = int(rng.uniform(6, 18))
+            x, y = int(rng.uniform(cx0 + r, cx1 - r)), int(rng.uniform(cy0 + r, cy1 - r))
+            cv2.circle(img, (x, y), r, (40, 30, 210), -1)
+            lines.append(f"4 {x / width:.6f} {y / height:.6f} {2 * r / width:.6f} {2 * r / height:.6f}")
+        name = os.path.join(out_dir, f"crate_{k:02d}")
+        cv2.imwrite(name + ".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        with open(name + ".txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+    return sorted(glob.glob(os.path.join(out_dir, "*.jpg")))
+
+
+def benchmark(paths, model, tile=640, overlap=0.2):
+    modes = [("whole image", None),
+             ("tiles", SlicedDetector(model, tile, overlap, skip_empty=False, full_image=False)),
+             ("tiles + skip empty", SlicedDetector(model, tile, overlap, full_image=False)),
+             ("tiles + skip + full", SlicedDetector(model, tile, overlap)),
+             ("tiles + skip, WBF", SlicedDetector(model, tile, overlap, merge="wbf", full_image=False))]
+    print(f"{'mode':<20} {'ms/img':>8} {'tiles':>6} {'skipped':>8} {'dets':>6} {'recall':>7} {'precision':>10}")
+    images = [(p, cv2.imread(p)) for p in paths]
+    model(images[0][1], verbose=False)  # warm-up
+    for name, sliced in modes:
+        tp = nd = ng = tiles = skipped = 0
+        labelled = True
+        t0 = time.perf_counter()
+        for path, img in images:
+            if sliced is None:
+                det, info = from_result(model(img, verbose=False)[0]), {"tiles": 1, "skipped": 0}
+            else:
+                det, info = sliced(img), sliced.last
+            tiles += info["tiles"]
+            skipped += info["skipped"]
+            labels = _read_labels(path, img.shape)
+            if labels is None:
+                labelled = False
+                nd += len(det.xyxy)
+                continue
+            a, b, c = _match(det, *labels)
+            tp, nd, ng = tp + a, nd + b, ng + c
+        ms = (time.perf_counter() - t0) * 1000 / len(images)
+        recall = f"{tp / max(ng, 1):.2f}" if labelled else "n/a"
+        precision = f"{tp / max(nd, 1):.2f}" if labelled else "n/a"
+        print(f"{name:<20} {ms:>8.1f} {tiles:>6} {skipped:>8} {nd:>6} {recall:>7} {precision:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Whole-image vs sliced inference: time and recall")
+    parser.add_argument("images", nargs="*", help="Images (YOLO .txt labels next to them or in ../labels)")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N", help="Generate N labelled 4K crate images")
+    parser.add_argument("--weights", default="best.pt")
+    parser.add_argument("--tile-size", type=int, default=640)
+    parser.add_argument("--tile-overlap", type=float, default=0.2)
+    args = parser.parse_args()
+
+    from backends import FAKE_PREFIX, load_model
+    paths = list(args.images)
+    if args.synthetic:
+        import tempfile
+        paths += synthetic_crates(os.path.join(tempfile.gettempdir(), "fruitvision_crates"), args.synthetic)
+    if not paths:
+        parser.error("give images or --synthetic N")
+    if args.weights.startswith(FAKE_PREFIX):
+        print("Simulated model: timings only, its detections ignore the image so recall/precision mean nothing")
+    benchmark(paths, load_model(args.weights), args.tile_size, args.tile_overlap)
@@ -1,77 +1,111 @@
+import argparse
+
 import cv2
-import numpy as np
-import pyrealsense2 as rs
-from ultralytics import YOLO  # Make sure you installed ultralytics: pip install ultralytics
+
+from annotate import Annotator, DrawCanvas
+from backends import add_backend_args, load_model, weights_from_args
+from batcher import MicroBatcher, add_batch_args
+from depth_filters import DepthFilterChain, add_depth_filter_args
+from depth_sampling import sample_box_depths
+from detections import from_result
+from frame_pipeline import Pipeline
+from frame_sources import add_source_args, source_from_args
+from metrics import METRICS, Instrumentation, add_metrics_args
 
 # -----------------------------
-# Load your trained YOLO model
+# Command line: frame source (RealSense by default) and display
 # -----------------------------
-model = YOLO("best.pt")   # replace "best.pt" with the path to your trained YOLO weights
+parser = add_source_args(argparse.ArgumentParser(description="YOLO + RealSense depth"))
+parser.add_argument("--headless", action="store_true", help="Do not open a window (benchmarking)")
+parser.add_argument("--server", action="store_true", help="Use the persistent detection server")
+add_backend_args(parser)
+add_batch_args(parser)
+add_depth_filter_args(parser)
+add_metrics_args(parser)
+args = parser.parse_args()
+instruments = Instrumentation.from_args(args)
 
 # -----------------------------
-# Configure Intel RealSense
+# Load your trained YOLO model (or connect to the warm detection server)
 # -----------------------------
-pipeline = rs.pipeline()
-config = rs.config()
+if args.server:
+    from detection_server import connect
+    client = connect(weights_from_args(args, "best.pt"), backend=args.backend)
+    names = client.names
+else:
+    # Make sure you installed ultralytics: pip install ultralytics
+    model = load_model(weights_from_args(args, "best.pt"), args.backend, args.calib)   # replace "best.pt" with the path to your trained YOLO weights
+    names = model.names
 
-# Enable RGB + Depth streams
-config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
+# With --max-batch > 1 consecutive frames are in flight together and share one forward pass
+batcher = None
+if args.max_batch > 1 and not args.server:
+    batcher = MicroBatcher(model, args.max_batch, args.max_wait_ms)
 
-# Start the pipeline
-pipeline.start(config)
-
-try:
-    while True:
-        # Wait for a new set of frames
-        frames = pipeline.wait_for_frames()
-        depth_frame = frames.get_depth_frame()
-        color_frame = frames.get_color_frame()
-        if not depth_frame or not color_frame:
-            continue
+annotator = Annotator(names)
+draw_canvas = DrawCanvas()  # ring frames are read-only shared memory
 
-        # Convert frames to numpy arrays
-        depth_image = np.asanyarray(depth_frame.get_data())
-        color_image = np.asanyarray(color_frame.get_data())
-
-        # -----------------------------
-        # Run YOLO inference on RGB
-        # -----------------------------
-        results = model(color_image, verbose=False)
-
-        # Get detection results
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                # Bounding box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
+# -----------------------------
+# Open the frame source (RGB + aligned depth)
+# -----------------------------
+source = source_from_args(args)
+depth_filters = DepthFilterChain.from_spec(args.depth_filters)
 
-                # Class + confidence
-                cls = int(box.cls[0])
-                label = model.names[cls]
-                conf = float(box.conf[0])
+# -----------------------------
+# Capture / inference / render stages
+# -----------------------------
+def capture():
+    return depth_filters.process(source.read())
 
-                # Center point for depth lookup
-                cx = int((x1 + x2) / 2)
-                cy = int((y1 + y2) / 2)
+def infer(frame):
+    # Run YOLO inference on RGB
+    if args.server:
+        det = client.detect_frame(frame.color)
+    elif batcher is not None:
+        det = from_result(batcher.infer(frame.color))
+    else:
+        det = from_result(model(frame.color, verbose=False)[0])
 
-                # Get depth (in meters) at center
-                depth = depth_frame.get_distance(cx, cy)
+    # Median depth (in meters) inside every box in one batched call
+    depths = None
+    if frame.depth is not None:
+        with METRICS.timer("depth.lookup"):
+            depths = sample_box_depths(frame.depth, det.xyxy, frame.depth_scale,
+                                       image_shape=frame.color.shape).median
+    return frame, det, depths
 
-                # Draw bounding box + label
-                cv2.rectangle(color_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(color_image, f"{label} {conf:.2f} {depth:.2f}m",
-                            (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6,
-                            (0, 255, 0), 2)
+def render(result):
+    frame, det, depths = result
+    if args.headless:
+        return True  # no annotation or display work
 
-        # Show the result
-        cv2.imshow("YOLO + RealSense", color_image)
+    # Boxes + class/confidence/depth labels from cached sprites
+    with METRICS.timer("draw"):
+        labels = [f"{d:.2f}m" for d in depths] if depths is not None else None
+        img = draw_canvas(frame.color)
+        annotator.boxes(img, det, labels)
+        instruments.overlay(img)
 
-        # Exit on 'q'
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    # Show the result, exit on 'q'
+    with METRICS.timer("imshow"):
+        cv2.imshow("YOLO + RealSense", img)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
 
+# -----------------------------
+# Main loop: capture, inference and display run concurrently
+# -----------------------------
+stream = Pipeline(*instruments.wrap(capture, infer, render), report_every=5.0, drop_frames=not args.fast,
+                  infer_workers=batcher.max_batch if batcher else 1)
+try:
+    stream.run()
 finally:
-    pipeline.stop()
-    cv2.destroyAllWindows()
+    source.close()
+    if not args.headless:
+        cv2.destroyAllWindows()
+    stream.report()
+    depth_filters.report()
+    if batcher is not None:
+        batcher.report()
+        batcher.close()
+    METRICS.report()
+    instruments.close()